@@ -0,0 +1,71 @@
+#! /usr/bin/env python
+# Replays synthetic context update notifications against a large contexts tree.
+#
+#   QT_QPA_PLATFORM=offscreen python benchmarks/context_updates.py --contexts 50000 --updates 100000
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from PyQt5 import QtWidgets
+from telepat.transportnotification import NOTIFICATION_TYPE_UPDATED, NOTIFICATION_TYPE_DELETED
+from event import TelepatContextUpdateEvent
+from models.context import Context
+from models.model import Model
+
+
+class FakeNotification(object):
+    def __init__(self, notification_type):
+        self.notification_type = notification_type
+        self.path = "name"
+        self.value = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay context notifications against a large contexts tree")
+    parser.add_argument("--contexts", type=int, default=50000)
+    parser.add_argument("--models", type=int, default=30)
+    parser.add_argument("--updates", type=int, default=100000)
+    parser.add_argument("--deletes", type=int, default=1000)
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication(sys.argv)
+    from telepatmanager import TelepatManager
+    win = TelepatManager()
+
+    contexts = [Context({"id": "ctx{0}".format(i), "name": "Context {0}".format(i)}) for i in range(args.contexts)]
+    schema = {"model{0}".format(i): Model({"properties": {}}) for i in range(args.models)}
+
+    start = time.perf_counter()
+    win.contexts_model.set_contexts(contexts, schema)
+    app.processEvents()
+    print("refresh: {0} contexts in {1:.3f}s".format(args.contexts, time.perf_counter() - start))
+
+    updated = FakeNotification(NOTIFICATION_TYPE_UPDATED)
+    events = []
+    for i in range(args.updates):
+        context_id = "ctx{0}".format(random.randrange(args.contexts))
+        events.append(TelepatContextUpdateEvent(Context({"id": context_id, "name": "Renamed {0}".format(i)}), updated))
+
+    start = time.perf_counter()
+    for event in events:
+        win.process_context_update_event(event)
+    elapsed = time.perf_counter() - start
+    print("updates: {0} in {1:.3f}s ({2:.1f} us/update)".format(args.updates, elapsed, elapsed / args.updates * 1e6))
+
+    deleted = FakeNotification(NOTIFICATION_TYPE_DELETED)
+    ids = random.sample(range(args.contexts), min(args.deletes, args.contexts))
+    start = time.perf_counter()
+    for i in ids:
+        win.process_context_update_event(TelepatContextUpdateEvent(Context({"id": "ctx{0}".format(i)}), deleted))
+    elapsed = time.perf_counter() - start
+    print("deletes: {0} in {1:.3f}s, {2} contexts left".format(len(ids), elapsed, win.contexts_model.rowCount()))
+
+
+if __name__ == "__main__":
+    main()
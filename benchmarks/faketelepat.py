@@ -0,0 +1,204 @@
+# A local stand-in for the Telepat client, serving a synthetic application
+# from memory. It answers the calls the workers make with responses shaped
+# like the real ones, optionally after a simulated network latency, and can
+# replay socket notifications at a fixed rate.
+import random
+import threading
+import time
+
+from telepat import TelepatResponse
+from telepat.channel import TelepatChannel
+from telepat.transportnotification import NOTIFICATION_TYPE_UPDATED
+
+
+class FakeResponse(TelepatResponse):
+    # Typed like the real one for the workers' signals, without a request
+    def __init__(self, content, status=200, message=""):
+        self.status = self.status_code = status
+        self.content = content
+        self.message = message
+
+    def json(self):
+        return {"status": self.status, "content": self.content, "message": self.message}
+
+    def getObjectOfType(self, object_type):
+        if isinstance(self.content, list):
+            return [self.wrap(item, object_type) for item in self.content]
+        return self.wrap(self.content, object_type)
+
+    def wrap(self, item, object_type):
+        # Applications are already built with their schema models
+        return item if isinstance(item, FakeApplication) else object_type(item)
+
+
+class FakeChannel(TelepatChannel):
+    def __init__(self, telepat, context, model_name):
+        # The real channel talks to the server, this one only keeps callbacks
+        self.telepat = telepat
+        self.context = context
+        self.model_name = model_name
+        self.on_add_object = None
+        self.on_update_object = None
+        self.on_delete_object = None
+
+    def subscription_identifier(self):
+        return "blg:{0}:context:{1}:{2}".format(self.telepat.app_id, self.context.id, self.model_name)
+
+    def patch(self, obj):
+        self.telepat.wait()
+        return FakeResponse({"id": obj.id})
+
+    def add_object(self, obj):
+        self.telepat.wait()
+        if self.telepat.failure_rate and random.random() < self.telepat.failure_rate:
+            return FakeResponse({}, 503, "Service unavailable")
+        self.telepat.created.append(obj.to_json())
+        return FakeResponse({}, 202, "Created")
+
+    def unsubscribe(self):
+        return FakeResponse({})
+
+
+class FakeApplication(dict):
+    # Applications are indexed (app["id"]) and read as attributes (app.schema)
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class Dataset(object):
+    def __init__(self, contexts=1000, models=10, objects=1000, users=1000, fields=10, seed=0):
+        rnd = random.Random(seed)
+        self.app_id = "bench-app"
+        self.model_names = ["model{0}".format(i) for i in range(models)]
+        self.schema = {name: {"properties": {"field{0}".format(f): {"type": "string"} for f in range(fields)}}
+                       for name in self.model_names}
+        self.contexts = [self.context(i, fields, rnd) for i in range(contexts)]
+        self.users = [{"id": "user{0}".format(i), "username": "user{0}@example.com".format(i), "name": "User {0}".format(i)}
+                      for i in range(users)]
+        self.objects_per_model = objects
+        self.fields = fields
+        self.seed = seed
+
+    def context(self, i, fields, rnd):
+        context = {"id": "ctx{0}".format(i), "name": "Context {0}".format(i), "type": "context",
+                   "application_id": self.app_id, "modified": 1, "state": rnd.randrange(3)}
+        for f in range(fields):
+            context["meta{0}".format(f)] = "value {0}".format(rnd.randrange(100000))
+        return context
+
+    def objects(self, context_id, model_name):
+        # Generated on demand, the same arguments always give the same objects
+        rnd = random.Random("{0}/{1}/{2}".format(self.seed, context_id, model_name))
+        objects = []
+        for i in range(self.objects_per_model):
+            obj = {"id": "{0}-{1}".format(model_name, i), "type": model_name, "model": model_name,
+                   "context_id": context_id, "application_id": self.app_id, "modified": 1,
+                   "count": rnd.randrange(1000000)}
+            for f in range(self.fields):
+                obj["field{0}".format(f)] = "text {0} {1}".format(rnd.randrange(100000), rnd.choice(("alpha", "beta", "gamma")))
+            objects.append(obj)
+        return objects
+
+    def application(self):
+        from models.model import Model
+        return FakeApplication(id=self.app_id, name="Benchmark", keys=["bench-key"],
+                               schema={name: Model(model) for name, model in self.schema.items()})
+
+
+class FakeTelepat(object):
+    def __init__(self, dataset, latency=0.0):
+        self.dataset = dataset
+        self.latency = latency
+        self.app_id = dataset.app_id
+        self.api_key = "bench-key"
+        self.device_id = "bench-device"
+        self.on_update_context = None
+        self.on_add_context = None
+        self.on_delete_context = None
+        self.requests = 0
+        # Share of creates answered with a 503, and the created objects
+        self.failure_rate = 0.0
+        self.created = []
+
+    def wait(self):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def login_admin(self, username, password):
+        self.wait()
+        return FakeResponse({"token": "bench-token"})
+
+    def disconnect(self):
+        pass
+
+    def register_device(self, update=False):
+        self.wait()
+        return FakeResponse({"identifier": self.device_id})
+
+    def get_apps(self):
+        self.wait()
+        return FakeResponse([self.dataset.application()])
+
+    def get_all(self):
+        self.wait()
+        return FakeResponse(self.dataset.contexts)
+
+    def get_schema(self):
+        self.wait()
+        return FakeResponse(self.dataset.schema)
+
+    def get_users(self, offset=0, limit=None):
+        self.wait()
+        end = offset + limit if limit is not None else None
+        return FakeResponse(self.dataset.users[offset:end])
+
+    def subscribe(self, context, model_name, object_type=None):
+        self.wait()
+        return FakeChannel(self, context, model_name), FakeResponse(self.dataset.objects(context.id, model_name))
+
+    def remove_subscription(self, channel):
+        self.wait()
+        return FakeResponse({})
+
+    def update_context(self, context):
+        self.wait()
+        return FakeResponse({})
+
+
+class FakeNotification(object):
+    def __init__(self, notification_type, path, value=None):
+        self.notification_type = notification_type
+        self.path = path
+        self.value = value
+
+
+class NotificationSource(threading.Thread):
+    # Plays the socket thread, calling on_update_context for random contexts.
+    # A rate of 0 sends everything as fast as possible.
+    def __init__(self, telepat, context_type, count, rate=0, seed=0):
+        super(NotificationSource, self).__init__(daemon=True)
+        self.telepat = telepat
+        self.context_type = context_type
+        self.count = count
+        self.rate = rate
+        self.rnd = random.Random(seed)
+        self.sent = 0
+
+    def run(self):
+        contexts = self.telepat.dataset.contexts
+        start = time.perf_counter()
+        for i in range(self.count):
+            if self.rate:
+                delay = start + i / self.rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            context = dict(self.rnd.choice(contexts))
+            context["name"] = "Renamed {0}".format(i)
+            context["modified"] = i + 2
+            self.telepat.on_update_context(self.context_type(context),
+                                           FakeNotification(NOTIFICATION_TYPE_UPDATED, "name", context["name"]))
+            self.sent += 1
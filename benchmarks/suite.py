@@ -0,0 +1,233 @@
+#! /usr/bin/env python
+# Headless benchmark suite running the real windows and models against a
+# synthetic application served by benchmarks/faketelepat.py. Results are
+# written as JSON so runs on different commits can be compared.
+#
+#   python benchmarks/suite.py --contexts 20000 --objects 50000 --output before.json
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+# Settings and snapshots of a run never touch the user's own
+os.environ["XDG_CONFIG_HOME"] = tempfile.mkdtemp(prefix="tmbench-")
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from PyQt5 import QtCore, QtWidgets
+
+
+def peak_rss():
+    # Kilobytes on Linux, bytes on macOS
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def wait_until(app, predicate, timeout):
+    deadline = time.perf_counter() + timeout
+    while not predicate():
+        if time.perf_counter() > deadline:
+            raise RuntimeError("Timed out after {0}s".format(timeout))
+        app.processEvents(QtCore.QEventLoop.AllEvents, 10)
+
+
+def timings(samples):
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "mean_ms": statistics.mean(samples) * 1000,
+        "median_ms": statistics.median(samples) * 1000,
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+        "max_ms": samples[-1] * 1000
+    }
+
+
+def bench_refresh_contexts(app, win, args):
+    results = {}
+    for run in ("cold", "warm"):
+        start = time.perf_counter()
+        win.refreshContexts()
+        wait_until(app, lambda: win.contexts_model.rowCount() == args.contexts, args.timeout)
+        first_rows = time.perf_counter() - start
+        wait_until(app, win.actionRefresh.isEnabled, args.timeout)
+        results[run] = {"first_rows_s": first_rows, "complete_s": time.perf_counter() - start}
+        # Let the worker save its snapshot before the warm run
+        wait_until(app, lambda: not win.contexts_worker.isRunning(), args.timeout)
+    return results
+
+
+def bench_browser_model(app, win, args, telepat):
+    from telepat.models import TelepatBaseObject
+    from modelbrowser import BrowserModel, ModelSortFilterProxyModel
+
+    context = win.contexts_model.contexts[0]
+    objects = [TelepatBaseObject(obj) for obj in telepat.dataset.objects(context.id, telepat.dataset.model_names[0])]
+    view = QtWidgets.QTreeView()
+    view.resize(1000, 700)
+    view.show()
+
+    start = time.perf_counter()
+    model = BrowserModel(view, objects)
+    proxy = ModelSortFilterProxyModel()
+    proxy.setSourceModel(model)
+    view.setModel(proxy)
+    app.processEvents()
+    construction = time.perf_counter() - start
+
+    # Typing a query one key at a time, the index build lands on the first key
+    keystrokes = []
+    query = ""
+    for char in args.query:
+        query += char
+        start = time.perf_counter()
+        proxy.setQuery(query)
+        app.processEvents()
+        keystrokes.append(time.perf_counter() - start)
+    matches = proxy.rowCount()
+
+    start = time.perf_counter()
+    proxy.setQuery("")
+    view.sortByColumn(model.column_index.get("count", 0), QtCore.Qt.DescendingOrder)
+    app.processEvents()
+    sort = time.perf_counter() - start
+    view.close()
+    return {
+        "objects": len(objects),
+        "construction_s": construction,
+        "filter_keystrokes": timings(keystrokes),
+        "filter_first_keystroke_ms": keystrokes[0] * 1000 if keystrokes else None,
+        "filter_matches": matches,
+        "sort_s": sort
+    }
+
+
+def bench_edit_object(app, win, args):
+    contexts = win.contexts_model.contexts
+    samples = []
+    for i in range(min(args.edits, len(contexts))):
+        start = time.perf_counter()
+        win.tableView.editObject(contexts[i])
+        app.processEvents()
+        samples.append(time.perf_counter() - start)
+    return timings(samples)
+
+
+def bench_notifications(app, win, args, telepat):
+    import notifications
+    from faketelepat import NotificationSource
+    from models.context import Context
+
+    queue = notifications.get_queue()
+    before = queue.stats()
+    source = NotificationSource(telepat, Context, args.notifications, args.notification_rate, args.seed)
+    start = time.perf_counter()
+    source.start()
+    wait_until(app, lambda: not source.is_alive() and not queue.pending, args.timeout)
+    app.processEvents()
+    elapsed = time.perf_counter() - start
+    after = queue.stats()
+    received = after["received"] - before["received"]
+    return {
+        "sent": source.sent,
+        "received": received,
+        "applied": after["applied"] - before["applied"],
+        "batches": after["batches"] - before["batches"],
+        "elapsed_s": elapsed,
+        "received_per_s": received / elapsed if elapsed else None
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the GUI benchmarks against a synthetic Telepat application")
+    parser.add_argument("--contexts", type=int, default=5000)
+    parser.add_argument("--models", type=int, default=10)
+    parser.add_argument("--objects", type=int, default=20000, help="objects per context and model")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--fields", type=int, default=10)
+    parser.add_argument("--notifications", type=int, default=20000)
+    parser.add_argument("--notification-rate", type=float, default=0, help="notifications per second, 0 for a burst")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated seconds per request")
+    parser.add_argument("--edits", type=int, default=200)
+    parser.add_argument("--query", default="text 12 alpha")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    args = parser.parse_args()
+
+    from faketelepat import Dataset, FakeTelepat
+    app = QtWidgets.QApplication(sys.argv)
+    dataset = Dataset(args.contexts, args.models, args.objects, args.users, args.fields, args.seed)
+    telepat = FakeTelepat(dataset, args.latency)
+    app.telepat_instance = telepat
+    app.server_url = "bench://localhost"
+
+    from telepatmanager import TelepatManager
+    import scheduler
+    import instrumentation
+    win = TelepatManager()
+    win.applications = [dataset.application()]
+    # Selecting the app would also start the users and register workers
+    win.appsCombobox.blockSignals(True)
+    win.appsCombobox.addItem("Benchmark")
+    win.appsCombobox.blockSignals(False)
+    win.show()
+    app.processEvents()
+
+    results = {}
+    memory = {"start": peak_rss()}
+    results["refresh_contexts"] = bench_refresh_contexts(app, win, args)
+    memory["refresh_contexts"] = peak_rss()
+    results["browser_model"] = bench_browser_model(app, win, args, telepat)
+    memory["browser_model"] = peak_rss()
+    results["edit_object"] = bench_edit_object(app, win, args)
+    memory["edit_object"] = peak_rss()
+    results["notifications"] = bench_notifications(app, win, args, telepat)
+    memory["notifications"] = peak_rss()
+    results["peak_rss"] = memory
+    results["scheduler"] = scheduler.get_scheduler().stats()
+    results["instrumentation"] = instrumentation.summary()
+
+    report = {
+        "suite": "telepatmanager",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "qt": QtCore.QT_VERSION_STR,
+        "pyqt": QtCore.PYQT_VERSION_STR,
+        "platform": platform.platform(),
+        "params": vars(args),
+        "results": results
+    }
+    output = json.dumps(report, indent=2, sort_keys=True, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    win.close()
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
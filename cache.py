@@ -0,0 +1,133 @@
+import collections
+import threading
+import time
+from PyQt5 import QtCore
+from settings import tmsettings
+from const import TM_EVENT_ON_ADD_OBJECT, TM_EVENT_ON_UPDATE_OBJECT, TM_EVENT_ON_DELETE_OBJECT, TM_EVENT_ON_DELETE_CONTEXT
+
+DEFAULT_TTL = 300  # seconds
+DEFAULT_MAX_SIZE = 500000  # cached objects, a non-list value counts as one
+OBJECT_EVENTS = (TM_EVENT_ON_ADD_OBJECT, TM_EVENT_ON_UPDATE_OBJECT, TM_EVENT_ON_DELETE_OBJECT)
+
+
+class TTLCache:
+    def __init__(self, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _weight(self, value):
+        return len(value) if isinstance(value, list) else 1
+
+    def _remove(self, key):
+        expires, value = self.entries.pop(key)
+        self.size -= self._weight(value)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            value = entry[1]
+        # Callers get their own list, the cached one is never mutated
+        return list(value) if isinstance(value, list) else value
+
+    def put(self, key, value):
+        weight = self._weight(value)
+        if weight > self.max_size:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.monotonic() + self.ttl, list(value) if isinstance(value, list) else value)
+            self.size += weight
+            while self.size > self.max_size:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def discard(self, key):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+
+    def invalidate(self, key_prefix):
+        # Keys are tuples, a shorter tuple drops every key starting with it
+        with self.lock:
+            for key in [key for key in self.entries if key[:len(key_prefix)] == key_prefix]:
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "size": self.size
+        }
+
+    def summary(self):
+        return "cache: {hits} hits, {misses} misses, {entries} entries".format(**self.stats())
+
+
+cache = None
+cache_lock = threading.Lock()
+
+def get_cache():
+    global cache
+    with cache_lock:
+        if cache is None:
+            cache = TTLCache(tmsettings.value("cacheTTL", DEFAULT_TTL, type=int),
+                             tmsettings.value("cacheMaxSize", DEFAULT_MAX_SIZE, type=int))
+    return cache
+
+def invalidate_app():
+    for kind in ("schema", "users", "objects"):
+        get_cache().invalidate((kind,) + app_key())
+
+def app_key():
+    app = QtCore.QCoreApplication.instance()
+    telepat = app.telepat_instance
+    return (getattr(app, "server_url", None), telepat.app_id)
+
+def contexts_key():
+    return ("contexts",) + app_key()
+
+def schema_key():
+    return ("schema",) + app_key()
+
+def users_key():
+    return ("users",) + app_key()
+
+def objects_key(context_id=None, model=None):
+    key = ("objects",) + app_key()
+    if context_id is not None:
+        key += (context_id,)
+        if model is not None:
+            key += (model,)
+    return key
+
+def invalidate_for_event(event):
+    obj = event.obj
+    if event.type() in OBJECT_EVENTS:
+        context_id = obj["context_id"] if "context_id" in obj else None
+        model = obj["model"] if "model" in obj else None
+        if context_id and model:
+            get_cache().discard(objects_key(context_id, model))
+    elif event.type() == TM_EVENT_ON_DELETE_CONTEXT:
+        get_cache().invalidate(objects_key(obj.id))
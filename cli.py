@@ -0,0 +1,360 @@
+#! /usr/bin/env python
+# Runs the manager's workers without a window, for bulk jobs on a server:
+#
+#   python cli.py -s https://api.example.com -w wss://ws.example.com -u admin@example.com -a APP_ID \
+#       export --model comments --output comments.ndjson
+#   python cli.py ... patch --model comments --field state --value 1 --where state=0
+#
+# Results are written as one JSON object per line, log lines and the final
+# throughput go to stderr.
+import argparse
+import getpass
+import json
+import os
+import signal
+import sys
+import time
+from PyQt5 import QtCore
+from telepat import Telepat
+from telepat.models import TelepatBaseObject
+from models.telepatobject import TelepatObject
+from workers import LoginWorker, ApplicationsWorker, RegisterWorker, ContextsWorker, UsersWorker, \
+    SubscribeWorker, UnsubscribeWorker, ObjectPatchWorker
+from pipeline import Pipeline
+import httpsession
+import scheduler
+import snapshots
+
+DEFAULT_PARALLELISM = 8
+DEFAULT_USERS_PAGE_SIZE = 1000
+
+
+class CliApplication(QtCore.QCoreApplication):
+    telepat_instance = None
+    server_url = None
+
+
+class NdjsonWriter:
+    def __init__(self, path=None):
+        self.file = open(path, "w") if path and path != "-" else sys.stdout
+        self.records = 0
+
+    def write(self, record):
+        self.file.write(json.dumps(record, default=str, separators=(",", ":")) + "\n")
+        self.records += 1
+
+    def close(self):
+        self.file.flush()
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+def parse_value(text):
+    # Numbers, booleans, null and JSON objects are typed, anything else is a string
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+# Connects, selects the application and runs one command. Per context work
+# is kept at the given parallelism, the scheduler running the workers.
+class Job(QtCore.QObject):
+    def __init__(self, app, args, writer):
+        super(Job, self).__init__()
+        self.app = app
+        self.args = args
+        self.writer = writer
+        self.tasks = iter(())
+        self.in_flight = 0
+        self.objects = 0
+        self.contexts = 0
+        self.errors = 0
+        self.finished = False
+        self.started = time.perf_counter()
+
+    def log(self, message):
+        if self.args.verbose:
+            print(message, file=sys.stderr)
+
+    def error(self, message):
+        self.errors += 1
+        print(message, file=sys.stderr)
+
+    def start(self):
+        self.pipeline = Pipeline("Cli", self)
+        self.pipeline.add_stage("login", self.login)
+        self.pipeline.add_stage("app", self.select_application, requires=("login",))
+        self.pipeline.add_stage("register", self.register, requires=("app",))
+        if self.args.command in ("contexts", "export", "patch"):
+            self.pipeline.add_stage("contexts", self.fetch_contexts, requires=("app",))
+        self.pipeline.add_stage("run", self.run_command, requires=tuple(name for name in self.pipeline.stages))
+        self.pipeline.stage_finished.connect(self.stage_finished)
+        self.pipeline.start()
+
+    def stage_finished(self, name, ok):
+        if not ok and name != "run":
+            self.error("Cannot {0}, stopping".format(name))
+            self.finish()
+
+    def watch(self, worker):
+        worker.log.connect(self.log)
+        scheduler.submit(worker)
+        return worker
+
+    def login(self):
+        worker = LoginWorker(None, self.args.user, self.args.password)
+        worker.failed.connect(lambda err_code, msg: self.error("Error {0}: {1}".format(err_code, msg)))
+        return self.watch(worker)
+
+    def select_application(self):
+        def apps_success(apps_list):
+            for app in apps_list:
+                if app["id"] == self.args.app:
+                    self.app.telepat_instance.app_id = app["id"]
+                    self.app.telepat_instance.api_key = app["keys"][0]
+                    return
+            self.error("No application {0}".format(self.args.app))
+            self.finish()
+
+        worker = ApplicationsWorker(None)
+        worker.success.connect(apps_success)
+        worker.failed.connect(lambda err_code, msg: self.error("Error {0}: {1}".format(err_code, msg)))
+        return self.watch(worker)
+
+    def register(self):
+        worker = RegisterWorker(None)
+        worker.failed.connect(lambda err_code, msg: self.error("Error {0}: {1}".format(err_code, msg)))
+        return self.watch(worker)
+
+    def fetch_contexts(self):
+        def contexts_success(contexts_list):
+            if getattr(self.args, "contexts", None):
+                wanted = set(self.args.contexts)
+                contexts_list = [context for context in contexts_list if context.id in wanted]
+            self.context_list = contexts_list
+
+        worker = ContextsWorker(None)
+        worker.success.connect(contexts_success)
+        worker.failed.connect(lambda err_code, msg: self.error("Error {0}: {1}".format(err_code, msg)))
+        return self.watch(worker)
+
+    def run_command(self):
+        getattr(self, "command_" + self.args.command)()
+
+    # Commands
+
+    def command_contexts(self):
+        for context in self.context_list:
+            self.writer.write(context.to_json())
+            self.objects += 1
+        self.finish()
+
+    def command_users(self):
+        def users_success(users_list, more):
+            for user in users_list:
+                self.writer.write(user.to_json())
+            self.objects += len(users_list)
+            if more:
+                fetch(offset + len(users_list))
+            else:
+                self.finish()
+
+        def users_failed(err_code, msg):
+            self.error("Error {0}: {1}".format(err_code, msg))
+            self.finish()
+
+        def fetch(start):
+            nonlocal offset
+            offset = start
+            worker = UsersWorker(None, offset, self.args.page_size)
+            worker.success.connect(users_success)
+            worker.failed.connect(users_failed)
+            self.watch(worker)
+
+        offset = 0
+        fetch(0)
+
+    def command_export(self):
+        self.run_tasks(self.export_model)
+
+    def command_patch(self):
+        self.run_tasks(self.patch_model)
+
+    def run_tasks(self, task):
+        self.tasks = ((task, context, model) for context in self.context_list for model in self.args.model)
+        self.start_tasks()
+
+    def start_tasks(self):
+        while self.in_flight < self.args.parallelism:
+            try:
+                task, context, model = next(self.tasks)
+            except StopIteration:
+                break
+            self.in_flight += 1
+            task(context, model)
+        if not self.in_flight:
+            self.finish()
+
+    def task_done(self, channel=None):
+        # The channel is dropped before the slot goes to the next context
+        def unsubscribed(*args):
+            self.in_flight -= 1
+            self.start_tasks()
+
+        self.contexts += 1
+        if channel is None:
+            unsubscribed()
+            return
+        worker = UnsubscribeWorker(None, channel)
+        worker.success.connect(unsubscribed)
+        worker.failed.connect(unsubscribed)
+        self.watch(worker)
+
+    def subscribe(self, context, model, on_objects):
+        def subscribe_failed(err_code, msg):
+            self.error("Error {0} while subscribing to {1} in {2}: {3}".format(err_code, model, context.id, msg))
+            self.writer.write({"context_id": context.id, "model": model, "status": err_code, "error": msg})
+            self.task_done()
+
+        worker = SubscribeWorker(None, context, model, TelepatBaseObject)
+        worker.success.connect(on_objects)
+        worker.failed.connect(subscribe_failed)
+        self.watch(worker)
+
+    def export_model(self, context, model):
+        def objects_received(channel, objects):
+            for obj in objects:
+                self.writer.write(obj.to_json())
+            self.objects += len(objects)
+            self.task_done(channel)
+
+        self.subscribe(context, model, objects_received)
+
+    def matches(self, obj):
+        for field, value in self.args.where:
+            if not field in obj or obj[field] != value:
+                return False
+        return True
+
+    def patch_model(self, context, model):
+        def patch_success(patched, failures):
+            self.objects += patched
+            self.writer.write({"context_id": context.id, "model": model, "patched": patched, "failed": failures})
+            self.task_done(channel)
+
+        def patch_failed(err_code, msg):
+            self.error("Error {0} while patching {1} in {2}: {3}".format(err_code, model, context.id, msg))
+            self.writer.write({"context_id": context.id, "model": model, "status": err_code, "error": msg})
+            self.task_done(channel)
+
+        def object_failed(object_id, status, message):
+            self.errors += 1
+            self.writer.write({"id": object_id, "context_id": context.id, "model": model, "status": status, "error": message})
+
+        def objects_received(subscribed_channel, objects):
+            nonlocal channel
+            channel = subscribed_channel
+            changes = []
+            for obj in objects:
+                if not self.matches(obj):
+                    continue
+                updated_object = TelepatObject(obj.to_json())
+                setattr(updated_object, self.args.field, self.args.value)
+                changes.append((obj, updated_object))
+            if self.args.dry_run or not changes:
+                for original, updated in changes:
+                    self.writer.write({"id": original.id, "context_id": context.id, "model": model,
+                                       "field": self.args.field, "old": original[self.args.field] if self.args.field in original else None,
+                                       "new": self.args.value})
+                self.objects += len(changes)
+                self.task_done(channel)
+                return
+            worker = ObjectPatchWorker(None, channel, changes, self.args.patch_parallelism)
+            worker.success.connect(patch_success)
+            worker.failed.connect(patch_failed)
+            worker.object_failed.connect(object_failed)
+            self.watch(worker)
+
+        channel = None
+        self.subscribe(context, model, objects_received)
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        self.pipeline.cancel()
+        elapsed = time.perf_counter() - self.started
+        rate = self.objects / elapsed if elapsed else 0
+        where = " from {0} contexts".format(self.contexts) if self.contexts else ""
+        print("{0}: {1} objects{2} in {3:.1f}s ({4:.0f} objects/s), {5} errors".format(
+            self.args.command, self.objects, where, elapsed, rate, self.errors), file=sys.stderr)
+        self.app.exit(1 if self.errors else 0)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Run Telepat admin jobs without the window, writing NDJSON")
+    parser.add_argument("-s", "--server", required=True, help="URL of the Telepat API")
+    parser.add_argument("-w", "--sockets", required=True, help="URL of the Telepat sockets server")
+    parser.add_argument("-u", "--user", required=True, help="admin username")
+    parser.add_argument("-p", "--password", help="admin password, TELEPAT_PASSWORD or a prompt otherwise")
+    parser.add_argument("-a", "--app", required=True, help="application id")
+    parser.add_argument("-o", "--output", help="write the results here instead of stdout")
+    parser.add_argument("-j", "--parallelism", type=int, default=DEFAULT_PARALLELISM, help="contexts handled at once")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print the workers' log to stderr")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    commands.add_parser("contexts", help="list the contexts")
+    users = commands.add_parser("users", help="list the users")
+    users.add_argument("--page-size", type=int, default=DEFAULT_USERS_PAGE_SIZE)
+
+    for name, description in (("export", "write every object of the models"), ("patch", "set a field on every matching object")):
+        command = commands.add_parser(name, help=description)
+        command.add_argument("-m", "--model", action="append", required=True, help="model name, can be repeated")
+        command.add_argument("-c", "--context", dest="contexts", action="append", help="context id, all contexts if not given")
+    patch = commands.choices["patch"]
+    patch.add_argument("--field", required=True)
+    patch.add_argument("--value", required=True, type=parse_value, help="JSON values are typed, e.g. 1, true, null")
+    patch.add_argument("--where", action="append", default=[], metavar="FIELD=VALUE",
+                       help="only patch objects with this value, can be repeated")
+    patch.add_argument("--patch-parallelism", type=int, default=None, help="patches in flight per context")
+    patch.add_argument("--dry-run", action="store_true", help="write the changes without sending them")
+
+    args = parser.parse_args()
+    if args.command == "patch":
+        where = []
+        for condition in args.where:
+            field, separator, value = condition.partition("=")
+            if not separator:
+                parser.error("--where expects FIELD=VALUE, got {0}".format(condition))
+            where.append((field, parse_value(value)))
+        args.where = where
+    if args.password is None:
+        args.password = os.environ.get("TELEPAT_PASSWORD") or getpass.getpass("Password for {0}: ".format(args.user))
+    args.parallelism = max(1, args.parallelism)
+    return args
+
+
+def main():
+    args = parse_arguments()
+    # Ctrl+C stops right away, like any other command line tool
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    app = CliApplication(sys.argv)
+    snapshots.disable()
+    # Each context keeps a subscribe or patch worker busy
+    scheduler.get_scheduler().max_threads = args.parallelism
+    app.telepat_instance = Telepat(args.server, args.sockets)
+    app.server_url = args.server
+    httpsession.install(app.telepat_instance, args.server, pool_size=args.parallelism * 2)
+
+    writer = NdjsonWriter(args.output)
+    job = Job(app, args, writer)
+    QtCore.QTimer.singleShot(0, job.start)
+    status = app.exec_()
+    writer.close()
+    os._exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,12 @@
 #! /usr/bin/env python
-from PyQt5 import QtGui, QtWidgets, QtCore, uic
+from PyQt5 import QtGui, QtWidgets, QtCore
 from settings import tmsettings
 from workers import *
 import console
+import scheduler
+import httpsession
+import subscriptions
+from uiloader import load_ui
 from telepat import Telepat
 
 
@@ -14,7 +18,7 @@ class ConnectionEditor(QtWidgets.QDialog):
 
         self.contexts_list = []
 
-        uic.loadUi('conneditor.ui', self)
+        load_ui('conneditor.ui', self)
         self.serverUrl.textEdited.connect(self.reset_lineedit)
         self.socketsUrl.textEdited.connect(self.reset_lineedit)
         self.adminUsername.textEdited.connect(self.reset_lineedit)
@@ -73,12 +77,17 @@ class ConnectionEditor(QtWidgets.QDialog):
         self.buttonBox.setDisabled(True)
         if QtCore.QCoreApplication.instance().telepat_instance:
             QtCore.QCoreApplication.instance().telepat_instance.disconnect()
-        QtCore.QCoreApplication.instance().telepat_instance = Telepat(self.serverUrl.text(), self.socketsUrl.text())
+            subscriptions.get_manager().clear()
+        telepat_instance = Telepat(self.serverUrl.text(), self.socketsUrl.text())
+        # Reconnecting to the same server keeps its kept-alive connections
+        httpsession.install(telepat_instance, self.serverUrl.text())
+        QtCore.QCoreApplication.instance().telepat_instance = telepat_instance
+        QtCore.QCoreApplication.instance().server_url = self.serverUrl.text()
         self.login_worker = LoginWorker(self, self.adminUsername.text(), self.adminPassword.text())
         self.login_worker.success.connect(self.login_success)
         self.login_worker.failed.connect(self.login_failed)
         self.login_worker.log.connect(console.log)
-        self.login_worker.start()
+        scheduler.submit(self.login_worker, key="login")
 
     def login_success(self):
         self.save_connection()
@@ -1,14 +1,110 @@
-log_widget = None
+import collections
+import threading
+import time
+from PyQt5 import QtCore
+from settings import tmsettings
+
+DEFAULT_MAX_LINES = 10000
+FLUSH_INTERVAL = 16  # ms, roughly one repaint per frame
+
+
+class LogBuffer(QtCore.QObject):
+	flush_requested = QtCore.pyqtSignal()
+
+	def __init__(self, max_lines=DEFAULT_MAX_LINES):
+		super(LogBuffer, self).__init__()
+		self.entries = collections.deque(maxlen=max_lines)
+		self.pending = []
+		self.lock = threading.Lock()
+		self.widget = None
+
+		self.timer = QtCore.QTimer(self)
+		self.timer.setSingleShot(True)
+		self.timer.setInterval(FLUSH_INTERVAL)
+		self.timer.timeout.connect(self.flush)
+		self.flush_requested.connect(self.schedule_flush)
+
+	@property
+	def max_lines(self):
+		return self.entries.maxlen
+
+	@max_lines.setter
+	def max_lines(self, value):
+		with self.lock:
+			self.entries = collections.deque(self.entries, maxlen=value)
+		if self.widget:
+			self.widget.setMaximumBlockCount(value)
+
+	def set_widget(self, widget):
+		self.widget = widget
+		if widget:
+			widget.setMaximumBlockCount(self.max_lines)
+			with self.lock:
+				self.pending = [line for timestamp, line in self.entries]
+			widget.clear()
+			self.schedule_flush()
+
+	def append(self, line):
+		line = str(line)
+		with self.lock:
+			self.entries.append((time.time(), line))
+			self.pending.append(line)
+			first = len(self.pending) == 1
+		if first:
+			# Queued across threads, so only the GUI thread touches the timer
+			self.flush_requested.emit()
+
+	def schedule_flush(self):
+		if not self.timer.isActive():
+			self.timer.start()
+
+	def flush(self):
+		with self.lock:
+			pending = self.pending
+			self.pending = []
+		if not self.widget or not pending:
+			return
+		# Only the last max_lines lines can survive in the widget anyway
+		pending = pending[-self.max_lines:]
+		scrollbar = self.widget.verticalScrollBar()
+		at_bottom = scrollbar.value() == scrollbar.maximum()
+		self.widget.appendPlainText("\n".join(pending))
+		if at_bottom:
+			scrollbar.setValue(scrollbar.maximum())
+
+	def export(self, path):
+		with self.lock:
+			entries = list(self.entries)
+		with open(path, "w", encoding="utf-8") as f:
+			for timestamp, line in entries:
+				f.write("{0} {1}\n".format(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)), line))
+		return len(entries)
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+			self.pending = []
+		if self.widget:
+			self.widget.clear()
+
+
+buffer = None
+
+def get_buffer():
+	global buffer
+	if buffer is None:
+		buffer = LogBuffer(tmsettings.value("consoleMaxLines", DEFAULT_MAX_LINES, type=int))
+	return buffer
 
 def log(line):
-	if log_widget:
-		text = log_widget.toPlainText()
-		if text:
-			log_widget.setPlainText("{0}\n{1}".format(text, line))
-		else:
-			log_widget.setPlainText("{0}".format(line))
-		log_widget.verticalScrollBar().setValue(log_widget.verticalScrollBar().maximum())
+	get_buffer().append(line)
 
 def set_widget(widget):
-	global log_widget
-	log_widget = widget
+	get_buffer().set_widget(widget)
+
+def set_max_lines(max_lines):
+	tmsettings.setValue("consoleMaxLines", max_lines)
+	get_buffer().max_lines = max_lines
+
+def export(path):
+	return get_buffer().export(path)
@@ -6,4 +6,5 @@ TM_EVENT_ON_UPDATE_CONTEXT = QtCore.QEvent.User+3
 TM_EVENT_ON_DELETE_CONTEXT = QtCore.QEvent.User+4
 TM_EVENT_ON_ADD_OBJECT = QtCore.QEvent.User+5
 TM_EVENT_ON_UPDATE_OBJECT = QtCore.QEvent.User+6
-TM_EVENT_ON_DELETE_OBJECT = QtCore.QEvent.User+7
\ No newline at end of file
+TM_EVENT_ON_DELETE_OBJECT = QtCore.QEvent.User+7
+TM_EVENT_ON_NOTIFICATION_BATCH = QtCore.QEvent.User+8
\ No newline at end of file
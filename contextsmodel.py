@@ -0,0 +1,211 @@
+from PyQt5 import QtCore, QtWidgets
+from PyQt5.QtCore import QCoreApplication
+from models.model import Model
+from snapshots import same_version
+from instrumentation import instrumented
+
+RECONCILE_RESET_LIMIT = 100  # removed contexts above which the model is reset
+
+
+# Contexts are kept in a flat list and share a single list of schema models.
+# A context's model rows are only inserted when the view expands it. Top level
+# indexes have an internal id of 0, model rows carry the serial of their context.
+class ContextsModel(QtCore.QAbstractItemModel):
+    def __init__(self, parent=None):
+        super(ContextsModel, self).__init__(parent)
+        self.contexts = []
+        self.ids = []
+        self.schema_models = []
+        self.show_names = True
+        self._rows = {}
+        self._serials = {}
+        self._ids = {}
+        self._next_serial = 1
+        self._fetched = set()
+        self._flags = QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+        style = QCoreApplication.instance().style()
+        self._context_icon = style.standardIcon(QtWidgets.QStyle.SP_DirClosedIcon)
+        self._model_icon = style.standardIcon(QtWidgets.QStyle.SP_FileIcon)
+
+    @instrumented("ContextsModel.set_contexts")
+    def set_contexts(self, contexts, schema):
+        self.beginResetModel()
+        self.schema_models = [(key, Model(schema[key].to_json())) for key in schema] if schema else []
+        self._set_rows(contexts)
+        self.endResetModel()
+
+    def _set_rows(self, contexts):
+        self.contexts = list(contexts)
+        self.ids = ids = [ctx.id for ctx in self.contexts]
+        self._rows = {context_id: row for row, context_id in enumerate(ids)}
+        self._serials = {context_id: row + 1 for row, context_id in enumerate(ids)}
+        self._ids = {row + 1: context_id for row, context_id in enumerate(ids)}
+        self._next_serial = len(ids) + 1
+        self._fetched = set()
+
+    def clear(self):
+        self.set_contexts([], None)
+
+    def append_context(self, context):
+        row = len(self.contexts)
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+        self.contexts.append(context)
+        self.ids.append(context.id)
+        self._rows[context.id] = row
+        self._assign_serial(context.id)
+        self.endInsertRows()
+
+    def update_context(self, row, context):
+        self.contexts[row] = context
+        index = self.index(row, 0)
+        self.dataChanged.emit(index, index)
+
+    def remove_context(self, context_id):
+        row = self._rows.get(context_id, -1)
+        if row < 0:
+            return False
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+        del self.contexts[row]
+        del self.ids[row]
+        del self._rows[context_id]
+        del self._ids[self._serials.pop(context_id)]
+        self._fetched.discard(context_id)
+        # Only the contexts below the removed one change rows
+        rows = self._rows
+        ids = self.ids
+        for i in range(row, len(ids)):
+            rows[ids[i]] = i
+        self.endRemoveRows()
+        return True
+
+    @instrumented("ContextsModel.reconcile")
+    def reconcile(self, contexts):
+        # Applies a fresh list on top of the one loaded from a snapshot,
+        # only the contexts that changed are touched
+        fresh_ids = set(ctx.id for ctx in contexts)
+        stale = [context_id for context_id in self.ids if not context_id in fresh_ids]
+        if len(stale) > RECONCILE_RESET_LIMIT:
+            self.beginResetModel()
+            self._set_rows(contexts)
+            self.endResetModel()
+            return len(contexts)
+        changed = len(stale)
+        for context_id in stale:
+            self.remove_context(context_id)
+        for context in contexts:
+            row = self._rows.get(context.id, -1)
+            if row < 0:
+                self.append_context(context)
+            elif not same_version(self.contexts[row], context):
+                self.update_context(row, context)
+            else:
+                continue
+            changed += 1
+        return changed
+
+    def row_for_id(self, context_id):
+        return self._rows.get(context_id, -1)
+
+    def set_show_names(self, show):
+        self.show_names = show
+        if self.contexts:
+            self.dataChanged.emit(self.index(0, 0), self.index(len(self.contexts) - 1, 0), [QtCore.Qt.DisplayRole])
+
+    def context_for(self, index):
+        if not index.isValid():
+            return None
+        if index.internalId() == 0:
+            return self.contexts[index.row()]
+        row = self._context_row(index)
+        return self.contexts[row] if row >= 0 else None
+
+    def model_name_for(self, index):
+        if not index.isValid() or index.internalId() == 0:
+            return None
+        return self.schema_models[index.row()][0]
+
+    def model_for(self, index):
+        if not index.isValid() or index.internalId() == 0:
+            return None
+        return self.schema_models[index.row()][1]
+
+    def is_context(self, index):
+        return index.isValid() and index.internalId() == 0
+
+    def context_name(self, context):
+        if self.show_names and hasattr(context, "name") and context.name:
+            return context.name
+        return context.id
+
+    def _assign_serial(self, context_id):
+        if context_id not in self._serials:
+            self._serials[context_id] = self._next_serial
+            self._ids[self._next_serial] = context_id
+            self._next_serial += 1
+
+    def _context_row(self, index):
+        context_id = self._ids.get(index.internalId())
+        return self._rows.get(context_id, -1)
+
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        if not parent.isValid():
+            if column == 0 and 0 <= row < len(self.contexts):
+                return self.createIndex(row, 0)
+        elif column == 0 and parent.internalId() == 0 and 0 <= row < len(self.schema_models):
+            return self.createIndex(row, 0, self._serials[self.ids[parent.row()]])
+        return QtCore.QModelIndex()
+
+    def parent(self, index):
+        if not index.isValid() or index.internalId() == 0:
+            return QtCore.QModelIndex()
+        row = self._context_row(index)
+        if row < 0:
+            return QtCore.QModelIndex()
+        return self.createIndex(row, 0)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if not parent.isValid():
+            return len(self.contexts)
+        if parent.internalId() == 0 and self.ids[parent.row()] in self._fetched:
+            return len(self.schema_models)
+        return 0
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        if not parent.isValid():
+            return len(self.contexts) > 0
+        return parent.internalId() == 0 and len(self.schema_models) > 0
+
+    def canFetchMore(self, parent):
+        if not self.schema_models or not parent.isValid() or parent.internalId() != 0:
+            return False
+        return self.ids[parent.row()] not in self._fetched
+
+    def fetchMore(self, parent):
+        if not self.canFetchMore(parent):
+            return
+        self.beginInsertRows(parent, 0, len(self.schema_models) - 1)
+        self._fetched.add(self.ids[parent.row()])
+        self.endInsertRows()
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return QtCore.QVariant()
+        is_context = index.internalId() == 0
+        if role == QtCore.Qt.DisplayRole:
+            if is_context:
+                return self.context_name(self.contexts[index.row()])
+            return self.schema_models[index.row()][0]
+        elif role == QtCore.Qt.DecorationRole:
+            return self._context_icon if is_context else self._model_icon
+        return QtCore.QVariant()
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return "Contexts"
+        return QtCore.QVariant()
+
+    def flags(self, index):
+        return self._flags if index.isValid() else QtCore.Qt.NoItemFlags
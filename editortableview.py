@@ -1,11 +1,40 @@
+import collections
+import json
 from copy import copy
 from PyQt5 import QtWidgets, QtCore, QtGui
 from workers import ContextPatchWorker
-from objecteditor import ObjectEditor
 from telepat import TelepatContext
 from models.basemodel import BaseModel
 from models.metaobject import MetaObject
 import console
+import scheduler
+from userdirectory import UserDirectory, UserCompletionModel
+
+COMMIT_DELAY = 800  # ms of inactivity before pending edits are sent
+
+class UserSelector(QtWidgets.QLineEdit):
+    # Completes user ids from the directory instead of listing every user
+    def __init__(self, parent, directory):
+        super(UserSelector, self).__init__(parent)
+        self.directory = directory
+        self.completionModel = UserCompletionModel(directory, self)
+        completer = QtWidgets.QCompleter(self.completionModel, self)
+        completer.setCompletionMode(QtWidgets.QCompleter.UnfilteredPopupCompletion)
+        completer.setCompletionRole(QtCore.Qt.EditRole)
+        self.setCompleter(completer)
+        self.setPlaceholderText("Search users by id, name or username")
+        self.textEdited.connect(self.search)
+        directory.changed.connect(self.pageLoaded)
+
+    def search(self, text):
+        self.completionModel.set_query(text)
+        if self.completionModel.rowCount():
+            self.completer().complete()
+
+    def pageLoaded(self):
+        # More users came in while searching, refresh the suggestions
+        if self.hasFocus():
+            self.search(self.text())
 
 
 class ComboBoxDelegate(QtWidgets.QItemDelegate):
@@ -24,6 +53,8 @@ class ComboBoxDelegate(QtWidgets.QItemDelegate):
         key = self.rows[index.row()][0][:-3]
         if not key in self.objects_map:
             return super(ComboBoxDelegate, self).createEditor(parent, option, index)
+        if isinstance(self.objects_map[key], UserDirectory):
+            return UserSelector(parent, self.objects_map[key])
 
         ids = []
         for obj in self.objects_map[key]:
@@ -41,6 +72,9 @@ class ComboBoxDelegate(QtWidgets.QItemDelegate):
             return super(ComboBoxDelegate, self).setEditorData(editor, index)
 
         value = index.data(QtCore.Qt.DisplayRole)
+        if isinstance(self.objects_map[key], UserDirectory):
+            editor.setText(value if isinstance(value, str) else "")
+            return
         ids = []
         for obj in self.objects_map[key]:
             ids.append(obj.id)
@@ -48,6 +82,14 @@ class ComboBoxDelegate(QtWidgets.QItemDelegate):
         editor.setCurrentIndex(ids.index(value))
  
     def setModelData(self, editor, model, index):
+        directory = self.objects_map.get(self.rows[index.row()][0][:-3])
+        if isinstance(directory, UserDirectory):
+            # Typed text is only taken as an id the directory knows, unless
+            # not every user is loaded yet
+            text = editor.text()
+            if text != index.data(QtCore.Qt.DisplayRole) and (directory.user(text) is not None or not directory.complete):
+                model.setData(index, text, QtCore.Qt.EditRole)
+            return
         key = self.rows[index.row()][0]
         if not key in self.objects_map:
             return super(ComboBoxDelegate, self).setModelData(editor, model, index)
@@ -131,26 +173,45 @@ class EditorTableModel(QtCore.QAbstractTableModel):
 
 class EditorTableView(QtWidgets.QTableView):
     original_object = None
-    updated_object = None
+    requests_saved = 0
+    bytes_saved = 0
     
     def __init__(self, parent=None):
         super(EditorTableView,  self).__init__(parent)
+        # Kept per object id, so moving to another object while a patch is
+        # in flight doesn't replace the edits still to be sent: the latest
+        # edited object and the number of edits in it, what the server has
+        # to diff against, and the objects with a patch in flight
+        self.pending = collections.OrderedDict()
+        self.sent_objects = {}
+        self.in_flight = set()
         
         self.setSelectionMode(QtWidgets.QTableView.SingleSelection)
         self.setSelectionBehavior(QtWidgets.QTableView.SelectRows)
         self.setEditTriggers(QtWidgets.QAbstractItemView.DoubleClicked)
         self.verticalHeader().setVisible(False)
         self.doubleClicked.connect(self.openObject)
+
+        # Edits are collected and sent as one patch when the user stops
+        # editing for a moment, or right away with the Save shortcut
+        self.commitTimer = QtCore.QTimer(self)
+        self.commitTimer.setSingleShot(True)
+        self.commitTimer.setInterval(COMMIT_DELAY)
+        self.commitTimer.timeout.connect(self.commit)
+        self.saveShortcut = QtWidgets.QShortcut(QtGui.QKeySequence.Save, self)
+        self.saveShortcut.activated.connect(self.commit)
         
     def resizeEvent(self, event):
         width = event.size().width()
-        self.setColumnWidth(0, width * 0.25)
-        self.setColumnWidth(1, width * 0.75)
+        self.setColumnWidth(0, int(width * 0.25))
+        self.setColumnWidth(1, int(width * 0.75))
         
     def editObject(self, basemodel, objects_map=None):
         if self.original_object and self.original_object.id == basemodel.id:  # If it's the same object just look for updates
             self.model().basemodel = basemodel
             return
+        if self.pending:  # Don't lose edits to the object we are leaving
+            self.commit()
         self.original_object = copy(basemodel)
         self.objects_map = objects_map if objects_map else {}
         model = EditorTableModel(self, basemodel)
@@ -163,15 +224,23 @@ class EditorTableView(QtWidgets.QTableView):
             if key in self.objects_map:
                 self.openPersistentEditor(model.index(row, 1))
 
+    def setRelatedObjects(self, key, objects):
+        self.objects_map[key] = objects
+        model = self.model()
+        for row in range(0, model.rowCount(None)):
+            if model.rows[row][0][:-3] == key:
+                self.openPersistentEditor(model.index(row, 1))
+
     def openObject(self, index):
         def object_saved(key, updated_object):
-            parent_object = copy(self.original_object)
+            parent_object = copy(self.model().basemodel)
             setattr(parent_object, key, updated_object.to_json())
             self.valueChanged(parent_object)
 
         def object_dismissed():
             del self.object_editor
 
+        from objecteditor import ObjectEditor
         key = index.model().data(index.model().index(index.row(), 0))
         if isinstance(self.original_object[key], dict) and \
             not index.model().flags(index) & QtCore.Qt.ItemIsEditable:
@@ -181,21 +250,60 @@ class EditorTableView(QtWidgets.QTableView):
             self.object_editor.show()
         
     def valueChanged(self, updated_object):
+        if updated_object == self.original_object or not isinstance(updated_object, TelepatContext):
+            return
+        object_id = updated_object.id
+        self.sent_objects.setdefault(object_id, copy(self.original_object))
+        edits = self.pending.pop(object_id, (None, 0))[1]
+        self.pending[object_id] = (updated_object, edits + 1)
+        self.commitTimer.start()
+
+    def commit(self):
+        self.commitTimer.stop()
+        for object_id in list(self.pending):
+            self.send(object_id)
+
+    def send(self, object_id):
         def patch_success(response):
-            self.editObject(self.updated_object)
-            self.updated_object = None
-            
+            self.in_flight.discard(object_id)
+            self.sent_objects[object_id] = sent_object
+            if self.original_object and self.original_object.id == object_id:
+                self.original_object = sent_object
+            # Edits made while this patch was in flight go out next
+            if object_id in self.pending and not self.commitTimer.isActive():
+                self.send(object_id)
+            self.forget(object_id)
+
         def patch_failed(status,  message):
+            self.in_flight.discard(object_id)
+            # Later edits hold this one's changes too, they are tried once more
+            if object_id in self.pending:
+                self.send(object_id)
+            self.forget(object_id)
             QtWidgets.QMessageBox.critical(self, "Patch error", "Error {0}: {1}".format(status, message))
-            self.updated_object = None
 
-        self.updated_object = updated_object
-        if self.updated_object == self.original_object:
+        # Patches to an object are serialized, the next one waits for this one
+        if not object_id in self.pending or object_id in self.in_flight:
             return
 
-        if isinstance(self.updated_object, TelepatContext):
-            worker = ContextPatchWorker(self, self.updated_object)
-            worker.success.connect(patch_success)
-            worker.failed.connect(patch_failed)
-            worker.log.connect(console.log)
-            worker.start()
+        updated_object, edits = self.pending.pop(object_id)
+        sent_object = copy(updated_object)
+        if not self.sent_objects[object_id].patch_against(sent_object):
+            self.forget(object_id)
+            return
+
+        self.requests_saved += edits - 1
+        self.bytes_saved += (edits - 1) * len(json.dumps(sent_object.to_json()))
+        console.log("Sending {0} edits to {1} in one request ({2} requests, {3} bytes saved so far)".format(
+            edits, sent_object.id, self.requests_saved, self.bytes_saved))
+
+        self.in_flight.add(object_id)
+        worker = ContextPatchWorker(self, sent_object)
+        worker.success.connect(patch_success)
+        worker.failed.connect(patch_failed)
+        worker.log.connect(console.log)
+        scheduler.submit(worker)
+
+    def forget(self, object_id):
+        if not object_id in self.pending and not object_id in self.in_flight:
+            self.sent_objects.pop(object_id, None)
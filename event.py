@@ -28,6 +28,11 @@ class TelepatContextAddEvent(TelepatObjectEvent):
         super(TelepatContextAddEvent, self).__init__(obj, notification, TM_EVENT_ON_ADD_CONTEXT)
 
 
+class TelepatContextDeleteEvent(TelepatObjectEvent):
+    def __init__(self, obj, notification):
+        super(TelepatContextDeleteEvent, self).__init__(obj, notification, TM_EVENT_ON_DELETE_CONTEXT)
+
+
 class TelepatObjectAddEvent(TelepatObjectEvent):
     def __init__(self, obj, notification):
         super(TelepatObjectAddEvent, self).__init__(obj, notification, TM_EVENT_ON_ADD_OBJECT)
@@ -40,4 +45,12 @@ class TelepatObjectUpdateEvent(TelepatObjectEvent):
 
 class TelepatObjectDeleteEvent(TelepatObjectEvent):
     def __init__(self, obj, notification):
-        super(TelepatObjectDeleteEvent, self).__init__(obj, notification, TM_EVENT_ON_DELETE_OBJECT)
\ No newline at end of file
+        super(TelepatObjectDeleteEvent, self).__init__(obj, notification, TM_EVENT_ON_DELETE_OBJECT)
+
+
+class TelepatBatchEvent(QtCore.QEvent):
+    events = None
+
+    def __init__(self, events):
+        super(TelepatBatchEvent, self).__init__(TM_EVENT_ON_NOTIFICATION_BATCH)
+        self.events = events
\ No newline at end of file
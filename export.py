@@ -0,0 +1,269 @@
+import csv
+import io
+import json
+import os
+from PyQt5 import QtCore, QtWidgets
+from requests.exceptions import RequestException
+from telepat import TelepatBaseObject, TelepatError
+from settings import tmsettings
+from workers import BaseWorker, response_content
+from modelbrowser import BrowserModel
+import errors
+import console
+import scheduler
+import subscriptions
+
+DEFAULT_CHUNK_SIZE = 1000  # objects formatted per write
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+FORMAT_JSONL = "jsonl"
+FORMAT_CSV = "csv"
+FILE_FILTERS = "JSON lines (*.jsonl);;CSV (*.csv)"
+
+
+def plain(obj):
+    return obj.to_json() if isinstance(obj, TelepatBaseObject) else obj
+
+
+class ColumnSet(object):
+    # Columns in the order they are first seen, "id" first, like the browser
+    def __init__(self, ignored=BrowserModel.ignored_colums):
+        self.columns = []
+        self.known = set(ignored)
+
+    def add(self, objects):
+        columns = {}
+        for obj in objects:
+            columns.update(dict.fromkeys(key for key in obj if not key in self.known))
+        columns = list(columns)
+        if not self.columns and "id" in columns:
+            columns.insert(0, columns.pop(columns.index("id")))
+        self.known.update(columns)
+        self.columns.extend(columns)
+        return columns
+
+
+class JsonlWriter(object):
+    def __init__(self, path, buffer_size=DEFAULT_BUFFER_SIZE):
+        self.path = path
+        self.file = open(path, "w", encoding="utf-8", buffering=buffer_size)
+        self.written = 0
+
+    def write(self, objects):
+        self.file.write("".join(json.dumps(plain(obj), default=str, separators=(",", ":")) + "\n" for obj in objects))
+        self.written += len(objects)
+
+    def close(self):
+        self.file.close()
+
+
+class CsvWriter(object):
+    # The header holds the columns of the first chunk. Rows only ever gain
+    # columns at the end, so when later chunks bring new ones the file is
+    # copied once on close, row by row, under the full header.
+    def __init__(self, path, buffer_size=DEFAULT_BUFFER_SIZE, ignored=BrowserModel.ignored_colums):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.file = open(path, "w", encoding="utf-8", newline="", buffering=buffer_size)
+        self.columns = ColumnSet(ignored)
+        self.header = None
+        self.written = 0
+
+    def cell(self, value):
+        if value is None:
+            return ""
+        if isinstance(value, (dict, list, bool)):
+            return json.dumps(value, default=str, separators=(",", ":"))
+        return value
+
+    def write(self, objects):
+        objects = [plain(obj) for obj in objects]
+        self.columns.add(objects)
+        chunk = io.StringIO()
+        writer = csv.writer(chunk)
+        if self.header is None:
+            self.header = list(self.columns.columns)
+            writer.writerow(self.header)
+        columns = self.columns.columns
+        for obj in objects:
+            writer.writerow([self.cell(obj.get(column)) for column in columns])
+        self.file.write(chunk.getvalue())
+        self.written += len(objects)
+
+    def close(self):
+        self.file.close()
+        if self.header is not None and len(self.header) < len(self.columns.columns):
+            self.rewrite_header()
+
+    def rewrite_header(self):
+        columns = self.columns.columns
+        temp_path = self.path + ".tmp"
+        with open(self.path, encoding="utf-8", newline="", buffering=self.buffer_size) as source, \
+                open(temp_path, "w", encoding="utf-8", newline="", buffering=self.buffer_size) as target:
+            reader = csv.reader(source)
+            writer = csv.writer(target)
+            next(reader)
+            writer.writerow(columns)
+            for row in reader:
+                writer.writerow(row + [""] * (len(columns) - len(row)))
+        os.replace(temp_path, self.path)
+
+
+def file_format(path):
+    return FORMAT_CSV if path.lower().endswith(".csv") else FORMAT_JSONL
+
+def open_writer(path, several_models=False):
+    buffer_size = tmsettings.value("exportBufferSize", DEFAULT_BUFFER_SIZE, type=int)
+    if file_format(path) == FORMAT_JSONL:
+        return JsonlWriter(path, buffer_size)
+    # Rows of different models are told apart by their model column
+    ignored = [column for column in BrowserModel.ignored_colums if not (several_models and column == "model")]
+    return CsvWriter(path, buffer_size, ignored)
+
+
+# Writes the objects of one or more models to a file as they are received.
+# Nothing goes through a BrowserModel: the subscription's content is written
+# in chunks as plain dicts and the model is dropped before the next one.
+class ExportWorker(BaseWorker):
+    success = QtCore.pyqtSignal(int, int)
+    failed = QtCore.pyqtSignal(int, str)
+    progress = QtCore.pyqtSignal(int, int)
+
+    def __init__(self, parent, path, targets, chunk_size=None):
+        # targets are (context, model name, objects) tuples, the objects of
+        # a warm subscription or None to subscribe for them
+        super(ExportWorker, self).__init__(parent)
+        self.path = path
+        self.targets = targets
+        self.chunk_size = chunk_size or tmsettings.value("exportChunkSize", DEFAULT_CHUNK_SIZE, type=int)
+
+    def fetch(self, telepat, context, model_name):
+        with self.timed("network"):
+            channel, subscribe_response = telepat.subscribe(context, model_name, TelepatBaseObject)
+        if subscribe_response.status != 200:
+            self.log.emit("Error {0} while subscribing to {1}: {2}".format(subscribe_response.status, model_name, subscribe_response.message))
+            return None
+        with self.timed("decode"):
+            objects = response_content(subscribe_response) or []
+        try:
+            telepat.remove_subscription(channel)
+        except RequestException as e:
+            self.log.emit("Connection error: {0}".format(str(e)))
+        except TelepatError as e:
+            self.log.emit("Error while unsubscribing from {0}: {1}".format(model_name, e))
+        return objects if isinstance(objects, list) else [objects]
+
+    def run(self):
+        telepat = QtCore.QCoreApplication.instance().telepat_instance
+        failures = 0
+        several_models = len(set(model_name for context, model_name, objects in self.targets)) > 1
+        try:
+            writer = open_writer(self.path, several_models)
+        except OSError as e:
+            self.failed.emit(errors.TELEPAT_GENERAL_ERROR, "Cannot write {0}: {1}".format(self.path, e))
+            return
+
+        try:
+            for context, model_name, objects in self.targets:
+                if self.cancelled:
+                    break
+                if objects is None:
+                    # A model that cannot be fetched is counted and skipped
+                    try:
+                        objects = self.fetch(telepat, context, model_name)
+                    except RequestException as e:
+                        self.log.emit("Connection error: {0}".format(str(e)))
+                    except (TelepatError, ValueError) as e:
+                        self.log.emit("Error while fetching {0}: {1}".format(model_name, e))
+                    if objects is None:
+                        failures += 1
+                        continue
+                with self.timed("write"):
+                    for start in range(0, len(objects), self.chunk_size):
+                        if self.cancelled:
+                            break
+                        writer.write(objects[start:start + self.chunk_size])
+                        self.progress.emit(writer.written, failures)
+                objects = None
+            writer.close()
+        except OSError as e:
+            self.failed.emit(errors.TELEPAT_GENERAL_ERROR, "Cannot write {0}: {1}".format(self.path, e))
+            return
+
+        self.log.emit("Exported {0} objects to {1}".format(writer.written, self.path))
+        if failures and not writer.written:
+            self.failed.emit(errors.TELEPAT_GENERAL_ERROR, "Failed to fetch {0} models".format(failures))
+        else:
+            self.success.emit(writer.written, failures)
+
+
+def export_objects(parent, targets, default_name):
+    # targets are (context, model name) pairs. Channels the manager holds
+    # are not subscribed again, their objects are exported once all are in.
+    path, _ = QtWidgets.QFileDialog.getSaveFileName(parent, "Export objects", default_name, FILE_FILTERS)
+    if not path:
+        return None
+
+    manager = subscriptions.get_manager()
+    held = []
+    for context, model_name in targets:
+        subscription = manager.subscriptions.get(manager.key(context, model_name))
+        if subscription is not None and subscription.state != subscriptions.FAILED:
+            held.append(manager.acquire(context, model_name))
+
+    progress = QtWidgets.QProgressDialog("Exporting objects...", "Cancel", 0, 0, parent)
+    progress.setWindowModality(QtCore.Qt.WindowModal)
+    progress.setMinimumDuration(500)
+    worker = None
+
+    def release():
+        for subscription in held:
+            manager.release(subscription)
+        held.clear()
+
+    def export_progress(written, failures):
+        progress.setLabelText("{0} objects exported...".format(written))
+
+    def export_success(written, failures):
+        progress.reset()
+        message = "Exported {0} objects to {1}".format(written, path)
+        if failures:
+            message += ", {0} models failed, see the log".format(failures)
+            QtWidgets.QMessageBox.warning(parent, "Export", message)
+        console.log(message)
+
+    def export_failed(err_code, err_message):
+        progress.reset()
+        QtWidgets.QMessageBox.critical(parent, "Export error", "Error {0}: {1}".format(err_code, err_message))
+
+    def export_cancelled():
+        release()
+        if worker is not None:
+            worker.cancel()
+            console.log("Export to {0} cancelled".format(path))
+
+    def start():
+        nonlocal worker
+        warm = {subscription.key: subscription.object_list() for subscription in held if subscription.state == subscriptions.READY}
+        release()
+        worker = ExportWorker(None, path, [(context, model_name, warm.get(manager.key(context, model_name)))
+                                           for context, model_name in targets])
+        worker.progress.connect(export_progress)
+        worker.success.connect(export_success)
+        worker.failed.connect(export_failed)
+        worker.log.connect(console.log)
+        scheduler.submit(worker)
+
+    def subscription_settled(*args):
+        if progress.wasCanceled() or worker is not None:
+            return
+        if all(subscription.state != subscriptions.SUBSCRIBING for subscription in held):
+            start()
+
+    progress.canceled.connect(export_cancelled)
+    pending = [subscription for subscription in held if subscription.state == subscriptions.SUBSCRIBING]
+    for subscription in pending:
+        subscription.ready.connect(subscription_settled)
+        subscription.failed.connect(subscription_settled)
+    if not pending:
+        start()
+    return progress
@@ -0,0 +1,132 @@
+import sys
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from settings import tmsettings
+import instrumentation
+
+DEFAULT_POOL_SIZE = 10  # connections kept alive per host
+DEFAULT_CONNECT_TIMEOUT = 5  # seconds
+DEFAULT_READ_TIMEOUT = 60  # seconds
+
+
+class PooledAdapter(HTTPAdapter):
+    # Applies the default timeout to requests that don't set one
+    def __init__(self, timeout, **kwargs):
+        self.timeout = timeout
+        super(PooledAdapter, self).__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        return super(PooledAdapter, self).send(request, timeout=timeout or self.timeout, **kwargs)
+
+
+def server_key(url):
+    parts = urlsplit(url)
+    return (parts.scheme, parts.netloc)
+
+
+def create_session(pool_size=None):
+    pool_size = pool_size or tmsettings.value("httpPoolSize", DEFAULT_POOL_SIZE, type=int)
+    timeout = (tmsettings.value("httpConnectTimeout", DEFAULT_CONNECT_TIMEOUT, type=float),
+               tmsettings.value("httpReadTimeout", DEFAULT_READ_TIMEOUT, type=float))
+    session = requests.Session()
+    # Workers firing at once wait for a free connection instead of opening
+    # throwaway ones past the pool size
+    adapter = PooledAdapter(timeout, pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Accept-Encoding"] = "gzip, deflate"
+    if not tmsettings.value("httpKeepAlive", True, type=bool):
+        session.headers["Connection"] = "close"
+    session.hooks["response"].append(record_response)
+    return session
+
+
+def record_response(response, *args, **kwargs):
+    instrumentation.record("HTTP.request", response.elapsed.total_seconds())
+
+
+# One session per server, shared by every worker thread and kept across
+# reconnects and app switches so their connections are reused
+sessions = {}
+sessions_lock = threading.Lock()
+
+def get_session(url, pool_size=None):
+    key = server_key(url)
+    with sessions_lock:
+        session = sessions.get(key)
+        if session is None:
+            session = sessions[key] = create_session(pool_size)
+    return session
+
+
+class SessionRouter:
+    # Stands in for the requests module inside the telepat client, sending
+    # each call through the session of the server it is addressed to
+    def request(self, method, url, **kwargs):
+        return get_session(url).request(method, url, **kwargs)
+
+    def get(self, url, params=None, **kwargs):
+        return self.request("GET", url, params=params, **kwargs)
+
+    def options(self, url, **kwargs):
+        return self.request("OPTIONS", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        kwargs.setdefault("allow_redirects", False)
+        return self.request("HEAD", url, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self.request("POST", url, data=data, json=json, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.request("PUT", url, data=data, **kwargs)
+
+    def patch(self, url, data=None, **kwargs):
+        return self.request("PATCH", url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def __getattr__(self, name):
+        # Exceptions, codes and the rest come from the real module
+        return getattr(requests, name)
+
+
+def install(telepat_instance, server_url, pool_size=None):
+    # Routes a Telepat client through the pooled session of its server
+    session = get_session(server_url, pool_size)
+    if hasattr(telepat_instance, "session"):
+        telepat_instance.session = session
+    module = sys.modules.get(type(telepat_instance).__module__)
+    if module is not None and getattr(module, "requests", None) is requests:
+        module.requests = SessionRouter()
+    return session
+
+
+def stats():
+    # Connections opened vs requests sent over all pools, the difference
+    # is the number of requests that reused a kept-alive connection
+    connections = 0
+    sent = 0
+    with sessions_lock:
+        adapters = set(adapter for session in sessions.values() for adapter in session.adapters.values())
+    for adapter in adapters:
+        for key in adapter.poolmanager.pools.keys():
+            pool = adapter.poolmanager.pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                sent += pool.num_requests
+    return {
+        "servers": len(sessions),
+        "requests": sent,
+        "connections": connections,
+        "reused": max(0, sent - connections)
+    }
+
+def summary():
+    stats_dict = stats()
+    if not stats_dict["requests"]:
+        return "HTTP: no requests yet"
+    return "HTTP: {requests} requests over {connections} connections ({reused} reused)".format(**stats_dict)
@@ -0,0 +1,419 @@
+import csv
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from PyQt5 import QtCore, QtWidgets
+from requests.exceptions import RequestException
+from telepat import TelepatBaseObject
+from models.telepatobject import TelepatObject
+from settings import tmsettings
+from workers import BaseWorker, SchemaWorker, response_content
+from export import file_format, FORMAT_CSV, FILE_FILTERS
+import errors
+import console
+import scheduler
+import subscriptions
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_PARALLELISM = 8
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_RETRY_DELAY = 0.5  # seconds, doubled on every retry
+MAX_RETRY_DELAY = 30
+METER_INTERVAL = 1.0  # seconds between objects/s lines in the console
+CHECKPOINT_INTERVAL = 1.0  # seconds between checkpoint saves
+CHECKPOINT_ROWS = 500  # rows done before the checkpoint is saved anyway
+# Set by the server on creation
+SKIPPED_FIELDS = set(TelepatObject._readonly_fields) | {"context_id", "model"}
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+def checkpoint_path(path):
+    return path + ".checkpoint"
+
+def rejected_path(path):
+    return path + ".rejected.jsonl"
+
+def load_checkpoint(path, context_id, model_name):
+    # The rows already done by an interrupted import of the same file
+    try:
+        with open(checkpoint_path(path), encoding="utf-8") as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+    except (OSError, ValueError):
+        return None
+    if checkpoint.get("context_id") != context_id or checkpoint.get("model") != model_name:
+        return None
+    return checkpoint
+
+
+def read_rows(path):
+    # (row number, values or None, error) for every row, read lazily
+    with open(path, encoding="utf-8", newline="") as source:
+        if file_format(path) == FORMAT_CSV:
+            for number, row in enumerate(csv.DictReader(source), 1):
+                yield number, {key: value for key, value in row.items() if key and value not in ("", None)}, None
+            return
+        number = 0
+        for line in source:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                values = json.loads(line)
+            except ValueError as e:
+                yield number, None, "Invalid JSON: {0}".format(e)
+                continue
+            if not isinstance(values, dict):
+                yield number, None, "Expected a JSON object"
+                continue
+            yield number, values, None
+
+
+def coerce(value, value_type):
+    # CSV cells are strings, they are converted to the schema's type. JSON
+    # values must already have it. Returns the value or raises ValueError.
+    if value is None or not value_type:
+        return value
+    if value_type == "string":
+        return value if isinstance(value, str) else json.dumps(value)
+    if value_type in ("number", "integer"):
+        if isinstance(value, bool):
+            raise ValueError("expected a number")
+        if isinstance(value, str):
+            value = float(value) if value_type == "number" and not value.lstrip("-").isdigit() else int(value)
+        if not isinstance(value, (int, float)) or value_type == "integer" and not isinstance(value, int):
+            raise ValueError("expected {0}".format("an integer" if value_type == "integer" else "a number"))
+        return value
+    if value_type == "boolean":
+        if isinstance(value, str):
+            lowered = value.lower()
+            if lowered in ("true", "1"):
+                return True
+            if lowered in ("false", "0"):
+                return False
+        if not isinstance(value, bool):
+            raise ValueError("expected true or false")
+        return value
+    if value_type in ("object", "array"):
+        if isinstance(value, str):
+            value = json.loads(value)
+        if not isinstance(value, dict if value_type == "object" else list):
+            raise ValueError("expected an {0}".format(value_type))
+        return value
+    return value
+
+
+# Creates the objects of a JSONL or CSV file in one model of a context. Rows
+# are read and validated a batch at a time, then created with a bounded
+# number of requests in flight; the next batch is only read once the
+# previous one is done, so a slow server slows the reading down instead of
+# queueing the whole file. Rows are checkpointed as their creates finish,
+# so an interrupted import resumes without creating them again; only the
+# creates in flight when it stopped may be sent twice. Rejected rows are
+# kept next to the file.
+class ImportWorker(BaseWorker):
+    success = QtCore.pyqtSignal(int, int)
+    failed = QtCore.pyqtSignal(int, str)
+    progress = QtCore.pyqtSignal(int, int, float)
+
+    def __init__(self, parent, path, context, model_name, app_schema, channel=None, related_ids=None, resume=False):
+        # related_ids holds the ids of related models already known, e.g.
+        # from warm subscriptions; the others are fetched when first needed
+        super(ImportWorker, self).__init__(parent)
+        self.path = path
+        self.context = context
+        self.model_name = model_name
+        self.app_schema = app_schema
+        self.channel = channel
+        self.related_ids = dict(related_ids or {})
+        self.resume = resume
+        # Every row up to the watermark is done, and these after it
+        self.watermark = 0
+        self.done_rows = set()
+        self.imported = 0
+        self.rejected = 0
+        self.session_imported = 0
+        self.rejected_file = None
+        # Rows are recorded by the thread that created them
+        self.record_lock = threading.Lock()
+        self.unsaved_rows = 0
+        self.next_checkpoint = 0
+        self.batch_size = max(1, tmsettings.value("importBatchSize", DEFAULT_BATCH_SIZE, type=int))
+        self.max_workers = max(1, tmsettings.value("importParallelism", DEFAULT_PARALLELISM, type=int))
+        self.max_retries = tmsettings.value("importMaxRetries", DEFAULT_MAX_RETRIES, type=int)
+        self.retry_delay = tmsettings.value("importRetryDelay", DEFAULT_RETRY_DELAY, type=float)
+        self.retries = 0
+
+        model_schema = app_schema[model_name] if model_name in app_schema else {}
+        self.properties = dict(model_schema.get("properties") or {})
+        # Fields named after a model hold the id of one of its objects, like
+        # the relations of the object editor
+        self.relations = {"{0}_id".format(name): name for name in app_schema}
+        if "user" in self.related_ids:
+            self.relations["user_id"] = "user"
+
+    def fetch_ids(self, telepat, model_name):
+        with self.timed("network"):
+            channel, subscribe_response = telepat.subscribe(self.context, model_name, TelepatBaseObject)
+        if subscribe_response.status != 200:
+            raise ValueError("cannot retrieve {0} objects: {1}".format(model_name, subscribe_response.message))
+        objects = response_content(subscribe_response) or []
+        objects = objects if isinstance(objects, list) else [objects]
+        try:
+            telepat.remove_subscription(channel)
+        except RequestException as e:
+            self.log.emit("Connection error: {0}".format(str(e)))
+        self.log.emit("Retrieved {0} {1} ids to check relations".format(len(objects), model_name))
+        return set(obj.get("id") for obj in objects)
+
+    def validate(self, telepat, values):
+        # Returns the values to create, raises ValueError for a rejected row
+        result = {}
+        for field, value in values.items():
+            if field in SKIPPED_FIELDS:
+                continue
+            value_type = (self.properties.get(field) or {}).get("type")
+            try:
+                value = coerce(value, value_type)
+            except ValueError as e:
+                raise ValueError("{0}: {1}".format(field, e))
+            related_model = self.relations.get(field)
+            if related_model and value is not None:
+                if not related_model in self.related_ids:
+                    try:
+                        self.related_ids[related_model] = self.fetch_ids(telepat, related_model)
+                    except (RequestException, ValueError) as e:
+                        # Not checked rather than rejecting every row
+                        self.log.emit("Relations to {0} are not checked, {1}".format(related_model, e))
+                        self.related_ids[related_model] = None
+                ids = self.related_ids[related_model]
+                if ids is not None and not value in ids:
+                    raise ValueError("{0}: no {1} with id {2}".format(field, related_model, value))
+            result[field] = value
+        result["context_id"] = self.context.id
+        result["model"] = self.model_name
+        return result
+
+    def retry_wait(self, attempt):
+        # Exponential with jitter, so throttled requests don't come back together
+        return min(MAX_RETRY_DELAY, self.retry_delay * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def create(self, values):
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.timed("network"):
+                    response = self.channel.add_object(TelepatBaseObject(values))
+                status, message = response.status, response.message
+            except RequestException as e:
+                status, message = errors.TELEPAT_CONNECTION_ERROR, "Connection error: {0}".format(e)
+            except Exception as e:
+                # A TelepatError or a bad response is not retried
+                return "Error {0}: {1}".format(errors.TELEPAT_GENERAL_ERROR, e)
+            if 200 <= status < 300:
+                return None
+            if attempt == self.max_retries or not (status in RETRY_STATUSES or status == errors.TELEPAT_CONNECTION_ERROR):
+                return "Error {0}: {1}".format(status, message)
+            self.retries += 1
+            time.sleep(self.retry_wait(attempt))
+
+    def record(self, number, values, error):
+        # Checkpointed by the thread that did the row, at most a second or
+        # CHECKPOINT_ROWS rows later, which bounds what a crash sends twice
+        with self.record_lock:
+            if error is None:
+                self.imported += 1
+                self.session_imported += 1
+            else:
+                self.rejected += 1
+                self.rejected_file.write(json.dumps({"row": number, "error": error, "values": values}, default=str) + "\n")
+                self.rejected_file.flush()
+            self.done_rows.add(number)
+            while self.watermark + 1 in self.done_rows:
+                self.watermark += 1
+                self.done_rows.remove(self.watermark)
+            self.unsaved_rows += 1
+            now = time.monotonic()
+            if self.unsaved_rows >= CHECKPOINT_ROWS or now >= self.next_checkpoint:
+                self.save_checkpoint()
+                self.unsaved_rows = 0
+                self.next_checkpoint = now + CHECKPOINT_INTERVAL
+
+    def create_row(self, number, values, validated):
+        self.record(number, values, self.create(validated))
+
+    def save_checkpoint(self):
+        temp_path = checkpoint_path(self.path) + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as checkpoint_file:
+            json.dump({"context_id": self.context.id, "model": self.model_name, "rows": self.watermark,
+                       "done": sorted(self.done_rows), "imported": self.imported, "rejected": self.rejected}, checkpoint_file)
+        os.replace(temp_path, checkpoint_path(self.path))
+
+    def run(self):
+        telepat = QtCore.QCoreApplication.instance().telepat_instance
+        subscribed = False
+        if self.channel is None:
+            try:
+                with self.timed("network"):
+                    self.channel, subscribe_response = telepat.subscribe(self.context, self.model_name, TelepatBaseObject)
+            except RequestException as e:
+                self.connection_error(e)
+                return
+            if subscribe_response.status != 200:
+                self.failed.emit(subscribe_response.status, subscribe_response.message)
+                return
+            subscribed = True
+
+        checkpoint = load_checkpoint(self.path, self.context.id, self.model_name) if self.resume else None
+        if checkpoint:
+            self.watermark = checkpoint["rows"]
+            self.done_rows = set(checkpoint.get("done", []))
+            self.imported = checkpoint["imported"]
+            self.rejected = checkpoint["rejected"]
+        started = time.perf_counter()
+        next_meter = started + METER_INTERVAL
+
+        try:
+            rows = read_rows(self.path)
+            with open(rejected_path(self.path), "a" if checkpoint else "w", encoding="utf-8") as self.rejected_file, \
+                    ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                while not self.cancelled:
+                    batch = list(itertools.islice(rows, self.batch_size))
+                    if not batch:
+                        break
+                    creates = []
+                    for number, values, error in batch:
+                        if number <= self.watermark or number in self.done_rows:
+                            continue
+                        if error is None:
+                            try:
+                                validated = self.validate(telepat, values)
+                                creates.append(executor.submit(self.create_row, number, values, validated))
+                                continue
+                            except ValueError as e:
+                                error = str(e)
+                        self.record(number, values, error)
+
+                    with self.timed("create"):
+                        for future in as_completed(creates):
+                            future.result()
+
+                    now = time.perf_counter()
+                    rate = self.session_imported / (now - started)
+                    self.progress.emit(self.imported, self.rejected, rate)
+                    if now >= next_meter:
+                        next_meter = now + METER_INTERVAL
+                        self.log.emit("Import into {0}: {1} objects created, {2} rejected ({3:.0f} objects/s)".format(
+                            self.model_name, self.imported, self.rejected, rate))
+        except OSError as e:
+            self.failed.emit(errors.TELEPAT_GENERAL_ERROR, "Cannot import {0}: {1}".format(self.path, e))
+            return
+        finally:
+            if self.unsaved_rows:
+                try:
+                    self.save_checkpoint()
+                except OSError as e:
+                    self.log.emit("Cannot save the import checkpoint: {0}".format(e))
+            if subscribed:
+                try:
+                    telepat.remove_subscription(self.channel)
+                except RequestException as e:
+                    self.log.emit("Connection error: {0}".format(str(e)))
+
+        elapsed = time.perf_counter() - started
+        if self.cancelled:
+            self.log.emit("Import into {0} stopped after {1} rows, it can be resumed".format(self.model_name, self.watermark + len(self.done_rows)))
+            return
+        if os.path.exists(checkpoint_path(self.path)):
+            os.remove(checkpoint_path(self.path))
+        if not self.rejected:
+            os.remove(rejected_path(self.path))
+        self.log.emit("Imported {0} {1} objects in {2:.1f}s ({3:.0f} objects/s), {4} rejected, {5} retries".format(
+            self.imported, self.model_name, elapsed, self.session_imported / elapsed if elapsed else 0, self.rejected, self.retries))
+        self.success.emit(self.imported, self.rejected)
+
+
+def import_objects(parent, context, model_name, user_directory=None):
+    path, _ = QtWidgets.QFileDialog.getOpenFileName(parent, "Import {0} objects".format(model_name), "", FILE_FILTERS)
+    if not path:
+        return None
+
+    resume = False
+    checkpoint = load_checkpoint(path, context.id, model_name)
+    if checkpoint:
+        answer = QtWidgets.QMessageBox.question(parent, "Import", "An earlier import of this file stopped after {0} rows. Resume without "
+            "the rows it already did?".format(checkpoint["rows"] + len(checkpoint.get("done", []))),
+            QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No | QtWidgets.QMessageBox.Cancel)
+        if answer == QtWidgets.QMessageBox.Cancel:
+            return None
+        resume = answer == QtWidgets.QMessageBox.Yes
+
+    # Warm channels are used as they are: the target model's to create
+    # objects, the others' objects for the relations
+    manager = subscriptions.get_manager()
+    held = []
+    progress = QtWidgets.QProgressDialog("Importing {0} objects...".format(model_name), "Cancel", 0, 0, parent)
+    progress.setWindowModality(QtCore.Qt.WindowModal)
+    progress.setMinimumDuration(500)
+    worker = None
+
+    def release():
+        for subscription in held:
+            manager.release(subscription)
+        held.clear()
+
+    def import_progress(imported, rejected, rate):
+        progress.setLabelText("{0} objects created, {1} rejected ({2:.0f} objects/s)...".format(imported, rejected, rate))
+
+    def import_success(imported, rejected):
+        release()
+        progress.reset()
+        if rejected:
+            QtWidgets.QMessageBox.warning(parent, "Import", "{0} objects created, {1} rows rejected, see {2}".format(
+                imported, rejected, rejected_path(path)))
+
+    def import_failed(err_code, err_message):
+        release()
+        progress.reset()
+        QtWidgets.QMessageBox.critical(parent, "Import error", "Error {0}: {1}".format(err_code, err_message))
+
+    def import_cancelled():
+        if worker is not None and not worker.isFinished():
+            # The batch in flight is finished and checkpointed first
+            worker.cancel()
+            worker.finished.connect(release)
+        else:
+            release()
+
+    def schema_success(app_schema):
+        nonlocal worker
+        if progress.wasCanceled():
+            return
+        related_ids = {}
+        for name in app_schema:
+            subscription = manager.lookup(context, name)
+            if subscription is not None:
+                related_ids[name] = set(subscription.objects)
+        if user_directory is not None and user_directory.complete:
+            related_ids["user"] = set(user_directory.users)
+        channel = None
+        subscription = manager.lookup(context, model_name)
+        if subscription is not None:
+            held.append(manager.acquire(context, model_name))
+            channel = subscription.channel
+        worker = ImportWorker(None, path, context, model_name, app_schema, channel, related_ids, resume)
+        worker.progress.connect(import_progress)
+        worker.success.connect(import_success)
+        worker.failed.connect(import_failed)
+        worker.log.connect(console.log)
+        scheduler.submit(worker)
+
+    schema_worker = SchemaWorker()
+    schema_worker.success.connect(schema_success)
+    schema_worker.failed.connect(import_failed)
+    schema_worker.log.connect(console.log)
+    progress.canceled.connect(import_cancelled)
+    scheduler.submit(schema_worker)
+    return progress
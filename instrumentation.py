@@ -0,0 +1,163 @@
+import collections
+import contextlib
+import cProfile
+import functools
+import io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+from settings import tmsettings
+
+DEFAULT_SAMPLES = 1000  # kept per metric for the percentiles
+PROFILE_LINES = 40
+PERCENTILES = (50, 90, 99)
+
+
+class Metric:
+    def __init__(self, max_samples):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = collections.deque(maxlen=max_samples)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.samples.append(value)
+
+    def summary(self):
+        samples = sorted(self.samples)
+        summary = {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max
+        }
+        for percentile in PERCENTILES:
+            index = min(len(samples) - 1, len(samples) * percentile // 100)
+            summary["p{0}".format(percentile)] = samples[index] if samples else 0.0
+        return summary
+
+
+# Durations (in seconds) are recorded under dotted names such as
+# "ContextsWorker.network" or "BrowserModel.insert". Recording is cheap and
+# thread safe, so it stays on all the time.
+class Recorder:
+    def __init__(self, max_samples=DEFAULT_SAMPLES):
+        self.max_samples = max_samples
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def record(self, name, value):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = Metric(self.max_samples)
+            metric.add(value)
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def summary(self):
+        with self.lock:
+            return {name: metric.summary() for name, metric in self.metrics.items()}
+
+    def reset(self):
+        with self.lock:
+            self.metrics = {}
+            self.started = time.time()
+
+
+# Optional, expensive collectors toggled from the View menu
+class Profiler:
+    def __init__(self):
+        self.cpu = None
+        self.reports = collections.OrderedDict()
+
+    def cpu_running(self):
+        return self.cpu is not None
+
+    def start_cpu(self):
+        if self.cpu is None:
+            self.cpu = cProfile.Profile()
+            # Only the GUI thread is profiled, workers are covered by their metrics
+            self.cpu.enable()
+
+    def stop_cpu(self):
+        if self.cpu is None:
+            return ""
+        self.cpu.disable()
+        stream = io.StringIO()
+        pstats.Stats(self.cpu, stream=stream).sort_stats("cumulative").print_stats(PROFILE_LINES)
+        self.cpu = None
+        self.reports["cpu"] = stream.getvalue()
+        return self.reports["cpu"]
+
+    def memory_running(self):
+        return tracemalloc.is_tracing()
+
+    def start_memory(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def stop_memory(self):
+        if not tracemalloc.is_tracing():
+            return ""
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        lines = ["Traced memory: {0:.1f} MiB current, {1:.1f} MiB peak".format(current / 1048576, peak / 1048576)]
+        lines.extend(str(stat) for stat in snapshot.statistics("lineno")[:PROFILE_LINES])
+        self.reports["memory"] = "\n".join(lines)
+        return self.reports["memory"]
+
+
+recorder = None
+profiler = Profiler()
+recorder_lock = threading.Lock()
+
+def get_recorder():
+    global recorder
+    with recorder_lock:
+        if recorder is None:
+            recorder = Recorder(tmsettings.value("instrumentationSamples", DEFAULT_SAMPLES, type=int))
+    return recorder
+
+def record(name, value):
+    get_recorder().record(name, value)
+
+def timed(name):
+    return get_recorder().timed(name)
+
+def instrumented(name):
+    # Decorator recording every call of a method under name
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def summary():
+    return get_recorder().summary()
+
+def export(path):
+    report = {
+        "started": get_recorder().started,
+        "exported": time.time(),
+        "metrics": summary(),
+        "profiles": dict(profiler.reports)
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    return len(report["metrics"])
@@ -1,12 +1,16 @@
 #! /usr/bin/env python
+import startup
 import os
 import sys
 import iconrc
-from PyQt5 import QtWidgets
+from PyQt5 import QtCore, QtWidgets
 from telepatmanager import TelepatManager
 
+startup.mark("imports")
+
 class TelepatManagerApplication(QtWidgets.QApplication):
     telepat_instance = None
+    server_url = None
     
     def __init__(self, args):
         super(TelepatManagerApplication, self).__init__(args)
@@ -14,6 +18,9 @@ class TelepatManagerApplication(QtWidgets.QApplication):
 if __name__ == "__main__":
     app = TelepatManagerApplication(sys.argv)
     win = TelepatManager()
+    startup.mark("main window created")
     win.show()
+    # Runs once the event loop has painted the window
+    QtCore.QTimer.singleShot(0, lambda: startup.mark("first window shown"))
     sys.excepthook = win.excepthook
     os._exit(app.exec_())
@@ -1,167 +1,680 @@
+import collections
 from PyQt5 import Qt, QtGui, QtWidgets, QtCore
 import telepat
-from telepat.models import TelepatBaseObject
 from models.telepatobject import TelepatObject
-from workers import SubscribeWorker, UnsubscribeWorker
-from objecteditor import ObjectEditor
-from event import TelepatObjectUpdateEvent
+from workers import ObjectPatchWorker
+from searchindex import SearchIndex, parse_query
+from event import TelepatObjectAddEvent, TelepatObjectUpdateEvent, TelepatObjectDeleteEvent, TelepatBatchEvent
 import console
+import scheduler
+import subscriptions
+from settings import tmsettings
+from snapshots import same_version
+from instrumentation import instrumented
+
+FILTER_DELAY = 150  # ms
+DEFAULT_PAGE_SIZE = 1000
 
 
 class ModelSortFilterProxyModel(QtCore.QSortFilterProxyModel):
+    query = ""
+
+    @instrumented("ModelBrowser.filter")
+    def setQuery(self, text):
+        if text == self.query:
+            return
+        self.query = text
+        model = self.sourceModel()
+        model.search(parse_query(text, model.columns))
+        self.invalidateFilter()
+
     def filterAcceptsRow(self, row_num, parent):
         model = self.sourceModel()
-        text = self.filterRegExp().pattern()
-        if not len(text): 
+        if model.search_index is None:
             return True
+        return model.search_index.accepts(model.ids[row_num])
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        # Sorting is done once by the source model on raw values instead of
+        # calling lessThan() on display strings for every comparison
+        if self.sourceModel() and column >= 0:
+            self.sourceModel().sort(column, order)
 
-        row = [model.item(row_num, column_num) for column_num in range(model.columnCount())]
-        tests = []
-        for col in range(0, len(row)-1):
-            tests.append(text.lower() in row[col].text().lower())
 
-        return True in tests
+def sorted_rows(values, reverse=False):
+    # Numbers sort before strings, which sort before everything else
+    numbers, strings, others = [], [], []
+    for row, value in enumerate(values):
+        if isinstance(value, str):
+            strings.append(row)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            numbers.append(row)
+        else:
+            others.append(row)
+    numbers.sort(key=values.__getitem__, reverse=reverse)
+    lowered = {row: values[row].lower() for row in strings}
+    strings.sort(key=lowered.__getitem__, reverse=reverse)
+    if reverse:
+        return others + strings + numbers
+    return numbers + strings + others
 
 
-class BrowserModel(QtGui.QStandardItemModel):
+class BrowserModel(QtCore.QAbstractTableModel):
     ignored_colums = ["type", "application_id", "context_id", "model"]
+    # Emitted whenever pages are received or inserted
+    pages_changed = QtCore.pyqtSignal()
 
-    def __init__(self, parent, objects):
+    def __init__(self, parent, objects, total=None):
+        # Objects can be handed in all at once, or as a first page followed
+        # by add_page() calls. Received pages are only inserted when the
+        # view scrolls to the end (fetchMore) so a huge model doesn't block
+        # the UI.
         super(BrowserModel, self).__init__(parent)
-        self.objects = objects
+        objects = objects if isinstance(objects, list) else [objects]
+        self.objects = []
+        self.ids = []
+        self.rows = {}
+        self.columns = []
+        self.column_index = {}
+        self.sorted_by = None
+        self.search_index = None
+        self.pending = collections.deque()
+        self.removed_ids = set()
+        self.received = len(objects)
+        self.total = self.received if total is None else total
+        # Once sorted or filtered, every received page is inserted right away
+        self.eager = False
+        # Ids seen in server pages while reconciling a snapshot, and ids
+        # changed by notifications in the meantime
+        self.reconcile_seen = None
+        self.notified = set()
+        self.resort_by = None
+        self.resortTimer = QtCore.QTimer(self)
+        self.resortTimer.setSingleShot(True)
+        self.resortTimer.timeout.connect(self.resort)
+        self.insert_objects(objects)
 
-        # Create a list of columns
-        columns = []
+    def page_columns(self, objects):
+        # Columns are added in the order they are first seen
+        columns = {}
         for obj in objects:
-            for key in obj.keys():
-                if not key in columns and not key in self.ignored_colums:
-                    columns.append(key)
+            columns.update(dict.fromkeys(obj.keys()))
+        columns = list(columns)
 
         # Move "id" at the first column
-        if "id" in columns:
+        if not self.columns and "id" in columns:
             columns.insert(0, columns.pop(columns.index("id")))
-        self.setColumnCount(len(columns))
-        self.setHorizontalHeaderLabels(columns)
+        return columns
 
-        # Populate according to columns
+    def add_page(self, objects):
+        if self.reconcile_seen is not None:
+            self.reconcile_page(objects)
+            return
+        self.received += len(objects)
+        if self.eager or not self.objects and not self.pending:
+            self.insert_objects(objects)
+            if self.eager and self.resort_by:
+                # Pages usually arrive in a burst, sort once after the last
+                self.resortTimer.start(0)
+        else:
+            self.pending.append(objects)
+        self.pages_changed.emit()
+
+    def begin_reconcile(self, total):
+        # The model was filled from a snapshot, the server's pages now replace
+        # what changed and whatever they don't contain is removed at the end
+        self.fetch_all()
+        self.eager = True
+        self.received = 0
+        self.total = total
+        self.reconcile_seen = set()
+        self.notified = set()
+        if not total:
+            self.end_reconcile()
+        self.pages_changed.emit()
+
+    @instrumented("BrowserModel.reconcile_page")
+    def reconcile_page(self, objects):
+        seen = self.reconcile_seen
+        rows = self.rows
+        added = []
         for obj in objects:
-            items_row = []
-            for col in columns:
-                if col in obj.keys():
-                    if isinstance(obj[col], str) or isinstance(obj[col], int):
-                        items_row.append(QtGui.QStandardItem(str(obj[col])))
-                    elif isinstance(obj[col], dict):
-                        items_row.append(QtGui.QStandardItem("[ Object ]"))
-                    else:
-                        items_row.append(QtGui.QStandardItem(""))
-                else:
-                    items_row.append(QtGui.QStandardItem(""))
-            self.appendRow(items_row)
+            seen.add(obj.id)
+            # Notifications are newer than the subscription's answer
+            if obj.id in self.notified:
+                continue
+            row = rows.get(obj.id, -1)
+            if row < 0:
+                added.append(obj)
+            elif not same_version(self.objects[row], obj):
+                self.replace_object(row, obj)
+        self.insert_objects(added)
+        self.received += len(objects)
+        if self.received >= self.total:
+            self.end_reconcile()
+        self.pages_changed.emit()
+
+    def end_reconcile(self):
+        seen = self.reconcile_seen
+        self.remove_rows([row for row, object_id in enumerate(self.ids) if not object_id in seen])
+        self.reconcile_seen = None
+        self.notified = set()
+        if self.resort_by:
+            self.resortTimer.start(0)
+
+    def replace_object(self, row, obj, column=-1):
+        self.objects[row] = obj
+        self.sorted_by = None
+        self.add_columns(obj.keys())
+        if self.search_index is not None:
+            self.search_index.set_text(obj.id, self.search_text(obj))
+        if column < 0:
+            self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.columns) - 1))
+        else:
+            index = self.index(row, column)
+            self.dataChanged.emit(index, index)
+
+    @instrumented("BrowserModel.remove_rows")
+    def remove_rows(self, rows):
+        # Removes contiguous ranges from the bottom up, then renumbers once
+        if not rows:
+            return
+        ranges = []
+        for row in sorted(rows):
+            if ranges and ranges[-1][1] == row - 1:
+                ranges[-1][1] = row
+            else:
+                ranges.append([row, row])
+        for first, last in reversed(ranges):
+            self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+            for object_id in self.ids[first:last + 1]:
+                del self.rows[object_id]
+                if self.search_index is not None:
+                    self.search_index.remove(object_id)
+            del self.objects[first:last + 1]
+            del self.ids[first:last + 1]
+            self.endRemoveRows()
+        self.reindex()
+
+    def loading(self):
+        return self.received < self.total
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        return not parent.isValid() and bool(self.pending)
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        if parent.isValid() or not self.pending:
+            return
+        self.insert_objects(self.pending.popleft())
+        self.pages_changed.emit()
+
+    def fetch_all(self):
+        if not self.pending:
+            return
+        objects = []
+        while self.pending:
+            objects.extend(self.pending.popleft())
+        self.insert_objects(objects)
+        self.pages_changed.emit()
+
+    @instrumented("BrowserModel.insert")
+    def insert_objects(self, objects):
+        rows = self.rows
+        removed_ids = self.removed_ids
+        # Notifications may have added or deleted objects of pending pages
+        objects = [obj for obj in objects if not obj.id in rows and not obj.id in removed_ids]
+        if not objects:
+            return
+        self.add_columns(self.page_columns(objects))
+        first = len(self.objects)
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(objects) - 1)
+        self.objects.extend(objects)
+        self.ids.extend(obj.id for obj in objects)
+        self.reindex(first)
+        if self.search_index is not None:
+            for obj in objects:
+                self.search_index.set_text(obj.id, self.search_text(obj))
+        self.sorted_by = None
+        self.endInsertRows()
+
+    def resort(self):
+        if self.sorted_by is None and self.resort_by:
+            self.sort(*self.resort_by)
+
+    def reindex(self, start=0):
+        if start == 0:
+            self.ids = [obj.id for obj in self.objects]
+            self.rows = {object_id: row for row, object_id in enumerate(self.ids)}
+            return
+        rows = self.rows
+        ids = self.ids
+        for row in range(start, len(ids)):
+            rows[ids[row]] = row
+
+    def row_for_id(self, object_id):
+        return self.rows.get(object_id, -1)
+
+    def add_columns(self, keys):
+        keys = [key for key in keys if not key in self.column_index and not key in self.ignored_colums]
+        if not keys:
+            return
+        first = len(self.columns)
+        self.beginInsertColumns(QtCore.QModelIndex(), first, first + len(keys) - 1)
+        for key in keys:
+            self.column_index[key] = len(self.columns)
+            self.columns.append(key)
+        self.endInsertColumns()
+
+    def changed_column(self, path, object_id):
+        # Paths look like "model/object_id/field/subfield", the cell to
+        # update is the top level field right after the object id
+        segments = path.split('/') if path else []
+        if object_id in segments:
+            segments = segments[segments.index(object_id) + 1:]
+        for segment in segments:
+            if segment in self.column_index:
+                return self.column_index[segment]
+        return -1
+
+    def search_text(self, obj):
+        parts = []
+        for key in obj.keys():
+            if key in self.ignored_colums:
+                continue
+            value = obj[key]
+            if isinstance(value, str) or isinstance(value, int):
+                parts.append(str(value))
+            elif isinstance(value, dict):
+                parts.append("[ Object ]")
+        return "\n".join(parts)
+
+    @instrumented("BrowserModel.search")
+    def search(self, terms):
+        # The index is only built the first time someone filters this model
+        if self.search_index is None:
+            if not terms:
+                return
+            self.eager = True
+            self.fetch_all()
+            self.search_index = SearchIndex(lambda object_id, column: self.display_text(self.rows[object_id], column))
+            for obj in self.objects:
+                self.search_index.set_text(obj.id, self.search_text(obj))
+        self.search_index.search(terms)
+
+    def display_text(self, row, column):
+        obj = self.objects[row]
+        key = self.columns[column]
+        if not key in obj:
+            return ""
+        value = obj[key]
+        if isinstance(value, str) or isinstance(value, int):
+            return str(value)
+        elif isinstance(value, dict):
+            return "[ Object ]"
+        return ""
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.objects)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and index.isValid():
+            return self.display_text(index.row(), index.column())
+        return QtCore.QVariant()
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole and section < len(self.columns):
+            return self.columns[section]
+        return QtCore.QVariant()
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        if column < 0 or column >= len(self.columns):
+            return
+        # The header and the view both ask for the same sort
+        if self.sorted_by == (column, order):
+            return
+        self.sort_rows(column, order)
+
+    @instrumented("BrowserModel.sort")
+    def sort_rows(self, column, order):
+        # Sorting only makes sense over everything that was received
+        self.eager = True
+        self.fetch_all()
+        self.sorted_by = (column, order)
+        self.resort_by = self.sorted_by
+        key = self.columns[column]
+        self.layoutAboutToBeChanged.emit()
+        old_objects = self.objects
+        values = [obj[key] if key in obj else None for obj in old_objects]
+        order_rows = sorted_rows(values, order == QtCore.Qt.DescendingOrder)
+        self.objects = [old_objects[row] for row in order_rows]
+        self.reindex()
+        new_rows = {old_row: new_row for new_row, old_row in enumerate(order_rows)}
+        old_indexes = self.persistentIndexList()
+        new_indexes = [self.index(new_rows[index.row()], index.column()) for index in old_indexes]
+        self.changePersistentIndexList(old_indexes, new_indexes)
+        self.layoutChanged.emit()
 
     def event(self, event):
-        if isinstance(event, TelepatObjectUpdateEvent):
-            updated_object = event.obj
-            changed_property = event.notification.path.split('/')[-1:][0]
-            # update the internal objects storage
-            for n, i in enumerate(self.objects):
-                if i.id == updated_object.id:
-                    self.objects[n] = updated_object
-                    break
-
-            # update the UI
-            i = 0
-            while self.item(i):
-                obj_id = self.item(i).text()
-                if obj_id == updated_object.id:
-                    for j in range(0, self.columnCount()):
-                        if self.headerData(j, QtCore.Qt.Horizontal, QtCore.Qt.DisplayRole) == changed_property:
-                            self.setData(self.index(i, j), event.notification.value)
-                    break
-                i += 1
+        if isinstance(event, TelepatBatchEvent):
+            for object_event in event.events:
+                self.process_object_event(object_event)
+            return True
+        self.process_object_event(event)
         return super(BrowserModel, self).event(event)
 
+    def process_object_event(self, event):
+        if isinstance(event, TelepatObjectUpdateEvent):
+            self.process_object_update_event(event)
+        elif isinstance(event, TelepatObjectAddEvent):
+            self.process_object_add_event(event)
+        elif isinstance(event, TelepatObjectDeleteEvent):
+            self.process_object_delete_event(event)
+
+    def process_object_update_event(self, event):
+        updated_object = event.obj
+        row = self.rows.get(updated_object.id, -1)
+        if row < 0:
+            self.process_object_add_event(event)
+            return
+
+        if self.reconcile_seen is not None:
+            self.notified.add(updated_object.id)
+            self.reconcile_seen.add(updated_object.id)
+        column = self.changed_column(event.notification.path, updated_object.id)
+        self.replace_object(row, updated_object, column)
+
+    def process_object_add_event(self, event):
+        new_object = event.obj
+        if new_object.id in self.rows:
+            self.process_object_update_event(event)
+            return
+        if self.reconcile_seen is not None:
+            self.notified.add(new_object.id)
+            self.reconcile_seen.add(new_object.id)
+
+        self.add_columns(new_object.keys())
+        if self.search_index is not None:
+            self.search_index.set_text(new_object.id, self.search_text(new_object))
+        row = len(self.objects)
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+        self.objects.append(new_object)
+        self.ids.append(new_object.id)
+        self.rows[new_object.id] = row
+        self.sorted_by = None
+        self.endInsertRows()
+
+    def process_object_delete_event(self, event):
+        row = self.rows.get(event.object_id(), -1)
+        if self.pending or self.reconcile_seen is not None:
+            self.removed_ids.add(event.object_id())
+        if row < 0:
+            return
+
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+        del self.objects[row]
+        del self.ids[row]
+        del self.rows[event.object_id()]
+        if self.search_index is not None:
+            self.search_index.remove(event.object_id())
+        self.reindex(row)
+        self.endRemoveRows()
+
 
 class ModelBrowser(QtWidgets.QWidget):
-    channel = None
+    subscription = None
+    # The model whose signals update the status, disconnected only once
+    status_model = None
+    subscription_connections = []
 
-    def browseModel(self, telepat_context, telepat_model, app_users):
+    @property
+    def channel(self):
+        return self.subscription.channel if self.subscription else None
+
+    def browseModel(self, telepat_context, telepat_model, user_directory):
         self.telepat_context = telepat_context
         self.telepat_model = telepat_model
-        self.app_users = app_users
-
-        if self.channel:
-            self.unsubscribe()
+        self.user_directory = user_directory
+        self.releaseSubscription()
 
-        def on_subscribe_success(channel, objects):
-            self.model = BrowserModel(self.treeView, objects)
+        def create_model(total):
+            self.model = BrowserModel(self.treeView, [], total)
+            self.model.pages_changed.connect(self.updateStatus)
+            self.model.rowsInserted.connect(self.updateStatus)
+            self.model.rowsRemoved.connect(self.updateStatus)
+            self.status_model = self.model
             self.proxyModel = ModelSortFilterProxyModel(self)
             self.proxyModel.setSourceModel(self.model)
-            self.proxyModel.setFilterCaseSensitivity(QtCore.Qt.CaseInsensitive)
+            self.proxyModel.setQuery(self.bFilterLineEdit.text())
+            # Keep the server order until the user sorts, sorting needs
+            # every page to be inserted
+            self.treeView.header().setSortIndicator(-1, QtCore.Qt.AscendingOrder)
             self.treeView.setModel(self.proxyModel)
-            self.treeView.resizeColumnToContents(0)
+            # Notifications of the channel reach the model through the subscription
+            subscription.add_receiver(self.model)
+            self.updateStatus()
+
+        def add_objects(objects):
+            # Handed over as pages, the view inserts them as it scrolls
+            for start in range(0, len(objects), page_size):
+                on_subscribe_page(objects[start:start + page_size])
+
+        def on_subscribe_snapshot(total, objects):
+            if not from_snapshot:
+                create_model(total)
+                from_snapshot.append(True)
+            on_subscribe_page(objects)
 
-            self.channel = channel
-            self.channel.on_update_object = self.on_update_object
+        def on_subscribe_success(total):
+            if from_snapshot:
+                self.model.begin_reconcile(total)
+            else:
+                create_model(total)
+
+        def on_subscribe_page(objects):
+            first_page = not self.model.objects
+            self.model.add_page(objects)
+            if first_page and self.model.objects:
+                self.treeView.resizeColumnToContents(0)
 
         def on_subscribe_failure(err_code, err_message):
+            self.statusProgress.hide()
+            self.statusLabel.setText("Error {0}: {1}".format(err_code, err_message))
             print("Error msg: {0}".format(err_message))
 
         if not hasattr(self, "treeView"):
             self.treeView = self.findChild(QtWidgets.QTreeView, "treeView")
             self.treeView.setSortingEnabled(True)
             self.treeView.setRootIsDecorated(False)
+            self.treeView.setUniformRowHeights(True)
             self.treeView.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+            self.treeView.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
             self.treeView.doubleClicked.connect(self.editObject)
+            self.treeView.setContextMenuPolicy(QtCore.Qt.ActionsContextMenu)
+            self.bulkEditAction = QtWidgets.QAction("Set field on selected objects...", self.treeView)
+            self.bulkEditAction.triggered.connect(self.bulkEdit)
+            self.treeView.addAction(self.bulkEditAction)
+            self.exportAction = QtWidgets.QAction("Export all objects...", self.treeView)
+            self.exportAction.triggered.connect(self.exportObjects)
+            self.treeView.addAction(self.exportAction)
+            self.importAction = QtWidgets.QAction("Import objects...", self.treeView)
+            self.importAction.triggered.connect(self.importObjects)
+            self.treeView.addAction(self.importAction)
         
         if not hasattr(self, "bFilterLineEdit"):
             self.bFilterLineEdit = self.findChild(QtWidgets.QLineEdit, "bFilterLineEdit")
             self.bFilterLineEdit.textChanged.connect(self.filterChanged)
+            self.filterTimer = QtCore.QTimer(self)
+            self.filterTimer.setSingleShot(True)
+            self.filterTimer.setInterval(FILTER_DELAY)
+            self.filterTimer.timeout.connect(self.applyFilter)
+
+        if not hasattr(self, "statusLabel"):
+            self.statusLabel = QtWidgets.QLabel(self)
+            self.statusProgress = QtWidgets.QProgressBar(self)
+            self.statusProgress.setMaximumHeight(self.statusLabel.sizeHint().height())
+            self.statusProgress.setTextVisible(False)
+            status_layout = QtWidgets.QHBoxLayout()
+            status_layout.addWidget(self.statusLabel, 1)
+            status_layout.addWidget(self.statusProgress)
+            self.layout().addLayout(status_layout)
 
         self.treeView.setModel(None)
+        self.disconnectStatus()
+        self.statusLabel.setText("Subscribing to {0}...".format(telepat_model))
+        self.statusProgress.setRange(0, 0)
+        self.statusProgress.show()
 
-        worker = SubscribeWorker(self, telepat_context, telepat_model, TelepatBaseObject)
-        worker.success.connect(on_subscribe_success)
-        worker.failed.connect(on_subscribe_failure)
-        worker.log.connect(console.log)
-        worker.start()
+        page_size = tmsettings.value("browserPageSize", DEFAULT_PAGE_SIZE, type=int)
+        from_snapshot = []
+        # The previous model's channel stays warm, coming back to it is instant
+        subscription = self.subscription = subscriptions.get_manager().acquire(telepat_context, telepat_model, page_size)
+        if subscription.state == subscriptions.READY:
+            create_model(len(subscription.objects))
+            add_objects(subscription.object_list())
+            return
+        if subscription.total is not None:
+            # Subscribed by someone else and still paging in
+            create_model(subscription.total)
+            add_objects(subscription.object_list())
+        self.subscription_connections = [
+            (subscription.snapshot, on_subscribe_snapshot),
+            (subscription.subscribed, on_subscribe_success),
+            (subscription.page, on_subscribe_page),
+            (subscription.failed, on_subscribe_failure)
+        ]
+        for signal, slot in self.subscription_connections:
+            signal.connect(slot)
+
+    def disconnectStatus(self):
+        # The previous model may still receive notifications
+        if self.status_model is None:
+            return
+        for signal in (self.status_model.pages_changed, self.status_model.rowsInserted, self.status_model.rowsRemoved):
+            signal.disconnect(self.updateStatus)
+        self.status_model = None
+
+    def releaseSubscription(self):
+        if self.subscription is None:
+            return
+        for signal, slot in self.subscription_connections:
+            signal.disconnect(slot)
+        self.subscription_connections = []
+        subscriptions.get_manager().release(self.subscription, getattr(self, "model", None))
+        self.subscription = None
+
+    def updateStatus(self):
+        if not hasattr(self, "model"):
+            return
+        model = self.model
+        status = "{0} of {1} objects loaded".format(len(model.objects), max(model.total, len(model.objects)))
+        if model.pending:
+            status += " (scroll for more)"
+        self.statusLabel.setText(status)
+        if model.loading():
+            self.statusProgress.setRange(0, model.total)
+            self.statusProgress.setValue(model.received)
+            self.statusProgress.show()
+        else:
+            self.statusProgress.hide()
 
     def filterChanged(self):
+        # Wait for the user to stop typing before filtering
+        self.filterTimer.start()
+
+    def applyFilter(self):
         if hasattr(self, "proxyModel"):
-            self.proxyModel.invalidateFilter()
-            self.proxyModel.setFilterFixedString(self.bFilterLineEdit.text())
+            self.proxyModel.setQuery(self.bFilterLineEdit.text())
+
+    def patchObjects(self, changes, on_done=None):
+        def patch_success(patched):
+            if on_done:
+                on_done(patched, failed_ids)
+
+        def patch_failed(err_code, err_message):
+            QtWidgets.QMessageBox.critical(self, "Patch error", "Error {0}: {1}".format(err_code, err_message))
+            if on_done:
+                on_done(0, failed_ids)
+
+        failed_ids = []
+        worker = ObjectPatchWorker(self, self.channel, changes)
+        worker.success.connect(patch_success)
+        worker.failed.connect(patch_failed)
+        worker.object_failed.connect(lambda object_id, status, message: failed_ids.append(object_id))
+        worker.log.connect(console.log)
+        scheduler.submit(worker)
+        return worker
+
+    def bulkEdit(self):
+        if not hasattr(self, "proxyModel") or not self.channel:
+            return
+        rows = [self.proxyModel.mapToSource(index).row() for index in self.treeView.selectionModel().selectedRows()]
+        if not rows:
+            return
+        fields = [column for column in self.model.columns if not column in TelepatObject._readonly_fields]
+        field, ok = QtWidgets.QInputDialog.getItem(self, "Bulk edit", "Field to set on {0} objects:".format(len(rows)), fields, 0, False)
+        if not ok:
+            return
+        value, ok = QtWidgets.QInputDialog.getText(self, "Bulk edit", "New value for {0}:".format(field))
+        if not ok:
+            return
+
+        changes = []
+        for row in rows:
+            obj = self.model.objects[row]
+            if field in obj and isinstance(obj[field], int) and not isinstance(obj[field], bool):
+                try:
+                    new_value = int(value)
+                except ValueError:
+                    QtWidgets.QMessageBox.critical(self, "Bulk edit", "{0} expects a number".format(field))
+                    return
+            else:
+                new_value = value
+            updated_object = TelepatObject(obj.to_json())
+            setattr(updated_object, field, new_value)
+            changes.append((obj, updated_object))
+
+        progress = QtWidgets.QProgressDialog("Patching {0} objects...".format(len(changes)), "Cancel", 0, len(changes), self)
+        progress.setWindowModality(QtCore.Qt.WindowModal)
+        progress.setMinimumDuration(500)
+
+        def bulk_done(patched, failed_ids):
+            progress.reset()
+            if failed_ids:
+                QtWidgets.QMessageBox.warning(self, "Bulk edit", "{0} objects patched, {1} failed:\n{2}".format(
+                    patched, len(failed_ids), "\n".join(failed_ids[:20])))
+
+        worker = self.patchObjects(changes, bulk_done)
+        worker.progress.connect(lambda done, total: progress.setValue(done))
+        progress.canceled.connect(worker.cancel)
+
+    def exportObjects(self):
+        if not hasattr(self, "telepat_model"):
+            return
+        from export import export_objects
+        export_objects(self, [(self.telepat_context, self.telepat_model)],
+                       "{0}-{1}.jsonl".format(self.telepat_context.id, self.telepat_model))
+
+    def importObjects(self):
+        if not hasattr(self, "telepat_model"):
+            return
+        from importer import import_objects
+        import_objects(self, self.telepat_context, self.telepat_model, self.user_directory)
 
     def editObject(self, index):
         def object_saved(updated_object):
-            row = self.proxyModel.mapToSource(index).row()
-            obj = index.model().sourceModel().objects[row]
-            telepat_object = TelepatBaseObject(updated_object.to_json())
-            patches = obj.patch_against(telepat_object)
-            self.channel.patch(updated_object)
+            self.patchObjects([(obj, updated_object)])
 
         def object_dismissed():
             if hasattr(self, "object_editor"):
                 del self.object_editor
 
+        from objecteditor import ObjectEditor
         row = self.proxyModel.mapToSource(index).row()
-        obj = index.model().sourceModel().objects[row]
-        self.object_editor = ObjectEditor(self, self.telepat_context, self.app_users, TelepatObject(obj.to_json()))
+        obj = self.model.objects[row]
+        self.object_editor = ObjectEditor(self, self.telepat_context, self.user_directory, TelepatObject(obj.to_json()))
         self.object_editor.saved.connect(object_saved)
         self.object_editor.rejected.connect(object_dismissed)
         self.object_editor.show()
-
-    def on_update_object(self, updated_object, notification):
-        event = TelepatObjectUpdateEvent(updated_object, notification)
-        QtWidgets.QApplication.postEvent(self.model, event)
-        
-    def unsubscribe(self):
-        def on_unsubscribe_success():
-            pass
-
-        def on_unsubscribe_failure(err_code, err_message):
-            print("Error msg: {0}".format(err_message))
-
-        worker = UnsubscribeWorker(self, self.channel)
-        worker.success.connect(on_unsubscribe_success)
-        worker.failed.connect(on_unsubscribe_failure)
-        worker.log.connect(console.log)
-        worker.start()
\ No newline at end of file
@@ -0,0 +1,107 @@
+import collections
+import threading
+from PyQt5 import QtCore, sip
+from settings import tmsettings
+from const import TM_EVENT_ON_DELETE_CONTEXT, TM_EVENT_ON_DELETE_OBJECT
+from event import TelepatBatchEvent
+import cache
+import snapshots
+from instrumentation import instrumented
+
+DEFAULT_BATCH_INTERVAL = 30  # ms
+DELETE_EVENTS = (TM_EVENT_ON_DELETE_CONTEXT, TM_EVENT_ON_DELETE_OBJECT)
+
+
+class NotificationQueue(QtCore.QObject):
+    flush_requested = QtCore.pyqtSignal()
+    delivered = QtCore.pyqtSignal(int, int)
+
+    def __init__(self, interval=DEFAULT_BATCH_INTERVAL):
+        super(NotificationQueue, self).__init__()
+        self.pending = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.received = 0
+        self.applied = 0
+        self.batches = 0
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.flush)
+        self.flush_requested.connect(self.schedule_flush)
+
+    def post(self, receiver, event):
+        notification = event.notification
+        object_id = event.object_id()
+        notification_type = getattr(notification, "notification_type", None)
+        path = getattr(notification, "path", None)
+        key = (id(receiver), event.type(), object_id, notification_type, path)
+        cache.invalidate_for_event(event)
+        with self.lock:
+            self.received += 1
+            if event.type() in DELETE_EVENTS:
+                # Pending changes to a deleted object are moot
+                for pending_key in [k for k in self.pending if k[0] == key[0] and k[2] == object_id]:
+                    del self.pending[pending_key]
+            # Last writer wins, but the merged notification takes the newest position
+            self.pending.pop(key, None)
+            self.pending[key] = (receiver, event)
+            first = len(self.pending) == 1
+        if first:
+            self.flush_requested.emit()
+
+    @QtCore.pyqtSlot()
+    def schedule_flush(self):
+        if not self.timer.isActive():
+            self.timer.start()
+
+    @QtCore.pyqtSlot()
+    @instrumented("NotificationQueue.flush")
+    def flush(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = collections.OrderedDict()
+        if not pending:
+            return
+
+        batches = collections.OrderedDict()
+        for receiver, event in pending.values():
+            batches.setdefault(id(receiver), (receiver, []))[1].append(event)
+
+        # Snapshots follow the merged notifications, one transaction per flush
+        snapshots.apply_events([event for receiver, event in pending.values()])
+
+        for receiver, events in batches.values():
+            if sip.isdeleted(receiver):
+                continue
+            QtCore.QCoreApplication.sendEvent(receiver, TelepatBatchEvent(events))
+            self.applied += len(events)
+            self.batches += 1
+        self.delivered.emit(self.received, self.applied)
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "applied": self.applied,
+            "batches": self.batches,
+            "pending": len(self.pending)
+        }
+
+
+queue = None
+queue_lock = threading.Lock()
+
+def get_queue():
+    global queue
+    with queue_lock:
+        if queue is None:
+            queue = NotificationQueue(tmsettings.value("notificationBatchInterval", DEFAULT_BATCH_INTERVAL, type=int))
+            # The socket thread may be the first one to post
+            queue.moveToThread(QtCore.QCoreApplication.instance().thread())
+    return queue
+
+def post(receiver, event):
+    get_queue().post(receiver, event)
+
+def stats():
+    return get_queue().stats()
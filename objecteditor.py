@@ -1,53 +1,106 @@
-from PyQt5 import QtWidgets, QtGui, QtCore, uic
-from requests.exceptions import ConnectionError
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from PyQt5 import QtWidgets, QtGui, QtCore
+from requests.exceptions import RequestException
 from telepat import TelepatBaseObject
-from workers import BaseWorker, SchemaWorker, SubscribeWorker
+from telepat.channel import TelepatChannel
+from settings import tmsettings
+from workers import BaseWorker, SchemaWorker
+import errors
+import console
+import cache
+import scheduler
+import subscriptions
+from uiloader import load_ui
+
+DEFAULT_FETCH_PARALLELISM = 4
 
 
 class ObjectsWorker(BaseWorker):
     success = QtCore.pyqtSignal(dict)
     failed = QtCore.pyqtSignal(int, str)
     progress = QtCore.pyqtSignal(int, int)
-
-    def __init__(self, parent, context, models_list):
+    loaded = QtCore.pyqtSignal(str, list)
+    # Channels are handed over to the subscription manager instead of
+    # being dropped, the next editor or browser finds them warm. It stays
+    # connected on cancel, so a channel emitted just before is not lost.
+    opened = QtCore.pyqtSignal(str, TelepatChannel, list)
+    result_signals = ("success", "failed", "progress", "loaded")
+
+    def __init__(self, parent, context, models_list, max_workers=None):
         super(ObjectsWorker, self).__init__(parent)
         self.context = context
         self.models_list = models_list
+        self.max_workers = max_workers or tmsettings.value("relatedFetchParallelism", DEFAULT_FETCH_PARALLELISM, type=int)
+
+    def fetch_model(self, telepat, model):
+        key = cache.objects_key(self.context.id, model)
+        objects = cache.get_cache().get(key)
+        if objects is not None:
+            self.log.emit("Using {0} cached {1} objects ({2})".format(len(objects), model, cache.get_cache().summary()))
+            return 200, None, objects
+
+        with self.timed("network"):
+            channel, subscribe_response = telepat.subscribe(self.context, model, TelepatBaseObject)
+        if subscribe_response.status != 200:
+            return subscribe_response.status, subscribe_response.message, None
+        with self.timed("decode"):
+            objects = subscribe_response.getObjectOfType(TelepatBaseObject)
+        objects = objects if isinstance(objects, list) else [objects]
+        cache.get_cache().put(key, objects)
+        if self.cancelled:
+            channel.unsubscribe()
+        else:
+            self.opened.emit(model, channel, objects)
+        return 200, None, objects
 
     def run(self):
         telepat = QtCore.QCoreApplication.instance().telepat_instance
         models_map = {}
-        try:
-            for model in self.models_list:
-                channel, subscribe_response = telepat.subscribe(self.context, model, TelepatBaseObject)
-                if subscribe_response.status != 200:
-                    self.failed.emit(subscribe_response.status, subscribe_response.message)
-                    return
-                objects = subscribe_response.getObjectOfType(TelepatBaseObject)
-                models_map[model] = objects if isinstance(objects, list) else [objects]
-                channel.unsubscribe()
-                self.progress.emit(self.models_list.index(model)+1, len(self.models_list))
+        errors_list = []
+        # Models are submitted in the order they are listed, so the ones for
+        # the first rows of the editor tend to arrive first
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            futures = {executor.submit(self.fetch_model, telepat, model): model for model in self.models_list}
+            for done, future in enumerate(as_completed(futures), 1):
+                model = futures[future]
+                try:
+                    status, message, objects = future.result()
+                except RequestException as e:
+                    status, message, objects = errors.TELEPAT_CONNECTION_ERROR, "Connection error: {0}".format(e), None
+                except Exception as e:
+                    # A TelepatError or a bad response only loses this model
+                    status, message, objects = errors.TELEPAT_GENERAL_ERROR, str(e), None
+                if objects is None:
+                    self.log.emit("Error {0} while retrieving {1} objects: {2}".format(status, model, message))
+                    errors_list.append((status, message))
+                else:
+                    models_map[model] = objects
+                    self.loaded.emit(model, objects)
+                self.progress.emit(done, len(self.models_list))
+
+        if errors_list and not models_map:
+            self.failed.emit(*errors_list[0])
+        else:
             self.success.emit(models_map)
-        except ConnectionError as e:
-            self.connection_error(e)
-            return
 
 class ObjectEditor(QtWidgets.QDialog):
     saved = QtCore.pyqtSignal(TelepatBaseObject)
 
-    def __init__(self, parent, context, app_users, obj):
+    def __init__(self, parent, context, user_directory, obj):
         super(ObjectEditor, self).__init__(parent)
 
-        uic.loadUi('objecteditor.ui', self)
+        load_ui('objecteditor.ui', self)
         self.edited_object = obj
         self.context = context
-        self.app_users = app_users
+        self.user_directory = user_directory
         self.related_models = {}
+        self.subscriptions = []
+        self.closed = False
 
         self.schema_worker = SchemaWorker()
         self.schema_worker.success.connect(self.on_schema_success)
         self.schema_worker.failed.connect(self.on_schema_failed)
-        self.schema_worker.start()
+        scheduler.submit(self.schema_worker)
         self.progressBar.setValue(0)
         self.buttonBox.setEnabled(False)
         self.tableView.setEnabled(False)
@@ -63,33 +116,72 @@ class ObjectEditor(QtWidgets.QDialog):
             if "{0}_id".format(model_name) in self.edited_object:
                 relations.append("{0}".format(model_name))
 
+        # The editor is usable right away, relation pickers show up as
+        # soon as their objects arrive
+        self.tableView.editObject(self.edited_object, {"user": self.user_directory})
         if len(relations) == 0:
             self.progressBar.setValue(0)
             self.progressBar.hide()
-            self.tableView.editObject(self.edited_object, {"user": self.app_users})
+            return
+
+        # Models with a warm channel are filled in right away
+        manager = subscriptions.get_manager()
+        missing = []
+        for model_name in sorted(relations):
+            if manager.lookup(self.context, model_name) is None:
+                missing.append(model_name)
+                continue
+            subscription = manager.acquire(self.context, model_name)
+            self.subscriptions.append(subscription)
+            self.tableView.setRelatedObjects(model_name, subscription.object_list())
+        if not missing:
+            self.progressBar.setValue(0)
+            self.progressBar.hide()
         else:
-            self.objects_worker = ObjectsWorker(self, self.context, relations)
+            self.objects_worker = ObjectsWorker(self, self.context, missing)
             self.objects_worker.success.connect(self.on_related_objects_success)
             self.objects_worker.failed.connect(self.on_related_objects_failed)
             self.objects_worker.progress.connect(self.on_related_objects_progress)
-            self.objects_worker.start()
+            self.objects_worker.loaded.connect(self.on_related_objects_loaded)
+            self.objects_worker.opened.connect(self.on_related_channel_opened)
+            self.objects_worker.log.connect(console.log)
+            scheduler.submit(self.objects_worker)
 
     def on_schema_failed(self, err_code, err_msg):
         QtWidgets.QMessageBox.critical(self, "Schema retrieving error", "Error {0}: {1}".format(err_code, msg))
 
+    def on_related_objects_loaded(self, model_name, objects):
+        self.tableView.setRelatedObjects(model_name, objects)
+
+    def on_related_channel_opened(self, model_name, channel, objects):
+        subscription = subscriptions.get_manager().adopt(self.context, model_name, channel, objects)
+        if self.closed:
+            # Emitted before done() cancelled the worker, left to warm down
+            subscriptions.get_manager().release(subscription)
+            return
+        self.subscriptions.append(subscription)
+
     def on_related_objects_success(self, objects_map):
         self.progressBar.setValue(0)
         self.progressBar.hide()
-        objects_map["user"] = self.app_users
-        self.tableView.editObject(self.edited_object, objects_map)
 
     def on_related_objects_failed(self, err_code, err_msg):
         QtWidgets.QMessageBox.critical(self, "Objects retrieval errror", "Error {0}: {1}".format(err_code, err_msg))
 
     def on_related_objects_progress(self, value, total):
         progress = value/total*50
-        self.progressBar.setValue(50+progress)
+        self.progressBar.setValue(int(50+progress))
 
     def accept(self):
         self.saved.emit(self.edited_object)
-        super(ObjectEditor, self).accept()
\ No newline at end of file
+        super(ObjectEditor, self).accept()
+
+    def done(self, result):
+        # Accepted or dismissed, the related channels are left to warm down
+        self.closed = True
+        if hasattr(self, "objects_worker"):
+            self.objects_worker.cancel()
+        for subscription in self.subscriptions:
+            subscriptions.get_manager().release(subscription)
+        self.subscriptions = []
+        super(ObjectEditor, self).done(result)
\ No newline at end of file
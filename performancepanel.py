@@ -0,0 +1,109 @@
+from PyQt5 import QtCore, QtGui, QtWidgets
+import instrumentation
+import httpsession
+import subscriptions
+import prefetch
+import console
+
+REFRESH_INTERVAL = 1000  # ms
+COLUMNS = ["Metric", "Count", "Mean", "p50", "p90", "p99", "Max", "Total"]
+FIELDS = ["count", "mean", "p50", "p90", "p99", "max", "total"]
+
+
+class PerformancePanel(QtWidgets.QDockWidget):
+    def __init__(self, parent=None):
+        super(PerformancePanel, self).__init__("Performance", parent)
+        self.setObjectName("performancePanel")
+
+        widget = QtWidgets.QWidget(self)
+        layout = QtWidgets.QVBoxLayout(widget)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.table = QtWidgets.QTableWidget(0, len(COLUMNS), widget)
+        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
+        self.table.setSortingEnabled(True)
+        layout.addWidget(self.table)
+
+        self.httpLabel = QtWidgets.QLabel(widget)
+        layout.addWidget(self.httpLabel)
+        self.subscriptionsLabel = QtWidgets.QLabel(widget)
+        layout.addWidget(self.subscriptionsLabel)
+        self.prefetchLabel = QtWidgets.QLabel(widget)
+        layout.addWidget(self.prefetchLabel)
+
+        self.profileView = QtWidgets.QPlainTextEdit(widget)
+        self.profileView.setReadOnly(True)
+        self.profileView.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+        self.profileView.setPlaceholderText("Profiles collected from the View menu show up here")
+        self.profileView.hide()
+        layout.addWidget(self.profileView)
+
+        buttons = QtWidgets.QHBoxLayout()
+        self.resetButton = QtWidgets.QPushButton("Reset", widget)
+        self.resetButton.clicked.connect(self.reset)
+        self.exportButton = QtWidgets.QPushButton("Export...", widget)
+        self.exportButton.clicked.connect(self.exportMetrics)
+        buttons.addStretch(1)
+        buttons.addWidget(self.resetButton)
+        buttons.addWidget(self.exportButton)
+        layout.addLayout(buttons)
+        self.setWidget(widget)
+
+        # Only refreshed while someone is looking
+        self.refreshTimer = QtCore.QTimer(self)
+        self.refreshTimer.setInterval(REFRESH_INTERVAL)
+        self.refreshTimer.timeout.connect(self.refresh)
+        self.visibilityChanged.connect(self.panelVisibilityChanged)
+
+    def panelVisibilityChanged(self, visible):
+        if visible:
+            self.refresh()
+            self.refreshTimer.start()
+        else:
+            self.refreshTimer.stop()
+
+    def refresh(self):
+        summary = instrumentation.summary()
+        self.table.setSortingEnabled(False)
+        self.table.setRowCount(len(summary))
+        for row, name in enumerate(sorted(summary)):
+            metric = summary[name]
+            self.table.setItem(row, 0, QtWidgets.QTableWidgetItem(name))
+            for column, field in enumerate(FIELDS, 1):
+                item = QtWidgets.QTableWidgetItem()
+                if field == "count":
+                    item.setData(QtCore.Qt.DisplayRole, metric[field])
+                else:
+                    # Durations are shown in milliseconds
+                    item.setData(QtCore.Qt.DisplayRole, round(metric[field] * 1000, 2))
+                item.setTextAlignment(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+                self.table.setItem(row, column, item)
+        self.table.setSortingEnabled(True)
+        self.httpLabel.setText(httpsession.summary())
+        self.subscriptionsLabel.setText(subscriptions.get_manager().summary())
+        self.prefetchLabel.setText(prefetch.summary())
+
+    def showProfile(self, title, report):
+        if not report:
+            return
+        console.log("{0} profile collected, see the Performance panel".format(title))
+        self.profileView.setPlainText(report)
+        self.profileView.show()
+        self.show()
+
+    def reset(self):
+        instrumentation.get_recorder().reset()
+        self.refresh()
+
+    def exportMetrics(self):
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Export performance metrics", "telepatmanager-performance.json", "JSON files (*.json)")
+        if not path:
+            return
+        try:
+            count = instrumentation.export(path)
+        except OSError as e:
+            QtWidgets.QMessageBox.critical(self, "Export error", "Cannot write {0}: {1}".format(path, e))
+            return
+        console.log("Exported {0} performance metrics to {1}".format(count, path))
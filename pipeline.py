@@ -0,0 +1,137 @@
+import collections
+import time
+from PyQt5 import QtCore
+import instrumentation
+import scheduler
+
+PENDING = 0
+RUNNING = 1
+DONE = 2
+FAILED = 3
+
+
+class Stage:
+    def __init__(self, name, start, requires, signals):
+        self.name = name
+        self.start = start
+        self.requires = requires
+        self.signals = signals
+        self.state = PENDING
+        self.worker = None
+        self.started_at = None
+        self.finished_at = None
+
+    def settled(self):
+        return self.state in (DONE, FAILED)
+
+    def duration(self):
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+
+# A set of named stages started as soon as the stages they require are done,
+# so independent ones run in parallel on the scheduler. A stage's start
+# function submits a worker and returns it (or None when it has nothing to
+# wait for); the stage is done when the worker emits one of the signals
+# listed, and failed on its failed signal or when it finishes without one.
+class Pipeline(QtCore.QObject):
+    stage_finished = QtCore.pyqtSignal(str, bool)
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, name, parent=None):
+        super(Pipeline, self).__init__(parent)
+        self.name = name
+        self.stages = collections.OrderedDict()
+        self.waiters = collections.OrderedDict()
+        self.cancelled = False
+        self.started_at = None
+        self.finished_at = None
+
+    def add_stage(self, name, start, requires=(), signals=("success",)):
+        self.stages[name] = Stage(name, start, tuple(requires), tuple(signals))
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self.start_ready()
+
+    def start_ready(self):
+        for stage in self.stages.values():
+            if self.cancelled or stage.state != PENDING:
+                continue
+            required = [self.stages[name] for name in stage.requires]
+            if any(other.state == FAILED for other in required):
+                # Skipped, it would work on missing data
+                stage.started_at = time.monotonic()
+                self.settle(stage, False)
+            elif all(other.state == DONE for other in required):
+                self.run_stage(stage)
+
+    def run_stage(self, stage):
+        stage.state = RUNNING
+        stage.started_at = time.monotonic()
+        with scheduler.get_scheduler().hold():
+            stage.worker = stage.start()
+            if stage.worker is not None:
+                for signal in stage.signals:
+                    getattr(stage.worker, signal).connect(lambda *args, stage=stage: self.settle(stage, True))
+                stage.worker.failed.connect(lambda *args, stage=stage: self.settle(stage, False))
+                # A worker that ended without emitting either has failed
+                stage.worker.finished.connect(lambda stage=stage: self.settle(stage, False))
+        if stage.worker is None:
+            self.settle(stage, True)
+
+    def settle(self, stage, ok):
+        if self.cancelled or stage.settled():
+            return
+        stage.state = DONE if ok else FAILED
+        stage.finished_at = time.monotonic()
+        instrumentation.record("{0}.{1}".format(self.name, stage.name), stage.duration())
+        self.stage_finished.emit(stage.name, ok)
+        self.call_waiters()
+        self.start_ready()
+        if not self.cancelled and self.finished_at is None and all(other.settled() for other in self.stages.values()):
+            self.finished_at = time.monotonic()
+            instrumentation.record(self.name + ".total", self.finished_at - self.started_at)
+            self.finished.emit()
+
+    def done(self, names):
+        return all(self.stages[name].settled() for name in names)
+
+    def when_done(self, names, callback, key=None):
+        # Calls back once the stages are settled, right away if they are.
+        # A newer callback with the same key replaces a waiting one.
+        if self.done(names):
+            callback()
+            return
+        key = key if key is not None else object()
+        self.waiters.pop(key, None)
+        self.waiters[key] = (names, callback)
+
+    def call_waiters(self):
+        for key, (names, callback) in list(self.waiters.items()):
+            if self.cancelled:
+                return
+            if key in self.waiters and self.done(names):
+                del self.waiters[key]
+                callback()
+
+    def cancel(self):
+        if self.cancelled:
+            return
+        self.cancelled = True
+        self.waiters.clear()
+        for stage in self.stages.values():
+            if stage.state == RUNNING and stage.worker is not None:
+                scheduler.get_scheduler().cancel_worker(stage.worker)
+
+    def report(self):
+        stages = []
+        for stage in self.stages.values():
+            duration = stage.duration()
+            if duration is None:
+                stages.append("{0} -".format(stage.name))
+            else:
+                stages.append("{0} {1:.2f}s{2}".format(stage.name, duration, "" if stage.state == DONE else " (failed)"))
+        total = (self.finished_at or time.monotonic()) - self.started_at
+        return "{0:.2f}s ({1})".format(total, ", ".join(stages))
@@ -0,0 +1,131 @@
+import collections
+import functools
+import threading
+from PyQt5 import QtCore
+from settings import tmsettings
+import scheduler
+import subscriptions
+
+DEFAULT_MAX_MODELS = 4  # candidates taken per navigation
+DEFAULT_MAX_IN_FLIGHT = 2
+DEFAULT_BYTE_BUDGET = 20 * 1024 * 1024  # per navigation
+
+
+# Subscribes to the models the user is likely to open next at background
+# priority, through the subscription manager, so they are warm when
+# clicked. Each navigation replaces the previous candidates and cancels
+# their subscriptions still in progress.
+class Prefetcher(QtCore.QObject):
+    def __init__(self, max_in_flight=DEFAULT_MAX_IN_FLIGHT, byte_budget=DEFAULT_BYTE_BUDGET):
+        super(Prefetcher, self).__init__()
+        self.max_in_flight = max_in_flight
+        self.byte_budget = byte_budget
+        self.queue = collections.deque()
+        self.in_flight = []
+        self.spent = 0
+        self.starting = False
+        # Prefetched subscriptions nobody has used yet
+        self.unused = {}
+        self.fetched = 0
+        self.hits = 0
+        self.cancelled = 0
+        self.used_bytes = 0
+        self.wasted_bytes = 0
+
+        manager = subscriptions.get_manager()
+        manager.acquired.connect(self.on_acquired)
+        manager.dropped.connect(self.on_dropped)
+
+    def navigate(self, candidates):
+        # candidates are (context, model name) pairs, most likely first
+        self.cancel()
+        self.spent = 0
+        self.queue.extend(candidates)
+        self.start_next()
+
+    def start_next(self):
+        manager = subscriptions.get_manager()
+        while self.queue and len(self.in_flight) < self.max_in_flight and self.spent < self.byte_budget:
+            context, model_name = self.queue.popleft()
+            if manager.key(context, model_name) in manager.subscriptions:
+                continue
+            self.starting = True
+            subscription = manager.acquire(context, model_name, priority=scheduler.PRIORITY_BACKGROUND, measure=True)
+            self.starting = False
+            self.fetched += 1
+            self.unused[subscription.key] = subscription
+            self.in_flight.append(subscription)
+            subscription.ready.connect(functools.partial(self.on_done, subscription))
+            subscription.failed.connect(functools.partial(self.on_done, subscription))
+
+    def on_done(self, subscription, *args):
+        if subscription not in self.in_flight:
+            return
+        self.in_flight.remove(subscription)
+        self.spent += subscription.bytes
+        # Left to the manager, it stays warm for the grace period
+        subscriptions.get_manager().release(subscription)
+        self.start_next()
+
+    def cancel(self):
+        manager = subscriptions.get_manager()
+        self.queue.clear()
+        in_flight, self.in_flight = self.in_flight, []
+        for subscription in in_flight:
+            manager.release(subscription)
+            if subscription.refs == 0 and subscription.state == subscriptions.SUBSCRIBING:
+                self.cancelled += 1
+                manager.drop(subscription)
+
+    def on_acquired(self, subscription):
+        if self.starting:
+            return
+        if self.unused.get(subscription.key) is subscription:
+            del self.unused[subscription.key]
+            self.hits += 1
+            self.used_bytes += subscription.bytes
+
+    def on_dropped(self, subscription):
+        if self.unused.get(subscription.key) is subscription:
+            del self.unused[subscription.key]
+            self.wasted_bytes += subscription.bytes
+
+    def stats(self):
+        return {
+            "fetched": self.fetched,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.fetched if self.fetched else 0.0,
+            "cancelled": self.cancelled,
+            "in_flight": len(self.in_flight),
+            "used_bytes": self.used_bytes,
+            "wasted_bytes": self.wasted_bytes
+        }
+
+    def summary(self):
+        stats = self.stats()
+        return "Prefetch: {0} fetched, {1} used ({2:.0%}), {3} cancelled, {4:.1f} MiB wasted".format(
+            stats["fetched"], stats["hits"], stats["hit_rate"], stats["cancelled"], stats["wasted_bytes"] / 1048576)
+
+
+prefetcher = None
+prefetcher_lock = threading.Lock()
+
+def enabled():
+    return tmsettings.value("prefetchEnabled", False, type=bool)
+
+def get_prefetcher():
+    global prefetcher
+    with prefetcher_lock:
+        if prefetcher is None:
+            prefetcher = Prefetcher(tmsettings.value("prefetchMaxInFlight", DEFAULT_MAX_IN_FLIGHT, type=int),
+                                    tmsettings.value("prefetchByteBudget", DEFAULT_BYTE_BUDGET, type=int))
+    return prefetcher
+
+def cancel():
+    if prefetcher is not None:
+        prefetcher.cancel()
+
+def summary():
+    if prefetcher is None:
+        return "Prefetch: {0}".format("idle" if enabled() else "off")
+    return prefetcher.summary()
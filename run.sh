@@ -1,4 +1,5 @@
 #!/bin/sh
 
 pyrcc5 -o iconrc.py resources/icons.qrc
-python3 main.py
\ No newline at end of file
+python3 uiloader.py
+python3 main.py
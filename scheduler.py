@@ -0,0 +1,150 @@
+import collections
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+from PyQt5 import QtCore
+from settings import tmsettings
+import console
+import instrumentation
+
+DEFAULT_MAX_THREADS = 4
+PRIORITY_USER = 0
+PRIORITY_BACKGROUND = 10
+SLOW_TASK = 1.0  # seconds, slower tasks are reported in the console
+
+
+class Task:
+    def __init__(self, worker, priority, key):
+        self.worker = worker
+        self.priority = priority
+        self.key = key
+        self.name = type(worker).__name__
+        self.queued_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.cancelled = False
+
+    def wait_time(self):
+        return (self.started_at or time.monotonic()) - self.queued_at
+
+    def run_time(self):
+        if self.started_at is None:
+            return 0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+
+# Runs BaseWorker threads with a bounded number of them alive at once.
+# Higher priority (lower number) tasks start first, and submitting a task
+# with the key of a queued or running one cancels the older task.
+class Scheduler(QtCore.QObject):
+    task_finished = QtCore.pyqtSignal(str, float, float)
+
+    def __init__(self, max_threads=DEFAULT_MAX_THREADS):
+        super(Scheduler, self).__init__()
+        self.max_threads = max_threads
+        self.queue = []
+        self.running = {}
+        self.keys = {}
+        self.counter = itertools.count()
+        self.history = collections.deque(maxlen=1000)
+        self.held = 0
+
+    def submit(self, worker, priority=PRIORITY_USER, key=None):
+        if key is not None and key in self.keys:
+            self.cancel(self.keys[key])
+        task = Task(worker, priority, key)
+        if key is not None:
+            self.keys[key] = task
+        worker.finished.connect(lambda: self.on_finished(task))
+        heapq.heappush(self.queue, (priority, next(self.counter), task))
+        self.start_next()
+        return task
+
+    def cancel(self, task):
+        task.cancelled = True
+        task.worker.cancel()
+        if self.keys.get(task.key) is task:
+            del self.keys[task.key]
+        # Queued tasks are skipped by start_next(), running ones are left
+        # to finish with their results disconnected
+
+    def cancel_key(self, key):
+        if key in self.keys:
+            self.cancel(self.keys[key])
+
+    def cancel_worker(self, worker):
+        tasks = itertools.chain(self.running.values(), (entry[2] for entry in self.queue))
+        for task in list(tasks):
+            if task.worker is worker and not task.cancelled:
+                self.cancel(task)
+                return
+
+    @contextlib.contextmanager
+    def hold(self):
+        # Workers submitted meanwhile only start once the block is left, so
+        # the caller can connect to them before they can emit anything
+        self.held += 1
+        try:
+            yield
+        finally:
+            self.held -= 1
+            self.start_next()
+
+    def start_next(self):
+        while not self.held and self.queue and len(self.running) < self.max_threads:
+            priority, seq, task = heapq.heappop(self.queue)
+            if task.cancelled:
+                self.history.append((task.name, task.wait_time(), 0, True))
+                continue
+            task.started_at = time.monotonic()
+            self.running[id(task)] = task
+            task.worker.start()
+
+    def on_finished(self, task):
+        task.worker.wait()
+        task.finished_at = time.monotonic()
+        if getattr(task.worker, "finished_at", None):
+            instrumentation.record(task.name + ".delivery", task.finished_at - task.worker.finished_at)
+        instrumentation.record(task.name + ".wait", task.wait_time())
+        instrumentation.record(task.name + ".run", task.run_time())
+        self.running.pop(id(task), None)
+        if self.keys.get(task.key) is task:
+            del self.keys[task.key]
+        self.history.append((task.name, task.wait_time(), task.run_time(), task.cancelled))
+        self.task_finished.emit(task.name, task.wait_time(), task.run_time())
+        if task.run_time() > SLOW_TASK:
+            console.log("{0} took {1:.2f}s (queued for {2:.2f}s)".format(task.name, task.run_time(), task.wait_time()))
+        self.start_next()
+
+    def pending(self):
+        return len([entry for entry in self.queue if not entry[2].cancelled])
+
+    def stats(self):
+        stats = {}
+        for name, wait_time, run_time, cancelled in self.history:
+            entry = stats.setdefault(name, {"count": 0, "cancelled": 0, "wait": 0.0, "run": 0.0, "max_run": 0.0})
+            entry["count"] += 1
+            entry["cancelled"] += 1 if cancelled else 0
+            entry["wait"] += wait_time
+            entry["run"] += run_time
+            entry["max_run"] = max(entry["max_run"], run_time)
+        return stats
+
+
+scheduler = None
+scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    global scheduler
+    with scheduler_lock:
+        if scheduler is None:
+            scheduler = Scheduler(tmsettings.value("maxWorkerThreads", DEFAULT_MAX_THREADS, type=int))
+    return scheduler
+
+def submit(worker, priority=PRIORITY_USER, key=None):
+    return get_scheduler().submit(worker, priority, key)
+
+def cancel(key):
+    get_scheduler().cancel_key(key)
@@ -0,0 +1,83 @@
+import collections
+
+# A single query term: field is a column number, or None to match the whole row
+Term = collections.namedtuple("Term", ["field", "value"])
+
+
+def parse_query(text, columns):
+    # "foo name:bar" matches rows containing "foo" anywhere and "bar" in
+    # the name column. Unknown fields are searched as plain text.
+    column_index = {name.lower(): column for column, name in enumerate(columns)}
+    terms = []
+    for token in text.lower().split():
+        field, separator, value = token.partition(":")
+        if separator and field in column_index:
+            terms.append(Term(column_index[field], value))
+        else:
+            terms.append(Term(None, token))
+    return terms
+
+
+def narrows(terms, previous_terms):
+    # True if every row matching terms also matched previous_terms
+    for old in previous_terms:
+        if not any(old.value in new.value and (old.field is None or old.field == new.field) for new in terms):
+            return False
+    return True
+
+
+class SearchIndex:
+    def __init__(self, field_text):
+        self.field_text = field_text
+        self.texts = {}
+        self.terms = []
+        self.matches = None
+
+    def set_text(self, object_id, text):
+        self.texts[object_id] = text.lower()
+        if self.matches is not None:
+            if self.test(object_id):
+                self.matches.add(object_id)
+            else:
+                self.matches.discard(object_id)
+
+    def remove(self, object_id):
+        self.texts.pop(object_id, None)
+        if self.matches is not None:
+            self.matches.discard(object_id)
+
+    def test(self, object_id):
+        text = self.texts.get(object_id, "")
+        for field, value in self.terms:
+            if field is None:
+                if not value in text:
+                    return False
+            elif not value in self.field_text(object_id, field).lower():
+                return False
+        return True
+
+    def search(self, terms):
+        if not terms:
+            self.terms = []
+            self.matches = None
+            return None
+
+        if self.matches is not None and narrows(terms, self.terms):
+            candidates = self.matches
+        else:
+            candidates = self.texts.keys()
+        self.terms = terms
+
+        # Plain terms only need the row text, so check them in one tight pass
+        texts = self.texts
+        for field, value in terms:
+            if field is None:
+                candidates = [object_id for object_id in candidates if value in texts[object_id]]
+        for field, value in terms:
+            if field is not None:
+                candidates = [object_id for object_id in candidates if value in self.field_text(object_id, field).lower()]
+        self.matches = set(candidates)
+        return self.matches
+
+    def accepts(self, object_id):
+        return self.matches is None or object_id in self.matches
@@ -0,0 +1,222 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from settings import tmsettings
+from const import *
+from telepat.transportnotification import NOTIFICATION_TYPE_DELETED
+import cache
+import console
+from instrumentation import instrumented
+
+SNAPSHOTS_FILE = "snapshots.sqlite"
+APPENDED_POSITION = 2 ** 53  # objects added by notifications go after the saved ones
+CONTEXT_EVENTS = (TM_EVENT_ON_ADD_CONTEXT, TM_EVENT_ON_UPDATE_CONTEXT, TM_EVENT_ON_DELETE_CONTEXT)
+OBJECT_EVENTS = (TM_EVENT_ON_ADD_OBJECT, TM_EVENT_ON_UPDATE_OBJECT, TM_EVENT_ON_DELETE_OBJECT)
+
+
+def scope_name(key):
+    # Snapshots use the same tuple keys as the cache, stored as "kind/server/app/..."
+    return "/".join(str(part) for part in key)
+
+
+def object_json(obj):
+    return obj.to_json() if hasattr(obj, "to_json") else obj
+
+
+def same_version(old, new):
+    # Telepat stamps objects with "modified", compare whole objects otherwise
+    if "modified" in old and "modified" in new:
+        return old["modified"] == new["modified"]
+    return object_json(old) == object_json(new)
+
+
+class SnapshotStore:
+    # Keeps the last known contexts, schema, users and objects of every
+    # server/app, so the UI can be filled before the server answers.
+    # Snapshots are replaced by workers after each successful download and
+    # kept up to date by notifications in between.
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS scopes (scope TEXT PRIMARY KEY, saved REAL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS objects (scope TEXT, object_id TEXT, position INTEGER, "
+                                "modified TEXT, data TEXT, PRIMARY KEY (scope, object_id)) WITHOUT ROWID")
+        self.connection.commit()
+        self.loads = 0
+        self.saves = 0
+        self.updates = 0
+
+    def load(self, key):
+        # Returns the decoded JSON of every object, or None without a snapshot
+        snapshot = self.load_pages(key, 0)
+        return None if snapshot is None else next(snapshot[1])
+
+    @instrumented("SnapshotStore.load")
+    def load_pages(self, key, page_size):
+        # Returns the number of objects and a generator decoding them in
+        # lists of page_size (all at once for 0), or None without a snapshot
+        scope = scope_name(key)
+        with self.lock:
+            if self.connection.execute("SELECT 1 FROM scopes WHERE scope = ?", (scope,)).fetchone() is None:
+                return None
+            rows = self.connection.execute("SELECT data FROM objects WHERE scope = ? ORDER BY position", (scope,)).fetchall()
+            self.loads += 1
+        page_size = page_size or max(len(rows), 1)
+        pages = ([json.loads(row[0]) for row in rows[start:start + page_size]] for start in range(0, len(rows) or 1, page_size))
+        return len(rows), pages
+
+    def saved_at(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT saved FROM scopes WHERE scope = ?", (scope_name(key),)).fetchone()
+        return row[0] if row else None
+
+    @instrumented("SnapshotStore.save")
+    def save(self, key, objects):
+        scope = scope_name(key)
+        rows = []
+        for obj in objects:
+            data = object_json(obj)
+            object_id = data.get("id", len(rows))
+            rows.append((scope, str(object_id), len(rows), str(data.get("modified", "")), json.dumps(data)))
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM objects WHERE scope = ?", (scope,))
+            self.connection.executemany("INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)", rows)
+            self.connection.execute("INSERT OR REPLACE INTO scopes VALUES (?, ?)", (scope, time.time()))
+            self.saves += 1
+
+    def drop(self, key_prefix):
+        # Like cache.invalidate(), drops every scope starting with key_prefix
+        scope = scope_name(key_prefix)
+        bounds = (scope, scope + "/", scope + "/\uffff")
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM objects WHERE scope = ? OR (scope >= ? AND scope < ?)", bounds)
+            self.connection.execute("DELETE FROM scopes WHERE scope = ? OR (scope >= ? AND scope < ?)", bounds)
+
+    @instrumented("SnapshotStore.apply_events")
+    def apply_events(self, events):
+        # Only scopes with an existing snapshot are updated, a partial
+        # snapshot would look complete on the next start
+        upserts = []
+        removals = []
+        dropped = []
+        for event in events:
+            event_type = event.type()
+            if event_type in CONTEXT_EVENTS:
+                scope = scope_name(cache.contexts_key())
+                notification_type = getattr(event.notification, "notification_type", None)
+                if event_type == TM_EVENT_ON_DELETE_CONTEXT or notification_type == NOTIFICATION_TYPE_DELETED:
+                    removals.append((scope, str(event.object_id())))
+                    dropped.append(cache.objects_key(event.object_id()))
+                    continue
+            elif event_type in OBJECT_EVENTS:
+                obj = event.obj
+                if not "context_id" in obj or not "model" in obj:
+                    continue
+                scope = scope_name(cache.objects_key(obj["context_id"], obj["model"]))
+                if event_type == TM_EVENT_ON_DELETE_OBJECT:
+                    removals.append((scope, str(event.object_id())))
+                    continue
+            else:
+                continue
+            data = object_json(event.obj)
+            upserts.append((scope, str(data["id"]), APPENDED_POSITION, str(data.get("modified", "")), json.dumps(data)))
+        if not upserts and not removals:
+            return
+
+        with self.lock, self.connection:
+            known = set(row[0] for row in self.connection.execute("SELECT scope FROM scopes"))
+            # Updated objects keep their position
+            self.connection.executemany("INSERT INTO objects VALUES (?, ?, ?, ?, ?) ON CONFLICT (scope, object_id) "
+                                        "DO UPDATE SET modified = excluded.modified, data = excluded.data",
+                                        [row for row in upserts if row[0] in known])
+            self.connection.executemany("DELETE FROM objects WHERE scope = ? AND object_id = ?",
+                                        [row for row in removals if row[0] in known])
+            self.updates += len(upserts) + len(removals)
+        for key in dropped:
+            self.drop(key)
+
+    def clear(self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM objects")
+            self.connection.execute("DELETE FROM scopes")
+
+    def stats(self):
+        return {
+            "loads": self.loads,
+            "saves": self.saves,
+            "updates": self.updates,
+            "size": os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        }
+
+
+store = None
+store_failed = False
+store_disabled = False
+store_lock = threading.Lock()
+
+def disable():
+    # For one-off runs (the command line) that shouldn't touch the store
+    global store_disabled
+    store_disabled = True
+
+def get_store():
+    # None when snapshots are disabled or the file cannot be opened
+    global store, store_failed
+    with store_lock:
+        if store_disabled:
+            return None
+        if store is None and not store_failed and tmsettings.value("snapshotsEnabled", True, type=bool):
+            directory = os.path.dirname(tmsettings.fileName())
+            try:
+                os.makedirs(directory, exist_ok=True)
+                store = SnapshotStore(os.path.join(directory, SNAPSHOTS_FILE))
+            except (OSError, sqlite3.Error) as e:
+                console.log("Cannot open the snapshot store: {0}".format(e))
+                store_failed = True
+    return store
+
+def store_failure(e):
+    # Like a store that cannot be opened, one that breaks is not used again
+    global store, store_failed
+    console.log("Snapshot store error, snapshots are disabled: {0}".format(e))
+    with store_lock:
+        store = None
+        store_failed = True
+
+def load(key):
+    store = get_store()
+    try:
+        return store.load(key) if store else None
+    except (OSError, sqlite3.Error) as e:
+        store_failure(e)
+        return None
+
+def load_pages(key, page_size):
+    store = get_store()
+    try:
+        return store.load_pages(key, page_size) if store else None
+    except (OSError, sqlite3.Error) as e:
+        store_failure(e)
+        return None
+
+def save(key, objects):
+    store = get_store()
+    if store:
+        try:
+            store.save(key, objects)
+        except (OSError, sqlite3.Error) as e:
+            store_failure(e)
+
+def apply_events(events):
+    store = get_store()
+    if store:
+        try:
+            store.apply_events(events)
+        except (OSError, sqlite3.Error) as e:
+            store_failure(e)
@@ -0,0 +1,27 @@
+import collections
+import time
+
+# Imported first by main.py, so this is close to the process start
+started = time.perf_counter()
+marks = collections.OrderedDict()
+logged = set()
+
+
+def mark(name):
+    # Records the first time a startup milestone is reached and logs it
+    if name in marks:
+        return
+    marks[name] = time.perf_counter() - started
+    from PyQt5 import QtCore
+    if QtCore.QCoreApplication.instance() is None:
+        # Logged together with the next milestone
+        return
+    import console
+    for milestone, elapsed in marks.items():
+        if not milestone in logged:
+            logged.add(milestone)
+            console.log("Startup: {0} after {1:.0f} ms".format(milestone, elapsed * 1000))
+
+
+def report():
+    return dict(marks)
@@ -0,0 +1,297 @@
+import collections
+import threading
+import time
+from PyQt5 import QtCore, sip
+from settings import tmsettings
+from event import TelepatObjectAddEvent, TelepatObjectUpdateEvent, TelepatObjectDeleteEvent, TelepatBatchEvent
+from workers import SubscribeWorker, UnsubscribeWorker
+from telepat.models import TelepatBaseObject
+import cache
+import console
+import notifications
+import scheduler
+
+DEFAULT_GRACE_PERIOD = 120  # seconds an unused channel stays subscribed
+DEFAULT_MAX_CHANNELS = 20
+DEFAULT_MAX_OBJECTS = 500000  # objects kept over all channels
+DEFAULT_PAGE_SIZE = 1000
+EXPIRY_CHECK = 5000  # ms
+
+SUBSCRIBING = 0
+READY = 1
+FAILED = 2
+
+
+# A channel and the current objects of one model of a context. Pages from
+# the subscribe worker and the channel's notifications are applied to the
+# objects and passed on to the receivers (browser models) of the consumers.
+class Subscription(QtCore.QObject):
+    snapshot = QtCore.pyqtSignal(int, list)
+    subscribed = QtCore.pyqtSignal(int)
+    page = QtCore.pyqtSignal(list)
+    ready = QtCore.pyqtSignal()
+    failed = QtCore.pyqtSignal(int, str)
+
+    def __init__(self, key, context, model_name, parent=None):
+        super(Subscription, self).__init__(parent)
+        self.key = key
+        self.context = context
+        self.model_name = model_name
+        self.channel = None
+        self.identifier = None
+        self.objects = collections.OrderedDict()
+        self.removed = set()
+        self.total = None
+        self.state = SUBSCRIBING
+        self.refs = 0
+        self.last_used = time.monotonic()
+        self.receivers = []
+        self.worker = None
+        self.bytes = 0  # response size, only measured for prefetches
+
+    def start(self, page_size, priority=scheduler.PRIORITY_USER, measure=False):
+        self.worker = SubscribeWorker(None, self.context, self.model_name, TelepatBaseObject, page_size, measure)
+        self.worker.snapshot.connect(self.snapshot)
+        self.worker.size.connect(self.on_size)
+        self.worker.subscribed.connect(self.on_subscribed)
+        self.worker.page.connect(self.on_page)
+        self.worker.failed.connect(self.on_failed)
+        self.worker.finished.connect(self.on_finished)
+        self.worker.log.connect(console.log)
+        scheduler.submit(self.worker, priority)
+
+    def on_size(self, size):
+        self.bytes = size
+
+    def attach(self, channel, objects):
+        # Takes over a channel subscribed by someone else
+        self.on_subscribed(channel, len(objects))
+        self.on_page(objects)
+        self.state = READY
+
+    def on_subscribed(self, channel, total):
+        self.channel = channel
+        self.identifier = channel.subscription_identifier()
+        self.total = total
+        channel.on_add_object = self.on_add_object
+        channel.on_update_object = self.on_update_object
+        channel.on_delete_object = self.on_delete_object
+        self.subscribed.emit(total)
+
+    def on_page(self, objects):
+        for obj in objects:
+            # Notifications that came in first are newer than the page
+            if obj.id not in self.objects and obj.id not in self.removed:
+                self.objects[obj.id] = obj
+        self.page.emit(objects)
+
+    def on_failed(self, err_code, err_message):
+        self.state = FAILED
+        self.failed.emit(err_code, err_message)
+
+    def on_finished(self):
+        self.worker = None
+        if self.state == SUBSCRIBING:
+            if self.channel is None:
+                # Cancelled before it was subscribed
+                self.state = FAILED
+                return
+            self.state = READY
+            self.removed.clear()
+            self.ready.emit()
+
+    def add_receiver(self, receiver):
+        if receiver not in self.receivers:
+            self.receivers.append(receiver)
+
+    def remove_receiver(self, receiver):
+        if receiver in self.receivers:
+            self.receivers.remove(receiver)
+
+    def on_add_object(self, new_object, notification):
+        notifications.post(self, TelepatObjectAddEvent(new_object, notification))
+
+    def on_update_object(self, updated_object, notification):
+        notifications.post(self, TelepatObjectUpdateEvent(updated_object, notification))
+
+    def on_delete_object(self, deleted_object, notification):
+        notifications.post(self, TelepatObjectDeleteEvent(deleted_object, notification))
+
+    def event(self, event):
+        if isinstance(event, TelepatBatchEvent):
+            for object_event in event.events:
+                self.apply_event(object_event)
+            for receiver in list(self.receivers):
+                if sip.isdeleted(receiver):
+                    self.receivers.remove(receiver)
+                else:
+                    QtCore.QCoreApplication.sendEvent(receiver, TelepatBatchEvent(event.events))
+            return True
+        return super(Subscription, self).event(event)
+
+    def apply_event(self, event):
+        object_id = event.object_id()
+        if isinstance(event, TelepatObjectDeleteEvent):
+            self.objects.pop(object_id, None)
+            if self.state == SUBSCRIBING:
+                self.removed.add(object_id)
+        else:
+            # Updates keep the position, new objects go last
+            self.objects[object_id] = event.obj
+
+    def object_list(self):
+        return list(self.objects.values())
+
+    def close(self):
+        if self.worker is not None:
+            # A worker cancelled after subscribing drops the channel itself
+            scheduler.get_scheduler().cancel_worker(self.worker)
+            self.worker = None
+        if self.channel is not None:
+            self.channel.on_add_object = None
+            self.channel.on_update_object = None
+            self.channel.on_delete_object = None
+            worker = UnsubscribeWorker(None, self.channel)
+            worker.log.connect(console.log)
+            scheduler.submit(worker, scheduler.PRIORITY_BACKGROUND)
+            self.channel = None
+        self.receivers = []
+        self.deleteLater()
+
+
+# Shares channels between the browser, the object editors and prefetching.
+# Consumers acquire a subscription and release it when done; unused ones
+# stay subscribed and current for a grace period, so coming back to a
+# model is instant, and the least recently used ones are dropped first
+# when there are too many channels or objects.
+class SubscriptionManager(QtCore.QObject):
+    acquired = QtCore.pyqtSignal(object)
+    dropped = QtCore.pyqtSignal(object)
+
+    def __init__(self, grace_period=DEFAULT_GRACE_PERIOD, max_channels=DEFAULT_MAX_CHANNELS, max_objects=DEFAULT_MAX_OBJECTS):
+        super(SubscriptionManager, self).__init__()
+        self.grace_period = grace_period
+        self.max_channels = max_channels
+        self.max_objects = max_objects
+        self.subscriptions = collections.OrderedDict()  # least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.expiryTimer = QtCore.QTimer(self)
+        self.expiryTimer.setInterval(min(EXPIRY_CHECK, int(grace_period * 1000) or EXPIRY_CHECK))
+        self.expiryTimer.timeout.connect(self.expire)
+
+    def key(self, context, model_name):
+        return cache.objects_key(context.id, model_name)
+
+    def lookup(self, context, model_name):
+        # A subscription whose objects are all in, without acquiring it
+        subscription = self.subscriptions.get(self.key(context, model_name))
+        if subscription is not None and subscription.state == READY:
+            return subscription
+        return None
+
+    def acquire(self, context, model_name, page_size=None, priority=scheduler.PRIORITY_USER, measure=False):
+        key = self.key(context, model_name)
+        subscription = self.subscriptions.get(key)
+        if subscription is not None and subscription.state == FAILED:
+            self.drop(subscription)
+            subscription = None
+        if subscription is None:
+            self.misses += 1
+            subscription = self.subscriptions[key] = Subscription(key, context, model_name, self)
+            subscription.start(page_size or DEFAULT_PAGE_SIZE, priority, measure)
+        else:
+            self.hits += 1
+        self.subscriptions.move_to_end(key)
+        subscription.refs += 1
+        subscription.last_used = time.monotonic()
+        self.enforce_budget()
+        self.acquired.emit(subscription)
+        return subscription
+
+    def adopt(self, context, model_name, channel, objects):
+        # Keeps a channel opened elsewhere instead of unsubscribing it,
+        # the caller holds a reference to the returned subscription
+        key = self.key(context, model_name)
+        if key in self.subscriptions and self.subscriptions[key].state != FAILED:
+            worker = UnsubscribeWorker(None, channel)
+            worker.log.connect(console.log)
+            scheduler.submit(worker, scheduler.PRIORITY_BACKGROUND)
+            return self.acquire(context, model_name)
+        if key in self.subscriptions:
+            self.drop(self.subscriptions[key])
+        subscription = self.subscriptions[key] = Subscription(key, context, model_name, self)
+        subscription.attach(channel, objects)
+        subscription.refs = 1
+        self.enforce_budget()
+        return subscription
+
+    def release(self, subscription, receiver=None):
+        if receiver is not None:
+            subscription.remove_receiver(receiver)
+        subscription.refs = max(0, subscription.refs - 1)
+        subscription.last_used = time.monotonic()
+        if subscription.refs == 0:
+            if subscription.state == FAILED:
+                self.drop(subscription)
+            elif not self.expiryTimer.isActive():
+                self.expiryTimer.start()
+        self.enforce_budget()
+
+    def object_count(self):
+        return sum(len(subscription.objects) for subscription in self.subscriptions.values())
+
+    def enforce_budget(self):
+        idle = [subscription for subscription in self.subscriptions.values() if subscription.refs == 0]
+        while idle and (len(self.subscriptions) > self.max_channels or self.object_count() > self.max_objects):
+            self.evictions += 1
+            self.drop(idle.pop(0))
+
+    def expire(self):
+        now = time.monotonic()
+        idle = [subscription for subscription in self.subscriptions.values() if subscription.refs == 0]
+        for subscription in idle:
+            if subscription.last_used + self.grace_period <= now:
+                self.drop(subscription)
+        if not any(subscription.refs == 0 for subscription in self.subscriptions.values()):
+            self.expiryTimer.stop()
+
+    def drop(self, subscription):
+        if self.subscriptions.get(subscription.key) is subscription:
+            del self.subscriptions[subscription.key]
+        self.dropped.emit(subscription)
+        subscription.close()
+
+    def clear(self):
+        for subscription in list(self.subscriptions.values()):
+            self.drop(subscription)
+
+    def stats(self):
+        active = len([subscription for subscription in self.subscriptions.values() if subscription.refs])
+        return {
+            "channels": len(self.subscriptions),
+            "active": active,
+            "warm": len(self.subscriptions) - active,
+            "objects": self.object_count(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+    def summary(self):
+        return "Subscriptions: {channels} channels ({active} in use, {warm} warm), {objects} objects, {hits} hits, {misses} misses".format(**self.stats())
+
+
+manager = None
+manager_lock = threading.Lock()
+
+def get_manager():
+    global manager
+    with manager_lock:
+        if manager is None:
+            manager = SubscriptionManager(tmsettings.value("subscriptionGracePeriod", DEFAULT_GRACE_PERIOD, type=float),
+                                          tmsettings.value("subscriptionMaxChannels", DEFAULT_MAX_CHANNELS, type=int),
+                                          tmsettings.value("subscriptionMaxObjects", DEFAULT_MAX_OBJECTS, type=int))
+    return manager
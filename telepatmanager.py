@@ -2,33 +2,45 @@ import traceback
 import time
 import io
 from copy import copy
-from PyQt5 import QtGui, QtCore, QtWidgets, uic
+from PyQt5 import QtGui, QtCore, QtWidgets
 from settings import tmsettings
 from functools import partial
 from const import *
-from event import TelepatContextAddEvent, TelepatContextUpdateEvent, ExceptionEvent
-from conneditor import ConnectionEditor
-from contextitem import ContextItem
+from event import TelepatContextAddEvent, TelepatContextUpdateEvent, TelepatContextDeleteEvent, TelepatBatchEvent, ExceptionEvent
+from contextsmodel import ContextsModel
+from performancepanel import PerformancePanel
 from models.context import Context
-from models.model import Model
-from modelitem import ModelItem
-from workers import ContextsWorker, SchemaWorker, ApplicationsWorker, RegisterWorker, UsersWorker
+from workers import ContextsWorker, SchemaWorker, ApplicationsWorker, RegisterWorker
 from telepat.transportnotification import NOTIFICATION_TYPE_ADDED, NOTIFICATION_TYPE_DELETED, NOTIFICATION_TYPE_UPDATED
 import console
+import notifications
+import cache
+import userdirectory
+import prefetch
+import scheduler
+import startup
+from pipeline import Pipeline
+import instrumentation
+from uiloader import load_ui
 
 
 class TelepatManager(QtWidgets.QMainWindow):
     def __init__(self, parent=None):
         super(TelepatManager, self).__init__(parent)
         self.applications = []
+        self.user_directory = None
+        self.app_switch = None
 
-        uic.loadUi('telepatmanager.ui', self)
+        load_ui('telepatmanager.ui', self)
         console.set_widget(self.loggerWidget)
 
         self.actionConnect.triggered.connect(self.openConnection)
-        self.actionRefresh.triggered.connect(self.refreshContexts)
+        self.actionExportLog.triggered.connect(self.exportLog)
+        self.actionRefresh.triggered.connect(self.refresh)
         self.actionEditApp.triggered.connect(self.editApplication)
         self.actionShowNameId.toggled.connect(self.showNameId)
+        self.actionProfileCpu.toggled.connect(self.profileCpu)
+        self.actionTraceMemory.toggled.connect(self.traceMemory)
         self.contextsTreeView.clicked.connect(self.itemSelected)
         self.filterLineEdit.textChanged.connect(self.filterChanged)
 
@@ -38,15 +50,25 @@ class TelepatManager(QtWidgets.QMainWindow):
         self.setupHistoryMenu()
         self.setupSplitters()
         self.setupAppsCombobox()
+        self.setupStatusBar()
+        self.setupPerformancePanel()
         self.treeViewLayout.setContentsMargins(0, 0, 0, 0)
         self.stackedWidget.setContentsMargins(0, 0, 0, 0)
         self.setUnifiedTitleAndToolBarOnMac(True)
 
-        self.contexts_model = QtGui.QStandardItemModel()
+        self.contexts_model = ContextsModel(self)
         self.proxy = QtCore.QSortFilterProxyModel(self)
         self.proxy.setSourceModel(self.contexts_model)
         self.proxy.setFilterCaseSensitivity(QtCore.Qt.CaseInsensitive)
+        self.contextsTreeView.setUniformRowHeights(True)
         self.contextsTreeView.setModel(self.proxy)
+        self.contextsTreeView.setContextMenuPolicy(QtCore.Qt.ActionsContextMenu)
+        self.exportObjectsAction = QtWidgets.QAction("Export objects...", self.contextsTreeView)
+        self.exportObjectsAction.triggered.connect(self.exportObjects)
+        self.contextsTreeView.addAction(self.exportObjectsAction)
+        self.importObjectsAction = QtWidgets.QAction("Import objects...", self.contextsTreeView)
+        self.importObjectsAction.triggered.connect(self.importObjects)
+        self.contextsTreeView.addAction(self.importObjectsAction)
 
         console.log("Application started")
 
@@ -83,28 +105,112 @@ class TelepatManager(QtWidgets.QMainWindow):
         layout.addWidget(self.appsCombobox)
         self.applicationToolbar.insertWidget(self.actionEditApp, widget)
 
+    def setupStatusBar(self):
+        self.notificationsLabel = QtWidgets.QLabel(self)
+        self.statusbar.addPermanentWidget(self.notificationsLabel)
+        notifications.get_queue().delivered.connect(self.notificationsDelivered)
+
+    def setupPerformancePanel(self):
+        self.performancePanel = PerformancePanel(self)
+        self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, self.performancePanel)
+        self.performancePanel.hide()
+        self.menuView.addAction(self.performancePanel.toggleViewAction())
+
+    def profileCpu(self, enabled):
+        if enabled:
+            instrumentation.profiler.start_cpu()
+            console.log("CPU profiling started")
+        else:
+            self.performancePanel.showProfile("CPU", instrumentation.profiler.stop_cpu())
+
+    def traceMemory(self, enabled):
+        if enabled:
+            instrumentation.profiler.start_memory()
+            console.log("Memory allocation tracing started")
+        else:
+            self.performancePanel.showProfile("Memory", instrumentation.profiler.stop_memory())
+
+    def notificationsDelivered(self, received, applied):
+        self.notificationsLabel.setText("Notifications: {0} received, {1} applied".format(received, applied))
+
     def openConnection(self, connection_dict=None):
+        # Pulls in the telepat client, only needed once the user connects
+        from conneditor import ConnectionEditor
         self.connectionEditor = ConnectionEditor(self, connection_dict)
         self.connectionEditor.success.connect(self.login_success)
         self.connectionEditor.show()
 
+    def exportLog(self):
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Export log", "telepatmanager.log", "Log files (*.log *.txt)")
+        if not path:
+            return
+        try:
+            count = console.export(path)
+        except OSError as e:
+            QtWidgets.QMessageBox.critical(self, "Log export error", "Cannot write {0}: {1}".format(path, e))
+            return
+        console.log("Exported {0} log lines to {1}".format(count, path))
+
+    def exportObjects(self):
+        # Every model of a selected context, or the selected model
+        index = self.contextsTreeView.currentIndex()
+        if not index.isValid():
+            return
+        source_index = self.proxy.mapToSource(index)
+        context = self.contexts_model.context_for(source_index)
+        if not context:
+            return
+        if self.contexts_model.is_context(source_index):
+            targets = [(context, name) for name, model in self.contexts_model.schema_models]
+            default_name = "{0}.jsonl".format(context.id)
+        else:
+            model_name = self.contexts_model.model_name_for(source_index)
+            targets = [(context, model_name)]
+            default_name = "{0}-{1}.jsonl".format(context.id, model_name)
+        from export import export_objects
+        export_objects(self, targets, default_name)
+
+    def importObjects(self):
+        # Into the selected model of its context
+        index = self.contextsTreeView.currentIndex()
+        if not index.isValid():
+            return
+        source_index = self.proxy.mapToSource(index)
+        context = self.contexts_model.context_for(source_index)
+        if not context or self.contexts_model.is_context(source_index):
+            QtWidgets.QMessageBox.information(self, "Import", "Select the model to import the objects into")
+            return
+        from importer import import_objects
+        import_objects(self, context, self.contexts_model.model_name_for(source_index), self.user_directory)
+
+    def refresh(self):
+        # An explicit refresh should not be answered from the cache
+        cache.invalidate_app()
+        userdirectory.drop_directory()
+        self.user_directory = userdirectory.get_directory()
+        self.refreshContexts()
+
     def refreshContexts(self):
+        from_snapshot = []
+
+        def contexts_snapshot(contexts_list):
+            application = self.applications[self.appsCombobox.currentIndex()]
+            self.contexts_model.set_contexts(contexts_list, application.schema)
+            from_snapshot.append(True)
+
         def contexts_success(contexts_list):
             telepat = QtCore.QCoreApplication.instance().telepat_instance
             telepat.on_update_context = self.on_update_context
             telepat.on_add_context = self.on_add_context
+            telepat.on_delete_context = self.on_delete_context
             application = self.applications[self.appsCombobox.currentIndex()]
 
-            self.contexts_model.setHorizontalHeaderLabels(["Contexts"])
             self.actionRefresh.setEnabled(True)
-            for ctx in contexts_list:
-                item = ContextItem(ctx)
-                item.setEditable(False)
-                for key in application.schema:
-                    subitem = ModelItem(key, Model(application.schema[key].to_json()))
-                    subitem.setEditable(False)
-                    item.appendRow(subitem)
-                self.contexts_model.appendRow(item)
+            if from_snapshot:
+                changed = self.contexts_model.reconcile(contexts_list)
+                console.log("{0} contexts changed since the local snapshot".format(changed))
+            else:
+                self.contexts_model.set_contexts(contexts_list, application.schema)
 
         def contexts_failed(err_code, msg):
             self.actionRefresh.setEnabled(True)
@@ -113,23 +219,24 @@ class TelepatManager(QtWidgets.QMainWindow):
         self.actionRefresh.setEnabled(False)
         self.contexts_model.clear()
         self.contexts_worker = ContextsWorker(self)
+        self.contexts_worker.snapshot.connect(contexts_snapshot)
         self.contexts_worker.success.connect(contexts_success)
         self.contexts_worker.failed.connect(contexts_failed)
         self.contexts_worker.log.connect(console.log)
-        self.contexts_worker.start()
+        scheduler.submit(self.contexts_worker, key="contexts")
+        return self.contexts_worker
 
     def getUsers(self):
-        def users_success(users_list):
-            self.app_users = users_list
-
+        # Only the first page, editors fetch more as they search
         def users_failed(err_code, err_msg):
             QtWidgets.QMessageBox.critical(self, "Cannot get application's users list", "Error {0}: {1}".format(err_code, err_msg))
 
-        self.users_worker = UsersWorker()
-        self.users_worker.success.connect(users_success)
-        self.users_worker.failed.connect(users_failed)
-        self.users_worker.log.connect(console.log)
-        self.users_worker.start()
+        self.user_directory = userdirectory.get_directory()
+        # Coming back to an app keeps the pages it already has
+        self.users_worker = self.user_directory.fetch_more() if len(self.user_directory) == 0 else None
+        if self.users_worker is not None:
+            self.users_worker.failed.connect(users_failed)
+        return self.users_worker
 
     def editApplication(self):
         def schema_success(app_schema):
@@ -143,42 +250,108 @@ class TelepatManager(QtWidgets.QMainWindow):
         self.schema_worker.success.connect(schema_success)
         self.schema_worker.failed.connect(schema_failed)
         self.schema_worker.log.connect(console.log)
-        self.schema_worker.start()
+        scheduler.submit(self.schema_worker)
 
     def on_update_context(self, context, notification):
         event = TelepatContextUpdateEvent(context, notification)
-        QtWidgets.QApplication.postEvent(self, event)
+        notifications.post(self, event)
 
     def on_add_context(self, context, notification):
         event = TelepatContextAddEvent(context, notification)
-        QtWidgets.QApplication.postEvent(self, event)
+        notifications.post(self, event)
+
+    def on_delete_context(self, context, notification):
+        event = TelepatContextDeleteEvent(context, notification)
+        notifications.post(self, event)
 
     def currentAppChanged(self, index):
         telepat = QtCore.QCoreApplication.instance().telepat_instance
         app = self.applications[index]
         telepat.app_id = app["id"]
         telepat.api_key = app["keys"][0]
-        self.registerDevice()
-        self.getUsers()
-        self.refreshContexts()
+
+        # A switch superseded by a newer one drops its pending results
+        if self.app_switch:
+            self.app_switch.cancel()
+        prefetch.cancel()
+        self.app_switch = Pipeline("AppSwitch", self)
+        # Contexts, users and the device registration don't depend on each
+        # other; the contexts tree is usable once its snapshot is shown
+        self.app_switch.add_stage("register", self.registerDevice)
+        self.app_switch.add_stage("users", self.getUsers)
+        self.app_switch.add_stage("contexts", self.refreshContexts, signals=("snapshot", "success"))
+        switch = self.app_switch
+
+        def stage_finished(name, ok):
+            if name == "contexts" and ok:
+                console.log("{0}: contexts ready after {1:.2f}s".format(app.name, switch.stages[name].finished_at - switch.started_at))
+
+        def switch_finished():
+            console.log("Switched to {0} in {1}".format(app.name, switch.report()))
+
+        switch.stage_finished.connect(stage_finished)
+        switch.finished.connect(switch_finished)
+        switch.start()
 
     def filterChanged(self):
         self.proxy.setFilterRegExp(self.filterLineEdit.text())
 
     def itemSelected(self, index):
-        item = self.contexts_model.itemFromIndex(index.model().mapToSource(index))
-        if type(item) == ContextItem:
+        source_index = index.model().mapToSource(index)
+        context = self.contexts_model.context_for(source_index)
+        if self.contexts_model.is_context(source_index):
             self.stackedWidget.setCurrentIndex(0)
-            self.tableView.editObject(item.context)
-        elif type(item) == ModelItem:
+            self.tableView.editObject(context)
+            self.prefetchNeighbours(index)
+        elif context:
             self.stackedWidget.setCurrentIndex(1)
-            self.modelBrowser.browseModel(item.parent().context, item.text(), self.app_users)
+            model_name = self.contexts_model.model_name_for(source_index)
+            selected = QtCore.QPersistentModelIndex(index)
+
+            def browse():
+                self.modelBrowser.browseModel(context, model_name, self.user_directory)
+                # After the browser holds its model, a prefetch of it is not cancelled
+                self.prefetchNeighbours(QtCore.QModelIndex(selected))
+
+            # Subscribing needs the registered device
+            if self.app_switch:
+                self.app_switch.when_done(("register",), browse, key="browse")
+            else:
+                browse()
+
+    def prefetchNeighbours(self, index):
+        # Models of the selected context first; for a model, the models next
+        # to it and the same model in the contexts above and below
+        if not prefetch.enabled() or not index.isValid():
+            prefetch.cancel()
+            return
+        source_index = self.proxy.mapToSource(index)
+        context = self.contexts_model.context_for(source_index)
+        model_names = [name for name, model in self.contexts_model.schema_models]
+        max_models = tmsettings.value("prefetchMaxModels", prefetch.DEFAULT_MAX_MODELS, type=int)
+        if self.contexts_model.is_context(source_index):
+            candidates = [(context, name) for name in model_names]
+        else:
+            model_name = self.contexts_model.model_name_for(source_index)
+            row = model_names.index(model_name)
+            context_row = index.parent().row()
+
+            def model_at(row):
+                if 0 <= row < len(model_names):
+                    return context, model_names[row]
+
+            def context_at(row):
+                # In the order the tree shows them, filtered or not
+                if 0 <= row < self.proxy.rowCount():
+                    return self.contexts_model.context_for(self.proxy.mapToSource(self.proxy.index(row, 0))), model_name
+
+            candidates = [model_at(row + 1), context_at(context_row + 1), model_at(row - 1),
+                          context_at(context_row - 1), model_at(row + 2), model_at(row - 2)]
+            candidates = [candidate for candidate in candidates if candidate]
+        prefetch.get_prefetcher().navigate(candidates[:max_models])
 
     def showNameId(self):
-        i = 0
-        while self.contexts_model.item(i):
-            self.contexts_model.item(i).show_name(self.actionShowNameId.isChecked())
-            i += 1
+        self.contexts_model.set_show_names(self.actionShowNameId.isChecked())
             
     def registerDevice(self):
         def register_success():
@@ -191,7 +364,8 @@ class TelepatManager(QtWidgets.QMainWindow):
         self.register_worker.success.connect(register_success)
         self.register_worker.failed.connect(register_failed)
         self.register_worker.log.connect(console.log)
-        self.register_worker.start()
+        scheduler.submit(self.register_worker, key="register")
+        return self.register_worker
 
     def login_success(self):
         def apps_success(apps_list):
@@ -200,6 +374,7 @@ class TelepatManager(QtWidgets.QMainWindow):
                 self.appsCombobox.addItem("{0} ({1})".format(app.name, app.id))
             self.appsCombobox.setDisabled(False)
             self.actionEditApp.setDisabled(False)
+            startup.mark("first connection ready")
 
         def apps_failed(err_code, msg):
             QtWidgets.QMessageBox.critical(self, "Failed to retrieve applications", "Error {0}: {1}".format(err_code, msg))
@@ -208,7 +383,7 @@ class TelepatManager(QtWidgets.QMainWindow):
         self.apps_worker.success.connect(apps_success)
         self.apps_worker.failed.connect(apps_failed)
         self.apps_worker.log.connect(console.log)
-        self.apps_worker.start()
+        scheduler.submit(self.apps_worker, key="applications")
 
     def process_context_add_event(self, event):
         application = self.applications[self.appsCombobox.currentIndex()]
@@ -216,32 +391,48 @@ class TelepatManager(QtWidgets.QMainWindow):
         if not context.application_id == application["id"]:
             return
 
-        item = ContextItem(Context(context.to_json()))
-        item.setEditable(False)
-        for key in application:
-            subitem = ModelItem(key, Model(application.schema[key].to_json()))
-            subitem.setEditable(False)
-            item.appendRow(subitem)
-        self.contexts_model.appendRow(item)
+        row = self.contexts_model.row_for_id(context.id)
+        if row < 0:
+            self.contexts_model.append_context(Context(context.to_json()))
+        else:
+            self.contexts_model.update_context(row, Context(context.to_json()))
 
     def process_context_update_event(self, event):
-        context = event.obj
-        i = 0
-        while self.contexts_model.item(i):
-            if context.id == self.contexts_model.item(i).context.id:
-                if event.notification.notification_type == NOTIFICATION_TYPE_UPDATED:
-                    self.contexts_model.item(i).context = Context(event.obj.to_json())
-                    self.tableView.editObject(self.contexts_model.item(i).context)
-                    break
-            i += 1
+        if event.notification.notification_type == NOTIFICATION_TYPE_DELETED:
+            self.process_context_delete_event(event)
+            return
+        elif event.notification.notification_type != NOTIFICATION_TYPE_UPDATED:
+            return
+
+        row = self.contexts_model.row_for_id(event.obj.id)
+        if row < 0:
+            return
+        context = Context(event.obj.to_json())
+        self.contexts_model.update_context(row, context)
+        # Only refresh the editor if it is showing this context
+        if self.tableView.original_object and self.tableView.original_object.id == context.id:
+            self.tableView.editObject(context)
+
+    def process_context_delete_event(self, event):
+        self.contexts_model.remove_context(event.obj.id)
             
-    def event(self, event):
-        if isinstance(event, ExceptionEvent):
-            event.callback()
-        elif isinstance(event, TelepatContextUpdateEvent):
+    def process_context_event(self, event):
+        if isinstance(event, TelepatContextUpdateEvent):
             self.process_context_update_event(event)
         elif isinstance(event, TelepatContextAddEvent):
             self.process_context_add_event(event)
+        elif isinstance(event, TelepatContextDeleteEvent):
+            self.process_context_delete_event(event)
+
+    def event(self, event):
+        if isinstance(event, ExceptionEvent):
+            event.callback()
+        elif isinstance(event, TelepatBatchEvent):
+            for context_event in event.events:
+                self.process_context_event(context_event)
+            return True
+        else:
+            self.process_context_event(event)
         return super(TelepatManager, self).event(event)
         
     def excepthook(self, excType, excValue, tracebackobj):
@@ -0,0 +1,84 @@
+#! /usr/bin/env python
+# Loads Qt Designer forms from Python modules compiled next to the .ui files
+# instead of parsing the XML every time a window is opened. A module is
+# rebuilt when its .ui file is newer, and uic.loadUi is used when it can't be.
+#
+#   python uiloader.py    compiles every .ui file up front
+import glob
+import importlib.util
+import io
+import os
+import sys
+from PyQt5 import QtCore, uic
+import console
+
+UI_DIR = os.path.dirname(os.path.abspath(__file__))
+# uic names resource modules after the .qrc file, run.sh compiles them differently
+RESOURCE_MODULES = {"icons_rc": "iconrc"}
+
+forms = {}
+
+
+def module_path(ui_file):
+    name = os.path.splitext(os.path.basename(ui_file))[0]
+    return os.path.join(UI_DIR, "ui_{0}.py".format(name))
+
+
+def report(message):
+    # The console of the running application, stderr when compiling up front
+    if QtCore.QCoreApplication.instance() is None:
+        sys.stderr.write(message + "\n")
+    else:
+        console.log(message)
+
+
+def compile_ui(ui_file):
+    # Returns the path of an up to date module, or None if it can't be written
+    ui_path = os.path.join(UI_DIR, ui_file)
+    py_path = module_path(ui_file)
+    try:
+        if os.path.exists(py_path) and os.path.getmtime(py_path) >= os.path.getmtime(ui_path):
+            return py_path
+        code = io.StringIO()
+        uic.compileUi(ui_path, code)
+        code = code.getvalue()
+        for resource, module in RESOURCE_MODULES.items():
+            code = code.replace("import {0}\n".format(resource), "import {0}\n".format(module))
+        with open(py_path + ".tmp", "w") as py_file:
+            py_file.write(code)
+        os.replace(py_path + ".tmp", py_path)
+    except OSError as e:
+        report("Cannot compile {0}: {1}".format(ui_file, e))
+        return None
+    return py_path
+
+
+def form_class(ui_file):
+    if not ui_file in forms:
+        forms[ui_file] = None
+        py_path = compile_ui(ui_file)
+        if py_path:
+            spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(py_path))[0], py_path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            forms[ui_file] = next(getattr(module, name) for name in dir(module) if name.startswith("Ui_"))
+    return forms[ui_file]
+
+
+def load_ui(ui_file, widget):
+    # Drop-in for uic.loadUi(ui_file, widget)
+    form = form_class(ui_file)
+    if form is None:
+        return uic.loadUi(os.path.join(UI_DIR, ui_file), widget)
+    ui = form()
+    ui.setupUi(widget)
+    # Like loadUi, child widgets become attributes of the widget itself
+    for name, value in vars(ui).items():
+        setattr(widget, name, value)
+    return widget
+
+
+if __name__ == "__main__":
+    for ui_path in sorted(glob.glob(os.path.join(UI_DIR, "*.ui"))):
+        if not compile_ui(os.path.basename(ui_path)):
+            sys.exit(1)
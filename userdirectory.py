@@ -0,0 +1,166 @@
+import bisect
+import re
+from PyQt5 import QtCore
+from settings import tmsettings
+from workers import UsersWorker
+import cache
+import console
+import scheduler
+
+DEFAULT_PAGE_SIZE = 500
+COMPLETION_LIMIT = 50  # suggestions shown, fewer matches fetch the next page
+SEARCH_FIELDS = ("id", "username", "name", "email")
+WORD_SEPARATORS = re.compile(r"[\W_]+")
+
+
+def field(user, name):
+    return user[name] if name in user and user[name] is not None else None
+
+def tokenize(user):
+    # Every field is matched from its start or from the start of any word
+    # in it, e.g. "jdoe@example.com" is found by "jd", "exa" and "com"
+    tokens = set()
+    for name in SEARCH_FIELDS:
+        value = field(user, name)
+        if value is None:
+            continue
+        value = str(value).lower()
+        tokens.add(value)
+        tokens.update(word for word in WORD_SEPARATORS.split(value) if word)
+    return tokens
+
+
+# The users of an application, fetched a page at a time when a search runs
+# out of loaded matches. Users are kept by id and indexed as pages arrive,
+# so searching never scans the whole list.
+class UserDirectory(QtCore.QObject):
+    changed = QtCore.pyqtSignal()
+
+    def __init__(self, page_size=DEFAULT_PAGE_SIZE, parent=None):
+        super(UserDirectory, self).__init__(parent)
+        self.page_size = page_size
+        self.users = {}
+        self.positions = {}
+        self.order = []
+        self.tokens = []  # sorted (token, user id) pairs
+        self.offset = 0
+        self.complete = False
+        self.worker = None
+
+    def __len__(self):
+        return len(self.order)
+
+    def user(self, user_id):
+        return self.users.get(user_id)
+
+    def label(self, user_id):
+        user = self.users.get(user_id)
+        if user is None:
+            return user_id
+        name = field(user, "name")
+        username = field(user, "username")
+        if name and username:
+            return "{0} <{1}>".format(name, username)
+        return name or username or user_id
+
+    def fetch_more(self):
+        # Returns the worker of the page being fetched, None once all are in
+        if self.worker is not None and self.worker.cancelled:
+            # Dropped by a superseded app switch, its page never arrives
+            self.worker = None
+        if self.complete or self.worker is not None:
+            return self.worker
+
+        def users_success(users_list, more):
+            self.worker = None
+            self.add_page(users_list, more)
+
+        def users_failed(err_code, err_msg):
+            self.worker = None
+
+        self.worker = UsersWorker(None, self.offset, self.page_size)
+        self.worker.success.connect(users_success)
+        self.worker.failed.connect(users_failed)
+        self.worker.log.connect(console.log)
+        scheduler.submit(self.worker)
+        return self.worker
+
+    def add_page(self, users_list, more):
+        self.offset += len(users_list)
+        added = []
+        for user in users_list:
+            if user.id is None or user.id in self.users:
+                continue
+            self.users[user.id] = user
+            self.positions[user.id] = len(self.order)
+            self.order.append(user.id)
+            added.extend((token, user.id) for token in tokenize(user))
+        if added:
+            # Sorting the appended page is cheap, the rest is already in order
+            self.tokens.extend(added)
+            self.tokens.sort()
+        self.complete = not more
+        self.changed.emit()
+
+    def search(self, text, limit=COMPLETION_LIMIT):
+        words = [word for word in WORD_SEPARATORS.split(text.lower()) if word]
+        if not words:
+            return self.order[:limit]
+        found = None
+        for word in words:
+            ids = set()
+            i = bisect.bisect_left(self.tokens, (word,))
+            while i < len(self.tokens) and self.tokens[i][0].startswith(word):
+                ids.add(self.tokens[i][1])
+                i += 1
+            found = ids if found is None else found & ids
+            if not found:
+                return []
+        return sorted(found, key=self.positions.get)[:limit]
+
+    def complete_search(self, text, limit=COMPLETION_LIMIT):
+        # Loaded matches right away, the next page is fetched if they are few
+        results = self.search(text, limit)
+        if len(results) < limit:
+            self.fetch_more()
+        return results
+
+
+class UserCompletionModel(QtCore.QAbstractListModel):
+    # Shows the matching users by name and completes to their id
+    def __init__(self, directory, parent=None):
+        super(UserCompletionModel, self).__init__(parent)
+        self.directory = directory
+        self.ids = []
+
+    def set_query(self, text):
+        self.beginResetModel()
+        self.ids = self.directory.complete_search(text)
+        self.endResetModel()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.ids)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return QtCore.QVariant()
+        user_id = self.ids[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            return self.directory.label(user_id)
+        if role == QtCore.Qt.EditRole or role == QtCore.Qt.ToolTipRole:
+            return user_id
+        return QtCore.QVariant()
+
+
+directories = {}
+
+def get_directory():
+    # One directory per server and application, kept across app switches
+    key = cache.app_key()
+    directory = directories.get(key)
+    if directory is None:
+        directory = directories[key] = UserDirectory(tmsettings.value("usersPageSize", DEFAULT_PAGE_SIZE, type=int))
+    return directory
+
+def drop_directory():
+    directories.pop(cache.app_key(), None)
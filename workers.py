@@ -1,15 +1,67 @@
+import inspect
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from PyQt5 import QtCore
 from telepat import TelepatContext, TelepatResponse, TelepatError
-from requests.exceptions import ConnectionError
+from requests.exceptions import RequestException
 import errors
+import cache
+import snapshots
+import instrumentation
+from settings import tmsettings
 from models.context import Context
 from models.model import Model
 from telepat.models import TelepatApplication, TelepatAppSchema, TelepatBaseObject, TelepatUser
 from telepat.channel import TelepatChannel
 from telepat import TelepatTransportNotification
 
+DEFAULT_PATCH_PARALLELISM = 8
+
+def response_size(response):
+    # Size of the response body, measured from its JSON when the client
+    # doesn't keep the raw body around
+    content = getattr(response, "content", None)
+    if isinstance(content, (bytes, str)):
+        return len(content)
+    return len(json.dumps(response.json(), default=str))
+
+def response_content(response):
+    # The content of a response as plain dicts, without building objects
+    content = getattr(response, "content", None)
+    if isinstance(content, (list, dict)):
+        return content
+    return response.json().get("content")
+
+
 class BaseWorker(QtCore.QThread):
     log = QtCore.pyqtSignal(str)
+    cancelled = False
+    finished_at = None
+    result_signals = ("success", "failed")
+
+    def __init__(self, parent=None):
+        super(BaseWorker, self).__init__(parent)
+        # Stamped in the worker thread, the scheduler measures how long the
+        # finished signal takes to reach the GUI thread
+        self.finished.connect(self.stamp_finished, QtCore.Qt.DirectConnection)
+
+    def stamp_finished(self):
+        self.finished_at = time.monotonic()
+
+    def timed(self, stage):
+        # Records a stage of the worker, e.g. "ContextsWorker.network"
+        return instrumentation.timed("{0}.{1}".format(type(self).__name__, stage))
+
+    def cancel(self):
+        # Results of a cancelled worker are dropped
+        self.cancelled = True
+        self.requestInterruption()
+        for name in self.result_signals:
+            try:
+                getattr(self, name).disconnect()
+            except TypeError:
+                pass
 
     def connection_error(self, e):
         self.log.emit("Connection error: {0}".format(str(e)))
@@ -27,7 +79,8 @@ class RegisterWorker(BaseWorker):
         telepat = QtCore.QCoreApplication.instance().telepat_instance
         try:
             self.log.emit("Registering device...")
-            register_response = telepat.register_device(self.update)
+            with self.timed("network"):
+                register_response = telepat.register_device(self.update)
             if not register_response.status_code == 200:
                 msg = "Failed to register device"
                 if "message" in register_response.json():
@@ -39,6 +92,8 @@ class RegisterWorker(BaseWorker):
                 self.success.emit()
         except TelepatError as e:
             self.failed.emit(errors.TELEPAT_GENERAL_ERROR, str(e))
+        except RequestException as e:
+            self.connection_error(e)
 
 
 class LoginWorker(BaseWorker):
@@ -53,8 +108,9 @@ class LoginWorker(BaseWorker):
     def run(self):
         telepat = QtCore.QCoreApplication.instance().telepat_instance
         try:
-            login_response = telepat.login_admin(self.username, self.password)
-        except ConnectionError as e:
+            with self.timed("network"):
+                login_response = telepat.login_admin(self.username, self.password)
+        except RequestException as e:
             self.connection_error(e)
             return
             
@@ -72,12 +128,20 @@ class LoginWorker(BaseWorker):
 class ContextsWorker(BaseWorker):
     success = QtCore.pyqtSignal(list)
     failed = QtCore.pyqtSignal(int, str)
+    snapshot = QtCore.pyqtSignal(list)
+    result_signals = ("success", "failed", "snapshot")
 
     def run(self):
         telepat = QtCore.QCoreApplication.instance().telepat_instance
+        # Show the last known contexts while the server is asked for fresh ones
+        snapshot = snapshots.load(cache.contexts_key())
+        if snapshot is not None:
+            self.log.emit("Loaded {0} contexts from the local snapshot".format(len(snapshot)))
+            self.snapshot.emit([Context(context) for context in snapshot])
         try:
-            contexts_response = telepat.get_all()
-        except ConnectionError as e:
+            with self.timed("network"):
+                contexts_response = telepat.get_all()
+        except RequestException as e:
             self.connection_error(e)
             return
         if not contexts_response.status == 200:
@@ -87,9 +151,11 @@ class ContextsWorker(BaseWorker):
             self.log.emit("Error {0} while retrieving contexts: {1}".format(contexts_response.status, msg))
             self.failed.emit(contexts_response.status, msg)
         else:
-            contexts_list = contexts_response.getObjectOfType(Context)
+            with self.timed("decode"):
+                contexts_list = contexts_response.getObjectOfType(Context)
             self.log.emit("Successfully retrieved {0} contexts".format(len(contexts_list)))
             self.success.emit(contexts_list)
+            snapshots.save(cache.contexts_key(), contexts_list)
 
 class SchemaWorker(BaseWorker):
     success = QtCore.pyqtSignal(TelepatAppSchema)
@@ -97,9 +163,20 @@ class SchemaWorker(BaseWorker):
 
     def run(self):
         telepat = QtCore.QCoreApplication.instance().telepat_instance
+        app_schema = cache.get_cache().get(cache.schema_key())
+        if app_schema is not None:
+            self.log.emit("Using cached application schema ({0})".format(cache.get_cache().summary()))
+            self.success.emit(app_schema)
+            return
         try:
-            schema_response = telepat.get_schema()
-        except ConnectionError as e:
+            with self.timed("network"):
+                schema_response = telepat.get_schema()
+        except RequestException as e:
+            snapshot = snapshots.load(cache.schema_key())
+            if snapshot:
+                self.log.emit("Connection error: {0}, using the schema from the local snapshot".format(str(e)))
+                self.success.emit(TelepatAppSchema(snapshot[0]))
+                return
             self.connection_error(e)
             return
         if not schema_response.status == 200:
@@ -109,29 +186,65 @@ class SchemaWorker(BaseWorker):
             self.log.emit("Error {0} while retrieving schema: {1}".format(schema_response.status_code, msg))
             self.failed.emit(schema_response.status_code, msg)
         else:
-            app_schema = schema_response.getObjectOfType(TelepatAppSchema)
+            with self.timed("decode"):
+                app_schema = schema_response.getObjectOfType(TelepatAppSchema)
+            cache.get_cache().put(cache.schema_key(), app_schema)
             self.log.emit("Successfully retrieved application schema")
             self.success.emit(app_schema)
+            snapshots.save(cache.schema_key(), [app_schema])
+
+
+def supports_paging(get_users):
+    # Older clients only return every user at once
+    try:
+        parameters = inspect.signature(get_users).parameters
+    except (TypeError, ValueError):
+        return False
+    return "offset" in parameters and "limit" in parameters or \
+        any(parameter.kind == inspect.Parameter.VAR_KEYWORD for parameter in parameters.values())
 
 
 class UsersWorker(BaseWorker):
-    success = QtCore.pyqtSignal(list)
+    success = QtCore.pyqtSignal(list, bool)  # users, more pages available
     failed = QtCore.pyqtSignal(int, str)
 
+    def __init__(self, parent=None, offset=0, limit=None):
+        super(UsersWorker, self).__init__(parent)
+        self.offset = offset
+        self.limit = limit
+
     def run(self):
         telepat = QtCore.QCoreApplication.instance().telepat_instance
+        key = cache.users_key() + (self.offset, self.limit)
+        page = cache.get_cache().get(key)
+        if page is not None:
+            self.log.emit("Using {0} cached users ({1})".format(len(page), cache.get_cache().summary()))
+            self.success.emit(page, self.limit is not None and len(page) == self.limit)
+            return
+        # Without paging in the client, everything comes at once
+        paged = self.limit is not None and supports_paging(telepat.get_users)
         try:
-            users_response = telepat.get_users()
-        except ConnectionError as e:
+            with self.timed("network"):
+                if paged:
+                    users_response = telepat.get_users(offset=self.offset, limit=self.limit)
+                else:
+                    users_response = telepat.get_users()
+        except RequestException as e:
             self.connection_error(e)
             return
         if not users_response.status == 200:
             self.log.emit("Error {0} while retrieving app users: {1}".format(users_response.status, users_response.message))
             self.failed.emit(users_response.status, users_response.message)
         else:
-            users_list = users_response.getObjectOfType(TelepatUser)
-            self.log.emit("Successfully retrieved {0} users".format(len(users_list)))
-            self.success.emit(users_list)
+            with self.timed("decode"):
+                users_list = users_response.getObjectOfType(TelepatUser)
+            cache.get_cache().put(key, users_list)
+            if paged:
+                self.log.emit("Retrieved {0} users from offset {1}".format(len(users_list), self.offset))
+                self.success.emit(users_list, len(users_list) == self.limit)
+            else:
+                self.log.emit("Successfully retrieved {0} users".format(len(users_list)))
+                self.success.emit(users_list, False)
 
 
 class ApplicationsWorker(BaseWorker):
@@ -141,8 +254,9 @@ class ApplicationsWorker(BaseWorker):
     def run(self):
         telepat = QtCore.QCoreApplication.instance().telepat_instance
         try:
-            apps_response = telepat.get_apps()
-        except ConnectionError as e:
+            with self.timed("network"):
+                apps_response = telepat.get_apps()
+        except RequestException as e:
             self.connection_error(e)
             return
         if not apps_response.status == 200:
@@ -152,7 +266,8 @@ class ApplicationsWorker(BaseWorker):
             self.log.emit("Error {0} while retrieving applications: {1}".format(apps_response.status_code, msg))
             self.failed.emit(apps_response.status_code, msg)
         else:
-            apps_list = apps_response.getObjectOfType(TelepatApplication)
+            with self.timed("decode"):
+                apps_list = apps_response.getObjectOfType(TelepatApplication)
             self.log.emit("Successfully retrieved {0} applications".format(len(apps_list)))
             self.success.emit(apps_list)
             
@@ -168,8 +283,9 @@ class ContextPatchWorker(BaseWorker):
     def run(self):
         telepat = QtCore.QCoreApplication.instance().telepat_instance
         try:
-            update_response = telepat.update_context(self.context)
-        except ConnectionError as e:
+            with self.timed("network"):
+                update_response = telepat.update_context(self.context)
+        except RequestException as e:
             self.connection_error(e)
             return
         if not update_response.status == 200:
@@ -181,38 +297,134 @@ class ContextPatchWorker(BaseWorker):
 
 
 class ObjectPatchWorker(BaseWorker):
-    success = QtCore.pyqtSignal(TelepatResponse)
+    success = QtCore.pyqtSignal(int, int)
     failed = QtCore.pyqtSignal(int, str)
+    progress = QtCore.pyqtSignal(int, int)
+    object_failed = QtCore.pyqtSignal(str, int, str)
+
+    def __init__(self, parent, channel, changes, max_workers=None):
+        # changes is a list of (original_object, updated_object) pairs
+        super(ObjectPatchWorker, self).__init__(parent)
+        self.channel = channel
+        self.changes = changes
+        self.max_workers = max_workers or tmsettings.value("objectPatchParallelism", DEFAULT_PATCH_PARALLELISM, type=int)
 
-    def __init__(self, parent):
-        pass
+    def patch_object(self, updated_object):
+        if self.cancelled:
+            return False, None
+        with self.timed("network"):
+            return True, self.channel.patch(updated_object)
+
+    def run(self):
+        # Objects without changes are not sent at all
+        changes = [(original, updated) for original, updated in self.changes
+                   if original.patch_against(TelepatBaseObject(updated.to_json()))]
+        total = len(changes)
+        patched = 0
+        failures = 0
+        if not total:
+            self.log.emit("Nothing to patch")
+            self.success.emit(0, 0)
+            return
+
+        # Several patches are kept in flight on the channel at once
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            futures = {executor.submit(self.patch_object, updated): updated for original, updated in changes}
+            for done, future in enumerate(as_completed(futures), 1):
+                updated = futures[future]
+                try:
+                    sent, response = future.result()
+                    if not sent:  # Cancelled before it was sent
+                        continue
+                    status, message = response.status, response.message
+                except RequestException as e:
+                    status, message = errors.TELEPAT_CONNECTION_ERROR, "Connection error: {0}".format(e)
+                except Exception as e:
+                    # A TelepatError or a bad response fails this object only
+                    status, message = errors.TELEPAT_GENERAL_ERROR, str(e)
+
+                if status == 200:
+                    patched += 1
+                else:
+                    failures += 1
+                    self.log.emit("Error {0} while patching object {1}: {2}".format(status, updated.id, message))
+                    self.object_failed.emit(updated.id, status, message or "")
+                self.progress.emit(done, total)
+
+        self.log.emit("Patched {0} of {1} objects in {2}".format(patched, total, self.channel.subscription_identifier()))
+        if failures and not patched:
+            self.failed.emit(errors.TELEPAT_GENERAL_ERROR, "Failed to patch {0} objects".format(failures))
+        else:
+            self.success.emit(patched, failures)
 
 
 class SubscribeWorker(BaseWorker):
     success = QtCore.pyqtSignal(TelepatChannel, list)
     failed = QtCore.pyqtSignal(int, str)
-
-    def __init__(self, parent, context, model_name, object_type):
+    subscribed = QtCore.pyqtSignal(TelepatChannel, int)
+    page = QtCore.pyqtSignal(list)
+    # Total number of snapshot objects and one page of them
+    snapshot = QtCore.pyqtSignal(int, list)
+    size = QtCore.pyqtSignal(int)
+    result_signals = ("success", "failed", "subscribed", "page", "snapshot", "size")
+
+    def __init__(self, parent, context, model_name, object_type, page_size=None, measure=False):
+        # With a page_size, objects are handed out through subscribed()
+        # and then one page() per chunk instead of a single success().
+        # With measure, the response size is emitted before them.
         super(SubscribeWorker, self).__init__(parent)
         self.context = context
         self.model_name = model_name
         self.object_type = object_type
+        self.page_size = page_size
+        self.measure = measure
 
     def run(self):
         telepat = QtCore.QCoreApplication.instance().telepat_instance
         channel = None
         subscribe_response = None
+        key = cache.objects_key(self.context.id, self.model_name)
+        snapshot = snapshots.load_pages(key, self.page_size or 0)
+        if snapshot is not None:
+            total, pages = snapshot
+            # Only the first page has to be decoded before rows show up
+            for page in pages:
+                if self.cancelled:
+                    return
+                self.snapshot.emit(total, [self.object_type(obj) for obj in page])
+            self.log.emit("Loaded {0} {1} objects from the local snapshot".format(total, self.model_name))
         try:
-            channel, subscribe_response = telepat.subscribe(self.context, self.model_name, self.object_type)
-        except ConnectionError as e:
+            with self.timed("network"):
+                channel, subscribe_response = telepat.subscribe(self.context, self.model_name, self.object_type)
+        except RequestException as e:
             self.connection_error(e)
             return
         if not subscribe_response.status == 200:
             self.log.emit("Error {0} while subscribing to {1}".format(subscribe_response.status, self.model_name))
             self.failed.emit(subscribe_response.status, subscribe_response.message)
+        elif self.cancelled:
+            # Nobody is waiting for this channel anymore
+            self.log.emit("Dropping superseded subscription to {0}".format(channel.subscription_identifier()))
+            try:
+                telepat.remove_subscription(channel)
+            except RequestException as e:
+                self.log.emit("Connection error: {0}".format(str(e)))
         else:
             self.log.emit("Successfully subscribed to {0}".format(channel.subscription_identifier()))
-            self.success.emit(channel, subscribe_response.getObjectOfType(TelepatBaseObject))
+            if self.measure:
+                self.size.emit(response_size(subscribe_response))
+            with self.timed("decode"):
+                objects = subscribe_response.getObjectOfType(TelepatBaseObject)
+            objects = objects if isinstance(objects, list) else [objects]
+            if not self.page_size:
+                self.success.emit(channel, objects)
+            else:
+                self.subscribed.emit(channel, len(objects))
+                for start in range(0, len(objects), self.page_size):
+                    if self.cancelled:
+                        return
+                    self.page.emit(objects[start:start + self.page_size])
+            snapshots.save(key, objects)
 
 
 
@@ -228,8 +440,9 @@ class UnsubscribeWorker(BaseWorker):
         telepat = QtCore.QCoreApplication.instance().telepat_instance
         unsubscribe_response = None
         try:
-            unsubscribe_response = telepat.remove_subscription(self.channel)
-        except ConnectionError as e:
+            with self.timed("network"):
+                unsubscribe_response = telepat.remove_subscription(self.channel)
+        except RequestException as e:
             self.connection_error(e)
             return
         if not unsubscribe_response.status == 200: